@@ -0,0 +1,114 @@
+import re
+import threading
+from collections import Counter
+from email.utils import parseaddr
+
+# Lines carrying amounts or dates are never dropped as boilerplate
+VALUE_RE = re.compile(
+    r"[$€£¥]\s?\d|\d[\d,]*\.\d{2}\b|\b(?:USD|EUR|GBP|CAD|INR)\b"
+    r"|\b\d{1,2}[/-]\d{1,2}(?:[/-]\d{2,4})?\b|\b\d{4}-\d{2}-\d{2}\b"
+    r"|\b(?:jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)[a-z]*\.?\s+\d{1,2}\b",
+    re.IGNORECASE
+)
+# Together with VALUE_RE, these mark the lines the token budget is centred on
+KEYWORD_RE = re.compile(r"\b(?:merchant|amount|purchase|transaction|charged?|spent|paid|payment|ending)\b", re.IGNORECASE)
+SPACE_RE = re.compile(r"[ \t\u00a0\u200b\u200c\u200d\ufeff]+")
+
+
+class BodyCompactor:
+    """
+    Shrink email bodies before they are sent to the model.
+
+    - Collapses whitespace and drops empty lines.
+    - Drops boilerplate learned per sender: long lines that appeared in at least `min_repeats` of that sender's
+      previous emails (legal footers, unsubscribe and privacy notices), unless they carry amounts, dates or
+      transaction keywords, or one of the sender's `account_numbers` from `transaction_rules.yaml` (the card line
+      "Your card ending in 1234 was used." repeats in every alert but is what identifies the account).
+    - Keeps the body within `max_tokens` (estimated at 4 characters per token), preferring the lines closest to
+      the amount, date and merchant lines.
+
+    Boilerplate is learned in memory while syncing, so it only kicks in once a sender has sent a few emails.
+    """
+
+    def __init__(self, max_tokens=1000, min_repeats=3, min_line_length=30, max_lines_per_sender=5000, transaction_filters=None):
+        self.max_tokens = max_tokens
+        self.min_repeats = min_repeats
+        self.min_line_length = min_line_length
+        self.max_lines_per_sender = max_lines_per_sender
+        self.line_counts = {}
+        self.lock = threading.Lock()
+        self.account_numbers = {}
+        for details in (transaction_filters or {}).get("credit_cards", {}).values():
+            for from_address in details.get("from_address", []):
+                account_numbers = self.account_numbers.setdefault(from_address.lower(), set())
+                account_numbers.update(str(n) for n in details.get("account_numbers", []))
+
+    @staticmethod
+    def estimate_tokens(text: str) -> int:
+        return (len(text) + 3) // 4
+
+    @staticmethod
+    def normalize_lines(body: str) -> list:
+        """
+        Split a body into lines with collapsed whitespace, leaving out empty lines.
+        """
+        lines = (SPACE_RE.sub(" ", line).strip() for line in body.splitlines())
+        return [line for line in lines if line]
+
+    def learn(self, sender: str, lines: list) -> Counter:
+        """
+        Count each distinct line once for this email and return how many of the sender's emails had each line.
+        """
+        with self.lock:
+            counts = self.line_counts.setdefault(sender, Counter())
+            counts.update(set(line for line in lines if len(line) >= self.min_line_length))
+            if len(counts) > self.max_lines_per_sender:
+                # Forget lines seen only once, they are not boilerplate yet
+                for line in [line for line, count in counts.items() if count < 2]:
+                    del counts[line]
+            return Counter({line: counts[line] for line in lines if line in counts})
+
+    def fit_budget(self, lines: list) -> list:
+        """
+        Keep the lines nearest to key lines (in original order) until the token budget is spent.
+        """
+        if not self.max_tokens or self.estimate_tokens("\n".join(lines)) <= self.max_tokens:
+            return lines
+
+        anchors = [i for i, line in enumerate(lines) if VALUE_RE.search(line) or KEYWORD_RE.search(line)] or [0]
+        distance = lambda i: min(abs(i - anchor) for anchor in anchors)
+        kept, used = set(), 0
+        for i in sorted(range(len(lines)), key=lambda i: (distance(i), i)):
+            cost = self.estimate_tokens(lines[i]) + 1
+            if used + cost > self.max_tokens:
+                continue
+            kept.add(i)
+            used += cost
+        return [line for i, line in enumerate(lines) if i in kept]
+
+    def is_key_line(self, sender: str, line: str) -> bool:
+        """
+        Whether a line may carry transaction details (amount, date, keyword or account number of the sender).
+        """
+        return bool(VALUE_RE.search(line) or KEYWORD_RE.search(line)
+                    or any(re.search(rf"(?<!\d){re.escape(n)}(?!\d)", line) for n in self.account_numbers.get(sender, ())))
+
+    def compact(self, from_address: str, body: str) -> str:
+        """
+        Compact an email body for prompting.
+
+        Args:
+            from_address (str): Sender of the email; boilerplate is learned per sender address.
+            body (str): Plain text body.
+
+        Returns:
+            str: The compacted body.
+        """
+        lines = self.normalize_lines(body or "")
+        sender = parseaddr(from_address or "")[1].lower()
+        counts = self.learn(sender, lines)
+        lines = [
+            line for line in lines
+            if counts[line] <= self.min_repeats or self.is_key_line(sender, line)
+        ]
+        return "\n".join(self.fit_budget(lines))
@@ -1,103 +1,250 @@
+import json
+import time
+import hashlib
 import duckdb
+import threading
+from email.utils import parseaddr
+
+# Schema migrations, applied in order by `DB.migrate`; the schema version is the number of migrations applied.
+# Append new migrations, never edit applied ones.
+MIGRATIONS = [
+    # 1: initial schema (IF NOT EXISTS, for databases created before versioning)
+    [
+        "CREATE SEQUENCE IF NOT EXISTS seq_account_id START WITH 1 INCREMENT BY 1;",
+        "CREATE SEQUENCE IF NOT EXISTS seq_transaction_id START WITH 1 INCREMENT BY 1;",
+        """
+        CREATE TABLE IF NOT EXISTS dim_accounts (
+            load_time TIMESTAMP DEFAULT(CURRENT_TIMESTAMP),
+            load_by VARCHAR,
+            account_id INTEGER PRIMARY KEY DEFAULT nextval('seq_account_id'),
+            account_number VARCHAR,
+            financial_institution VARCHAR,
+            account_name VARCHAR,
+            account_owner VARCHAR,
+            active BOOLEAN,
+            comments VARCHAR
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS fact_transactions (
+            load_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            load_by STRING,
+            transaction_id INTEGER PRIMARY KEY DEFAULT nextval('seq_transaction_id'),
+            transaction_date TIMESTAMP,
+            transaction_amount FLOAT,
+            merchant STRING,
+            category STRING,
+            account_id INTEGER REFERENCES dim_accounts(account_id),
+            expense_owner STRING,
+            from_address STRING,
+            to_address STRING,
+            email_uid STRING,
+            email_date TIMESTAMP,
+            llm_reasoning STRING
+        );
+        """,
+        "CREATE SEQUENCE IF NOT EXISTS seq_email_checkpoint_id START WITH 1 INCREMENT BY 1;",
+        """
+        CREATE TABLE IF NOT EXISTS email_checkpoints (
+            id BIGINT PRIMARY KEY DEFAULT nextval('seq_email_checkpoint_id'),
+            folder VARCHAR NOT NULL,
+            last_seen_uid INTEGER,
+            UNIQUE(folder)
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS llm_cache (
+            cache_key VARCHAR PRIMARY KEY,
+            model VARCHAR,
+            llm_response STRING,
+            llm_reasoning STRING,
+            llm_prediction STRING,
+            generation_seconds DOUBLE,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            last_hit_at TIMESTAMP,
+            hits INTEGER DEFAULT 0
+        );
+        """,
+    ],
+    # 2: accounts are unique by institution and number, for the set-based upsert
+    [
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_dim_accounts_key ON dim_accounts (financial_institution, account_number);",
+    ],
+    # 3: transactions are unique by email identity, so replays and checkpoint resets insert nothing twice
+    [
+        "ALTER TABLE fact_transactions ADD COLUMN email_folder VARCHAR;",
+        "ALTER TABLE fact_transactions ADD COLUMN email_uidvalidity BIGINT;",
+        "ALTER TABLE fact_transactions ADD COLUMN email_content_hash VARCHAR;",
+        """
+        CREATE UNIQUE INDEX idx_fact_transactions_email
+        ON fact_transactions (email_folder, email_uidvalidity, email_uid, email_content_hash);
+        """,
+    ],
+    # 4: checkpoints remember the folder's UIDVALIDITY and HIGHESTMODSEQ; transactions their Message-ID, to
+    # recognize stored emails after a UIDVALIDITY change
+    [
+        "ALTER TABLE email_checkpoints ADD COLUMN uidvalidity BIGINT;",
+        "ALTER TABLE email_checkpoints ADD COLUMN highestmodseq BIGINT;",
+        "ALTER TABLE fact_transactions ADD COLUMN email_message_id VARCHAR;",
+    ],
+    # 5: spend rollups by day and month, account and merchant, filled from the existing transactions
+    [
+        f"""
+        CREATE TABLE {table} (
+            period_start DATE NOT NULL,
+            account_id INTEGER NOT NULL,
+            merchant VARCHAR NOT NULL,
+            transaction_count BIGINT NOT NULL,
+            total_amount DOUBLE NOT NULL,
+            PRIMARY KEY (period_start, account_id, merchant)
+        );
+        """
+        for table in ("rollup_daily_spend", "rollup_monthly_spend")
+    ] + [
+        f"""
+        INSERT INTO {table} (period_start, account_id, merchant, transaction_count, total_amount)
+        SELECT {period} AS period_start, account_id, COALESCE(merchant, ''), COUNT(*), SUM(CAST(transaction_amount AS DOUBLE))
+        FROM fact_transactions
+        WHERE transaction_date IS NOT NULL AND account_id IS NOT NULL
+        GROUP BY ALL;
+        """
+        for table, period in (("rollup_daily_spend", "CAST(transaction_date AS DATE)"),
+                              ("rollup_monthly_spend", "CAST(date_trunc('month', transaction_date) AS DATE)"))
+    ],
+]
+
+# Rollup table and period expression per grain, see `DB.update_rollups`
+ROLLUPS = {
+    "day": ("rollup_daily_spend", "CAST(transaction_date AS DATE)"),
+    "month": ("rollup_monthly_spend", "CAST(date_trunc('month', transaction_date) AS DATE)"),
+}
+
 
 class DB:
     """
     Database handler for DuckDB, supporting account bootstrapping, transaction logging, and email checkpointing.
     """
 
-    def __init__(self, db_name):
+    def __init__(self, db_name, write_batch_size=1, write_interval=5.0):
         self.db_name = db_name
         self.con = duckdb.connect(self.db_name)
+        self.local = threading.local()
+        # Transactions and checkpoints are buffered and written together by `flush` every `write_batch_size`
+        # writes or `write_interval` seconds; 1 writes each one immediately
+        self.write_batch_size = write_batch_size
+        self.write_interval = write_interval
+        self.pending_transactions = []
+        # Identity key (see `save_transaction`) to the row replacing the stored one, or None to remove it
+        self.pending_replacements = {}
+        self.pending_checkpoints = {}
+        self.pending_writes = 0
+        self.last_flush = time.monotonic()
+        self.write_lock = threading.RLock()
+
+    def cursor(self):
+        """
+        Connection for the calling thread, used by methods called from extraction threads (a DuckDB connection
+        must not be used from several threads at once).
+        """
+        if getattr(self.local, "con", None) is None:
+            self.local.con = self.con.cursor()
+        return self.local.con
 
     def bootstrap(self, accounts=None):
         """
-        Bootstrap the database by creating necessary sequences and tables, and optionally insert/update accounts.
+        Bootstrap the database by applying the pending schema migrations (see `MIGRATIONS`), and optionally
+        insert/update accounts.
 
-        This method sets up:
+        The schema sets up:
         - `seq_account_id` for unique account IDs.
         - `seq_transaction_id` for unique transaction IDs.
-        - `dim_accounts` table to store account details.
+        - `dim_accounts` table to store account details, unique by financial_institution and account_number.
         - `fact_transactions` table to store transaction details.
         - `email_checkpoints` table to store the last seen email UID for checkpointing (replaces external file).
+        - `llm_cache` table to store model outputs, so the same email is never sent to the model twice.
+        - `rollup_daily_spend` and `rollup_monthly_spend` tables with the transaction count and total amount per
+          period, account and merchant, kept up to date by `flush` (see `get_spend`).
 
-        If `accounts` is provided, each account dict is inserted into `dim_accounts` if it does not already exist (by financial_institution and account_number).
+        The applied version is kept in `schema_version`, so an up-to-date database runs no DDL at all.
+
+        If `accounts` is provided, they are upserted into `dim_accounts` with one statement: new accounts are
+        inserted, and the name, owner and comments of existing ones (by financial_institution and
+        account_number) are updated when they changed.
 
         Args:
             accounts (list[dict], optional): List of account dicts to insert. Each dict should have at least
                 'account_number' and 'financial_institution'.
         """
-        
-        self.con.execute("CREATE SEQUENCE IF NOT EXISTS seq_account_id START WITH 1 INCREMENT BY 1;")
-        self.con.execute("CREATE SEQUENCE IF NOT EXISTS seq_transaction_id START WITH 1 INCREMENT BY 1;")
-        
-        self.con.execute("""
-            CREATE TABLE IF NOT EXISTS dim_accounts (
-                load_time TIMESTAMP DEFAULT(CURRENT_TIMESTAMP),
-                load_by VARCHAR,
-                account_id INTEGER PRIMARY KEY DEFAULT nextval('seq_account_id'),
-                account_number VARCHAR,
-                financial_institution VARCHAR,
-                account_name VARCHAR,
-                account_owner VARCHAR,
-                active BOOLEAN,
-                comments VARCHAR
-            );
-        """)
-
-        # Insert accounts if provided
+        self.migrate()
         if accounts:
-            for acc in accounts:
-                # Only insert if not already present
-                exists = self.con.execute(
-                    "SELECT 1 FROM dim_accounts WHERE financial_institution=? AND account_number=?",
-                    (acc['financial_institution'], acc['account_number'])
-                ).fetchone()
-                if not exists:
-                    self.con.execute(
-                        """
-                        INSERT INTO dim_accounts (
-                            load_by, account_number, financial_institution, account_name, account_owner, active, comments
-                        ) VALUES (?, ?, ?, ?, ?, ?, ?)
-                        """,
-                        (
-                            'agent',
-                            acc['account_number'],
-                            acc['financial_institution'],
-                            acc.get('account_name', ''),
-                            acc.get('account_owner', ''),
-                            True,
-                            acc.get('comments', '')
-                        )
-                    )
+            self.upsert_accounts(accounts)
 
-        self.con.execute("""
-            CREATE TABLE IF NOT EXISTS fact_transactions (
-                load_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                load_by STRING,
-                transaction_id INTEGER PRIMARY KEY DEFAULT nextval('seq_transaction_id'),
-                transaction_date TIMESTAMP,
-                transaction_amount FLOAT,
-                merchant STRING,
-                category STRING,
-                account_id INTEGER REFERENCES dim_accounts(account_id),
-                expense_owner STRING,
-                from_address STRING,
-                to_address STRING,
-                email_uid STRING,
-                email_date TIMESTAMP,
-                llm_reasoning STRING
-            );
-        """)
+    def schema_version(self) -> int:
+        """
+        Version of the database schema, 0 for a new database or one created before versioning.
+        """
+        try:
+            return self.con.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version").fetchone()[0]
+        except duckdb.CatalogException:
+            return 0
 
-        self.con.execute("CREATE SEQUENCE IF NOT EXISTS seq_email_checkpoint_id START WITH 1 INCREMENT BY 1;")
+    def migrate(self):
+        """
+        Apply the migrations newer than the database's schema version, each in its own database transaction.
+        """
+        version = self.schema_version()
+        if version >= len(MIGRATIONS):
+            return
         self.con.execute("""
-            CREATE TABLE IF NOT EXISTS email_checkpoints (
-                id BIGINT PRIMARY KEY DEFAULT nextval('seq_email_checkpoint_id'),
-                folder VARCHAR NOT NULL,
-                last_seen_uid INTEGER,
-                UNIQUE(folder)
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INTEGER PRIMARY KEY,
+                applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
             );
         """)
+        for version, statements in enumerate(MIGRATIONS[version:], start=version + 1):
+            self.con.execute("BEGIN TRANSACTION")
+            try:
+                for statement in statements:
+                    self.con.execute(statement)
+                self.con.execute("INSERT INTO schema_version (version) VALUES (?)", (version,))
+                self.con.execute("COMMIT")
+            except Exception:
+                self.con.execute("ROLLBACK")
+                raise
+
+    def upsert_accounts(self, accounts):
+        """
+        Insert new accounts and update the details of existing ones, in one statement.
+
+        Args:
+            accounts (list[dict]): Account dicts with 'account_number' and 'financial_institution', and optionally
+                'account_name', 'account_owner' and 'comments'.
+        """
+        # A key listed twice would make the statement update the same row twice
+        rows = {
+            (acc['financial_institution'], str(acc['account_number'])): (
+                'agent',
+                str(acc['account_number']),
+                acc['financial_institution'],
+                acc.get('account_name', ''),
+                acc.get('account_owner', ''),
+                True,
+                acc.get('comments', '')
+            )
+            for acc in accounts
+        }
+        self.con.execute(f"""
+            INSERT INTO dim_accounts (
+                load_by, account_number, financial_institution, account_name, account_owner, active, comments
+            ) VALUES {", ".join(["(?, ?, ?, ?, ?, ?, ?)"] * len(rows))}
+            ON CONFLICT (financial_institution, account_number) DO UPDATE SET
+                account_name = excluded.account_name,
+                account_owner = excluded.account_owner,
+                comments = excluded.comments
+            WHERE dim_accounts.account_name IS DISTINCT FROM excluded.account_name
+                OR dim_accounts.account_owner IS DISTINCT FROM excluded.account_owner
+                OR dim_accounts.comments IS DISTINCT FROM excluded.comments
+        """, [value for row in rows.values() for value in row])
 
     def get_last_seen_uid(self, folder):
         """
@@ -109,21 +256,319 @@ class DB:
         Returns:
             int or None: The last seen UID, or None if not set.
         """
-        row = self.con.execute("SELECT last_seen_uid FROM email_checkpoints WHERE folder=?", (folder,)).fetchone()
-        return row[0] if row else None
+        checkpoint = self.get_checkpoint(folder)
+        return checkpoint["last_seen_uid"] if checkpoint else None
 
-    def set_last_seen_uid(self, folder, uid):
+    def get_checkpoint(self, folder):
+        """
+        Retrieve the checkpoint of a folder.
+
+        Args:
+            folder (str): The email folder name.
+
+        Returns:
+            dict or None: 'last_seen_uid', and the 'uidvalidity' and 'highestmodseq' it was taken with (None when
+            unknown), or None if not set.
+        """
+        with self.write_lock:
+            if folder in self.pending_checkpoints:
+                return dict(zip(("last_seen_uid", "uidvalidity", "highestmodseq"), self.pending_checkpoints[folder]))
+        row = self.con.execute(
+            "SELECT last_seen_uid, uidvalidity, highestmodseq FROM email_checkpoints WHERE folder=?", (folder,)
+        ).fetchone()
+        return dict(zip(("last_seen_uid", "uidvalidity", "highestmodseq"), row)) if row else None
+
+    def set_last_seen_uid(self, folder, uid, uidvalidity=None, highestmodseq=None):
         """
         Update or insert the last seen email UID for a specific folder in the email_checkpoints table.
 
+        The checkpoint is written with the transactions buffered before it (see `flush`).
+
         Args:
             folder (str): The email folder name.
             uid (int): The UID to store as the checkpoint.
+            uidvalidity (int, optional): UIDVALIDITY of the folder the UID belongs to.
+            highestmodseq (int, optional): HIGHESTMODSEQ of the folder, only once all of it has been synced.
         """
-        if self.con.execute("SELECT 1 FROM email_checkpoints WHERE folder=?", (folder,)).fetchone():
-            self.con.execute("UPDATE email_checkpoints SET last_seen_uid=? WHERE folder=?", (uid, folder))
-        else:
-            self.con.execute("INSERT INTO email_checkpoints (folder, last_seen_uid) VALUES (?, ?)", (folder, uid))
+        with self.write_lock:
+            self.pending_checkpoints[folder] = (uid, uidvalidity, highestmodseq)
+            self.pending_writes += 1
+        self.flush_if_due()
+
+    def flush_if_due(self):
+        """
+        Flush the buffered writes once there are `write_batch_size` of them or `write_interval` seconds have passed.
+        """
+        with self.write_lock:
+            if self.pending_writes >= self.write_batch_size or time.monotonic() - self.last_flush >= self.write_interval:
+                self.flush()
+
+    def flush(self):
+        """
+        Write the buffered transactions and checkpoints in one database transaction, so a crash never leaves a
+        checkpoint ahead of its transactions (or transactions without their checkpoint). The transactions
+        actually inserted are added to the spend rollups in the same database transaction, and replaced or removed
+        ones (see `save_transaction` and `remove_transaction`) taken out of them.
+
+        If the write fails, it is rolled back and the buffer dropped: the checkpoints did not advance either, so
+        the emails are processed again on the next sync.
+        """
+        with self.write_lock:
+            transactions, replacements, checkpoints = self.pending_transactions, self.pending_replacements, self.pending_checkpoints
+            self.pending_transactions, self.pending_replacements, self.pending_checkpoints = [], {}, {}
+            self.pending_writes = 0
+            self.last_flush = time.monotonic()
+            if not transactions and not replacements and not checkpoints:
+                return
+            self.con.execute("BEGIN TRANSACTION")
+            try:
+                if transactions or replacements:
+                    # Transaction IDs only grow: the rows inserted below are the ones above the current maximum
+                    last_id = self.con.execute("SELECT COALESCE(MAX(transaction_id), 0) FROM fact_transactions").fetchone()[0]
+                if replacements:
+                    self.con.execute("""
+                        CREATE TEMP TABLE IF NOT EXISTS replaced_emails (
+                            email_folder VARCHAR, email_uidvalidity BIGINT, email_uid STRING, email_content_hash VARCHAR
+                        );
+                    """)
+                    self.con.execute("DELETE FROM replaced_emails")
+                    self.con.executemany("INSERT INTO replaced_emails VALUES (?, ?, ?, ?)", list(replacements))
+                    replaced = """EXISTS (
+                        SELECT 1 FROM replaced_emails r
+                        WHERE r.email_folder = fact_transactions.email_folder
+                            AND r.email_uidvalidity = fact_transactions.email_uidvalidity
+                            AND r.email_uid = fact_transactions.email_uid
+                            AND r.email_content_hash = fact_transactions.email_content_hash
+                    )"""
+                    # Take the stored rows out of the rollups, then remove or overwrite them and add them back
+                    self.update_rollups(replaced, sign=-1)
+                    removed = [identity for identity, row in replacements.items() if row is None]
+                    if removed:
+                        self.con.executemany("""
+                            DELETE FROM fact_transactions
+                            WHERE email_folder = ? AND email_uidvalidity = ? AND email_uid = ? AND email_content_hash = ?
+                        """, removed)
+                    rows = [row for row in replacements.values() if row is not None]
+                    if rows:
+                        self.con.executemany("""
+                            INSERT INTO fact_transactions (
+                                load_by, transaction_date, transaction_amount, merchant, account_id, from_address,
+                                to_address, email_uid, email_date, llm_reasoning, email_folder, email_uidvalidity,
+                                email_content_hash, email_message_id
+                            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                            ON CONFLICT (email_folder, email_uidvalidity, email_uid, email_content_hash) DO UPDATE SET
+                                load_time = excluded.load_time,
+                                transaction_date = excluded.transaction_date,
+                                transaction_amount = excluded.transaction_amount,
+                                merchant = excluded.merchant,
+                                account_id = excluded.account_id,
+                                llm_reasoning = excluded.llm_reasoning
+                        """, rows)
+                    self.update_rollups(f"transaction_id <= ? AND {replaced}", (last_id,))
+                if transactions:
+                    self.con.executemany("""
+                        INSERT INTO fact_transactions (
+                            load_by, transaction_date, transaction_amount, merchant, account_id, from_address,
+                            to_address, email_uid, email_date, llm_reasoning, email_folder, email_uidvalidity,
+                            email_content_hash, email_message_id
+                        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                        ON CONFLICT DO NOTHING
+                    """, transactions)
+                if transactions or replacements:
+                    self.update_rollups("transaction_id > ?", (last_id,))
+                if checkpoints:
+                    self.con.executemany("""
+                        INSERT INTO email_checkpoints (folder, last_seen_uid, uidvalidity, highestmodseq)
+                        VALUES (?, ?, ?, ?)
+                        ON CONFLICT (folder) DO UPDATE SET
+                            last_seen_uid = excluded.last_seen_uid,
+                            uidvalidity = excluded.uidvalidity,
+                            highestmodseq = excluded.highestmodseq
+                    """, [(folder, *checkpoint) for folder, checkpoint in checkpoints.items()])
+                self.con.execute("COMMIT")
+            except Exception:
+                self.con.execute("ROLLBACK")
+                raise
+
+    def update_rollups(self, where="TRUE", params=(), sign=1):
+        """
+        Add the transactions matching `where` to the spend rollups of every grain (or, with `sign` -1, take them out).
+
+        Args:
+            where (str): SQL condition on fact_transactions selecting the transactions to add.
+            params (tuple): Parameters of `where`.
+            sign (int): 1 to add the transactions, -1 to subtract them.
+        """
+        for table, period in ROLLUPS.values():
+            self.con.execute(f"""
+                INSERT INTO {table} (period_start, account_id, merchant, transaction_count, total_amount)
+                SELECT {period} AS period_start, account_id, COALESCE(merchant, ''),
+                    {sign} * COUNT(*), {sign} * SUM(CAST(transaction_amount AS DOUBLE))
+                FROM fact_transactions
+                WHERE transaction_date IS NOT NULL AND account_id IS NOT NULL AND ({where})
+                GROUP BY ALL
+                ON CONFLICT (period_start, account_id, merchant) DO UPDATE SET
+                    transaction_count = {table}.transaction_count + excluded.transaction_count,
+                    total_amount = {table}.total_amount + excluded.total_amount
+            """, params)
+            if sign < 0:
+                self.con.execute(f"DELETE FROM {table} WHERE transaction_count <= 0")
+
+    def rebuild_rollups(self):
+        """
+        Recompute the spend rollups from fact_transactions, after transactions were corrected or deleted by hand.
+        """
+        with self.write_lock:
+            self.flush()
+            self.con.execute("BEGIN TRANSACTION")
+            try:
+                for table, _ in ROLLUPS.values():
+                    self.con.execute(f"DELETE FROM {table}")
+                self.update_rollups()
+                self.con.execute("COMMIT")
+            except Exception:
+                self.con.execute("ROLLBACK")
+                raise
+
+    def get_spend(self, grain="month", by=(), start=None, end=None) -> list:
+        """
+        Read spend totals per period from the rollups, e.g. monthly by account, monthly by merchant or daily totals.
+
+        Args:
+            grain (str): "day" or "month".
+            by (list[str]): Also group by "account" and/or "merchant".
+            start (str or date, optional): First day included (the month containing it, for months).
+            end (str or date, optional): Last day included.
+
+        Returns:
+            list[dict]: Rows ordered by period: 'period_start', 'financial_institution' and 'account_number' when
+            grouped by account, 'merchant' when grouped by merchant, 'transaction_count' and 'total_amount'.
+        """
+        if grain not in ROLLUPS:
+            raise ValueError(f"Unknown grain {grain!r}, expected one of {', '.join(ROLLUPS)}")
+        unknown = set(by) - {"account", "merchant"}
+        if unknown:
+            raise ValueError(f"Cannot group by {', '.join(sorted(unknown))}, expected account or merchant")
+
+        columns = ["r.period_start"]
+        if "account" in by:
+            columns += ["a.financial_institution", "a.account_number"]
+        if "merchant" in by:
+            columns.append("r.merchant")
+        conditions, params = [], []
+        if start is not None:
+            # A month starting before `start` is included when `start` falls in it
+            conditions.append("r.period_start >= CAST(date_trunc('month', CAST(? AS DATE)) AS DATE)" if grain == "month"
+                              else "r.period_start >= CAST(? AS DATE)")
+            params.append(str(start))
+        if end is not None:
+            conditions.append("r.period_start <= CAST(? AS DATE)")
+            params.append(str(end))
+        cursor = self.cursor().execute(f"""
+            SELECT {", ".join(columns)}, SUM(r.transaction_count) AS transaction_count, SUM(r.total_amount) AS total_amount
+            FROM {ROLLUPS[grain][0]} r JOIN dim_accounts a USING (account_id)
+            {"WHERE " + " AND ".join(conditions) if conditions else ""}
+            GROUP BY {", ".join(columns)}
+            ORDER BY {", ".join(columns)}
+        """, params)
+        names = [d[0] for d in cursor.description]
+        return [dict(zip(names, row)) for row in cursor.fetchall()]
+
+    def get_cached_prediction(self, cache_key):
+        """
+        Look up a cached model output and record the hit.
+
+        Args:
+            cache_key (str): Key computed by `TransactionHandler.cache_key`.
+
+        Returns:
+            tuple or None: (llm_reasoning, llm_prediction dict), or None on a cache miss.
+        """
+        con = self.cursor()
+        row = con.execute("SELECT llm_reasoning, llm_prediction FROM llm_cache WHERE cache_key=?", (cache_key,)).fetchone()
+        if row is None:
+            return None
+        try:
+            con.execute("UPDATE llm_cache SET last_hit_at=CURRENT_TIMESTAMP, hits=hits + 1 WHERE cache_key=?", (cache_key,))
+        except duckdb.TransactionException:
+            # The same email looked up concurrently (e.g. found in two folders): the hit bookkeeping is best-effort
+            pass
+        return row[0], json.loads(row[1])
+
+    def cache_prediction(self, cache_key, model, llm_response, llm_reasoning, llm_prediction, generation_seconds):
+        """
+        Store a model output in the llm_cache table, replacing any previous entry for the key.
+
+        Args:
+            cache_key (str): Key computed by `TransactionHandler.cache_key`.
+            model (str): Model that produced the output.
+            llm_response (str): Raw model response.
+            llm_reasoning (str): Reasoning parsed from the response.
+            llm_prediction (dict): Prediction parsed from the response.
+            generation_seconds (float): Time the model took to respond.
+        """
+        try:
+            self.cursor().execute("""
+                INSERT OR REPLACE INTO llm_cache (cache_key, model, llm_response, llm_reasoning, llm_prediction, generation_seconds)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, (cache_key, model, llm_response, llm_reasoning, json.dumps(llm_prediction, default=str), generation_seconds))
+        except duckdb.TransactionException:
+            # The same email extracted concurrently (e.g. found in two folders) is already being cached
+            pass
+
+    def evict_llm_cache(self, max_entries=None, max_age_days=None) -> int:
+        """
+        Delete cache entries not used for more than `max_age_days`, then the least recently used entries
+        beyond `max_entries`.
+
+        Args:
+            max_entries (int, optional): Maximum number of entries to keep.
+            max_age_days (int, optional): Maximum age in days since an entry was created or last hit.
+
+        Returns:
+            int: The number of entries deleted.
+        """
+        before = self.con.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+        if max_age_days:
+            self.con.execute(
+                "DELETE FROM llm_cache WHERE COALESCE(last_hit_at, created_at) < CURRENT_TIMESTAMP - to_days(CAST(? AS INTEGER))",
+                (max_age_days,)
+            )
+        if max_entries:
+            self.con.execute("""
+                DELETE FROM llm_cache WHERE cache_key IN (
+                    SELECT cache_key FROM llm_cache
+                    ORDER BY COALESCE(last_hit_at, created_at) DESC
+                    OFFSET ?
+                )
+            """, (max_entries,))
+        return before - self.con.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+
+    @staticmethod
+    def email_content_hash(e_mail) -> str:
+        """
+        SHA-256 of an email's sender address, date, subject and body, telling apart different emails that were
+        given the same UID.
+        """
+        content = json.dumps([parseaddr(e_mail.get('from_address') or '')[1]] +
+                             [e_mail.get(k) for k in ('email_date', 'subject', 'body')], default=str)
+        return hashlib.sha256(content.encode()).hexdigest()
+
+    def get_stored_email_ids(self, folder) -> set:
+        """
+        Message-IDs and content hashes (see `email_content_hash`) of the emails of a folder stored as transactions,
+        to recognize them after the folder's UIDs changed.
+
+        Args:
+            folder (str): The email folder name.
+
+        Returns:
+            set: The Message-IDs and content hashes.
+        """
+        rows = self.cursor().execute(
+            "SELECT email_message_id, email_content_hash FROM fact_transactions WHERE email_folder=?", (folder,)
+        ).fetchall()
+        return {value for row in rows for value in row if value}
 
     def get_account_ids_dict(self) -> dict:
         """
@@ -136,41 +581,46 @@ class DB:
         rows = self.con.execute("SELECT financial_institution, account_number, account_id FROM dim_accounts").fetchall()
         return { (row[0], row[1]): row[2] for row in rows }
 
-    def save_transaction(self, e_mail, llm_reasoning, llm_prediction, account_id):
+    @classmethod
+    def email_identity(cls, e_mail) -> tuple:
+        """
+        Identity of an email's transaction: folder, UIDVALIDITY, UID and content hash (see `email_content_hash`).
+        """
+        # Servers that report no UIDVALIDITY never change it either
+        return e_mail.get('folder'), e_mail.get('uidvalidity') or 0, int(e_mail['uid']), cls.email_content_hash(e_mail)
+
+    def remove_transaction(self, e_mail):
+        """
+        Remove the transaction stored for an email, if any (e.g. reprocessing found it is not a transaction after
+        all), buffered like checkpoints (see `flush`).
+
+        Args:
+            e_mail (dict): Email details, as for `save_transaction`.
+        """
+        with self.write_lock:
+            self.pending_replacements[self.email_identity(e_mail)] = None
+            self.pending_writes += 1
+        self.flush_if_due()
+
+    def save_transaction(self, e_mail, llm_reasoning, llm_prediction, account_id, replace=False):
         """
-        Save a transaction to the database (fact_transactions).
+        Save a transaction to the database (fact_transactions), buffered like checkpoints (see `flush`).
+
+        Transactions are unique by email identity (see `email_identity`). Saving an email already stored does
+        nothing, so emails can be replayed freely, unless `replace` is set: the stored transaction is then
+        overwritten, so reprocessing with a new prompt or model corrects it. Emails without a 'folder' are not
+        deduplicated.
 
         Args:
-            e_mail (dict): Dictionary with email details ('from_address', 'to_address', 'uid', 'email_date').
+            e_mail (dict): Dictionary with email details ('from_address', 'to_address', 'uid', 'email_date', and
+                'folder' and 'uidvalidity' as set by `EmailHandler.iter_emails`).
             llm_reasoning (str): Reasoning provided by the language model for the transaction.
             llm_prediction (dict): Dict with predicted transaction details ('transaction_date', 'merchant', etc).
             account_id (int): The ID of the account associated with the transaction.
+            replace (bool, optional): Overwrite the transaction already stored for the email. Default: False.
         """
-        q = f"""INSERT INTO fact_transactions (
-                load_by,
-                transaction_date,
-                transaction_amount,
-                merchant,
-                account_id,
-                from_address,
-                to_address,
-                email_uid,
-                email_date,
-                llm_reasoning)
-                VALUES (
-                ?,
-                ?,
-                ?,
-                ?,
-                ?,
-                ?,
-                ?,
-                ?,
-                ?,
-                ?
-                )
-            """
-        self.con.execute(q, (
+        folder, uidvalidity, uid, content_hash = identity = self.email_identity(e_mail)
+        row = (
             'agent',
             llm_prediction['transaction_date'],
             llm_prediction['transaction_amount'],
@@ -178,7 +628,18 @@ class DB:
             account_id,
             e_mail['from_address'],
             e_mail['to_address'],
-            int(e_mail['uid']),
+            uid,
             e_mail['email_date'],
-            llm_reasoning
-        ))
+            llm_reasoning,
+            folder,
+            uidvalidity,
+            content_hash,
+            e_mail.get('message_id')
+        )
+        with self.write_lock:
+            if replace:
+                self.pending_replacements[identity] = row
+            else:
+                self.pending_transactions.append(row)
+            self.pending_writes += 1
+        self.flush_if_due()
@@ -1,18 +1,147 @@
+import re
+import time
+import select
 import imaplib
 import email
+import email.message
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
 from bs4 import BeautifulSoup
 from email.header import decode_header
-from email.utils import parsedate_to_datetime
+from email.utils import parseaddr, parsedate_to_datetime
+
+_OPEN = object()
+_CLOSE = object()
+_ATOM_DELIMITERS = frozenset(b' ()"\r\n\t')
+HEADER_FIELDS = "BODY.PEEK[HEADER.FIELDS (FROM TO SUBJECT DATE MESSAGE-ID)]"
+# lxml is much faster on the table-heavy HTML banks send, html.parser is the always available fallback
+try:
+    import lxml  # noqa: F401
+    HTML_PARSER = "lxml"
+except ImportError:
+    HTML_PARSER = "html.parser"
+# Inline styles used to hide preheaders and tracking content from readers
+HIDDEN_STYLE_RE = re.compile(
+    r"display\s*:\s*none|visibility\s*:\s*hidden|mso-hide\s*:\s*all|(?:max-height|font-size|opacity)\s*:\s*0(?:px)?\s*(?:;|!|$)",
+    re.IGNORECASE
+)
+BLOCK_TAGS = ["p", "div", "br", "tr", "li", "table", "h1", "h2", "h3", "h4", "h5", "h6"]
+# Errors meaning the IMAP connection is gone (or in an unusable state) and must be re-established
+CONNECTION_ERRORS = (imaplib.IMAP4.error, OSError)
+
+
+def _tokenize(data: bytes) -> list:
+    """
+    Split a chunk of an IMAP response into tokens.
+
+    Parentheses become the `_OPEN`/`_CLOSE` sentinels, quoted strings become bytes, `NIL` becomes None
+    and everything else (numbers, flags, item names such as `BODY[HEADER.FIELDS (FROM)]`) becomes a str.
+    """
+    tokens = []
+    i, n = 0, len(data)
+    while i < n:
+        c = data[i]
+        if c in b" \r\n\t":
+            i += 1
+        elif c == ord("("):
+            tokens.append(_OPEN)
+            i += 1
+        elif c == ord(")"):
+            tokens.append(_CLOSE)
+            i += 1
+        elif c == ord('"'):
+            buf = bytearray()
+            i += 1
+            while i < n and data[i] != ord('"'):
+                if data[i] == ord("\\"):
+                    i += 1
+                buf.append(data[i])
+                i += 1
+            tokens.append(bytes(buf))
+            i += 1
+        else:
+            start, depth = i, 0
+            while i < n:
+                if data[i] == ord("["):
+                    depth += 1
+                elif data[i] == ord("]"):
+                    depth -= 1
+                elif depth == 0 and data[i] in _ATOM_DELIMITERS:
+                    break
+                i += 1
+            atom = data[start:i].decode("ascii", errors="replace")
+            tokens.append(None if atom.upper() == "NIL" else atom)
+    return tokens
+
+
+def _call_safely(func, args):
+    """
+    Run a decoding job, returning (result, None) or (None, error) so one bad email cannot fail a whole batch.
+    """
+    try:
+        return func(*args), None
+    except Exception as e:
+        return None, repr(e)
+
+
+def _parse_list(tokens: list, pos: int) -> tuple:
+    """
+    Build a nested list from `tokens`, starting right after an `_OPEN` sentinel.
+
+    Returns:
+        tuple: The parsed list and the position right after the matching `_CLOSE`.
+    """
+    items = []
+    while pos < len(tokens):
+        tok = tokens[pos]
+        if tok is _OPEN:
+            value, pos = _parse_list(tokens, pos + 1)
+            items.append(value)
+        elif tok is _CLOSE:
+            return items, pos + 1
+        else:
+            items.append(tok)
+            pos += 1
+    return items, pos
+
 
 class EmailHandler:
 
-    def __init__(self, logger, host, port, username, password, folder):
+    def __init__(self, logger, host, port, username, password, folder, fetch_batch_size=100, sender_filter=None, server_side_filter=False, fetch_mode="full", raw_store=None, store_key=None, parse_workers=0):
         self.logger = logger
         self.host = host
         self.port = port
         self.username = username
         self.password = password
         self.folder = folder
+        self.fetch_batch_size = max(1, int(fetch_batch_size))
+        # Only emails sent from one of these addresses are downloaded in full (None disables filtering)
+        self.sender_filter = {address.lower() for address in sender_filter} if sender_filter else None
+        self.server_side_filter = server_side_filter
+        # "full" downloads whole RFC822 messages, "partial" only the text part picked from BODYSTRUCTURE
+        if fetch_mode not in ("full", "partial"):
+            raise ValueError(f"Unsupported fetch mode: {fetch_mode}")
+        self.fetch_mode = fetch_mode
+        # Raw emails are kept in `raw_store` (a RawEmailStore) under `store_key`, which needs whole messages
+        self.raw_store = raw_store
+        self.store_key = store_key or folder
+        if raw_store is not None and fetch_mode == "partial":
+            self.logger.info("Raw email store enabled, fetching whole messages")
+            self.fetch_mode = "full"
+        self.uidvalidity = None
+        # HIGHESTMODSEQ reported on SELECT by servers with CONDSTORE (RFC 7162), None otherwise
+        self.highestmodseq = None
+        # Whether the last search found UIDVALIDITY changed since the checkpoint, and so rescanned the folder
+        self.uidvalidity_changed = False
+        # MIME parsing and HTML conversion run in a pool of this many processes (0 or 1 decodes inline)
+        self.parse_workers = parse_workers
+        self.parse_pool = None
+        # Highest UID returned by the last search, including emails dropped by the sender filter
+        self.last_scanned_uid = None
+        self.imapb = None
+        # Seconds without a command after which the connection is checked before fetching the next batch
+        self.keepalive_interval = 60
+        self.last_command_time = time.monotonic()
 
     def imap_bridge(self):
         """
@@ -30,24 +159,151 @@ class EmailHandler:
             return self.imapb
         except Exception as e:
             raise RuntimeError(f"Failed to connect to email account: {e}")
-    
-    def get_email_uids(self, last_seen_uid=None):
+
+    def close(self):
+        """
+        Logout from the email account, ignoring errors from an already broken connection.
+        """
+        if self.parse_pool is not None:
+            self.parse_pool.shutdown()
+            self.parse_pool = None
+        if self.imapb is None:
+            return
+        try:
+            self.imapb.logout()
+        except Exception as e:
+            self.logger.warning(f"Failed to logout from email host: {e}")
+        self.imapb = None
+
+    def has_pending_data(self) -> bool:
+        """
+        Check without blocking whether a response is already waiting, either in imaplib's read buffer or on the socket.
+        """
+        sock = self.imapb.sock
+        timeout = sock.gettimeout()
+        sock.setblocking(False)
+        try:
+            return bool(self.imapb.file.peek(1))
+        finally:
+            sock.settimeout(timeout)
+
+    def idle(self, timeout=29 * 60):
+        """
+        Wait for new emails in the selected folder using IMAP IDLE (RFC 2177).
+
+        Servers drop IDLE sessions after 30 minutes, so callers should re-issue it (after a NOOP) whenever it
+        returns False. Servers without IDLE support are polled instead: this sleeps for at most a minute and
+        reports possible new emails.
+
+        Args:
+            timeout (int): Seconds to wait for a notification before ending the IDLE command.
+
+        Returns:
+            bool: True if the server reported new emails, False if the timeout expired.
+        """
+        if "IDLE" not in self.imapb.capabilities:
+            time.sleep(min(timeout, 60))
+            return True
+
+        tag = self.imapb._new_tag()
+        self.imapb.send(tag + b" IDLE\r\n")
+        response = self.imapb.readline()
+        if not response.startswith(b"+"):
+            raise imaplib.IMAP4.error(f"IDLE rejected: {response.decode(errors='ignore').strip()}")
+
+        new_emails = False
+        deadline = time.monotonic() + timeout
+        while not new_emails:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            # imaplib reads through a buffered file, which may already hold the notification
+            if not self.has_pending_data() and not select.select([self.imapb.sock], [], [], remaining)[0]:
+                break
+            line = self.imapb.readline()
+            if not line:
+                raise imaplib.IMAP4.abort("Connection closed while idling")
+            new_emails = re.match(rb"\* \d+ EXISTS", line) is not None
+
+        self.imapb.send(b"DONE\r\n")
+        # Drain untagged responses until the IDLE command completes
+        while True:
+            line = self.imapb.readline()
+            if not line:
+                raise imaplib.IMAP4.abort("Connection closed while ending IDLE")
+            if line.startswith(tag):
+                break
+            new_emails = new_emails or re.match(rb"\* \d+ EXISTS", line) is not None
+        return new_emails
+
+    def select_folder(self):
+        """
+        Select `folder` on the current connection.
+        """
+        status, _ = self.imapb.select(f'"{self.folder}"')
+        if status != "OK":
+            raise Exception(f"Failed to select folder: {self.folder}")
+
+        try:
+            _, data = self.imapb.response("UIDVALIDITY")
+            self.uidvalidity = int(data[0]) if data and data[0] else None
+        except (TypeError, ValueError):
+            self.uidvalidity = None
+        try:
+            _, data = self.imapb.response("HIGHESTMODSEQ")
+            self.highestmodseq = int(data[0]) if data and data[0] else None
+        except (TypeError, ValueError):
+            self.highestmodseq = None
+
+    def keepalive(self):
+        """
+        Make sure the connection is still usable before the next batch is fetched.
+
+        Consumers may spend a long time on a batch (e.g. one LLM call per email), longer than the 30 minute
+        autologout servers may apply (RFC 3501). After `keepalive_interval` seconds without a command, a NOOP
+        checks the connection, and a dropped connection is re-established with the folder selected again.
+        """
+        if time.monotonic() - self.last_command_time < self.keepalive_interval:
+            return
+        try:
+            self.imapb.noop()
+        except CONNECTION_ERRORS as e:
+            self.logger.info(f"Email connection dropped while idle ({e}), reconnecting")
+            self.close()
+            self.imap_bridge()
+            self.select_folder()
+
+    def get_email_uids(self, last_seen_uid=None, uidvalidity=None, highestmodseq=None):
         """
         Retrieve UIDs of emails in a folder. If last_seen_uid is given, only fetch newer ones.
 
+        The checkpoint's `uidvalidity` and `highestmodseq` are compared with the folder's: if UIDVALIDITY changed,
+        `last_seen_uid` means nothing anymore and the whole folder is searched (`uidvalidity_changed` is set);
+        if HIGHESTMODSEQ did not change, nothing happened in the folder and no search is made.
+
         Args:
             last_seen_uid: last_seen_uid
+            uidvalidity (int, optional): UIDVALIDITY the checkpoint was taken with.
+            highestmodseq (int, optional): HIGHESTMODSEQ of the folder when it was last fully synced.
 
         Returns:
             list: A list containing all email index numbers in the specified folder.
         """
         try:
-            if not hasattr(self, 'imapb') or self.imapb is None:
+            if self.imapb is None:
                 raise RuntimeError("IMAP connection not established. Call imap_bridge first.")
             
-            status, _ = self.imapb.select(f'"{self.folder}"')
-            if status != "OK":
-                raise Exception(f"Failed to select folder: {self.folder}")
+            self.select_folder()
+            # Only this search's UIDs may move the checkpoint, never those of an earlier one (or UIDVALIDITY)
+            self.last_scanned_uid = None
+
+            self.uidvalidity_changed = uidvalidity is not None and self.uidvalidity is not None and uidvalidity != self.uidvalidity
+            if self.uidvalidity_changed:
+                self.logger.warning(f"UIDVALIDITY of {self.folder} changed from {uidvalidity} to {self.uidvalidity}, rescanning the folder")
+                last_seen_uid = None
+            elif last_seen_uid and highestmodseq is not None and highestmodseq == self.highestmodseq:
+                self.logger.info(f"No changes in {self.folder} since the last sync (HIGHESTMODSEQ {highestmodseq})")
+                return []
 
             # Search from UID+1 to newest
             if last_seen_uid:
@@ -55,85 +311,518 @@ class EmailHandler:
             else:
                 criteria = "ALL"
 
+            # Let the server drop emails from unknown senders
+            if self.sender_filter and self.server_side_filter:
+                criteria = f"{criteria} {self.sender_search_criteria(self.sender_filter)}"
+
             status, messages = self.imapb.uid("search", None, criteria)
             if status != "OK":
                 raise Exception("Failed to search for emails")
 
-            return messages[0].split()
+            # `UID n:*` always matches the newest email, even when its UID is below n
+            uids = [uid for uid in messages[0].split() if not last_seen_uid or int(uid) > int(last_seen_uid)]
+            if uids:
+                self.last_scanned_uid = max(int(uid) for uid in uids)
+            return uids
+        except CONNECTION_ERRORS:
+            # Left as is so callers can tell a lost connection from other failures
+            raise
         except Exception as e:
             raise RuntimeError(f"Failed to retrieve email UIDs: {e}")
     
-    def get_emails(self, last_seen_uid=None):
+    @staticmethod
+    def compress_uids(uids) -> str:
         """
-        Retrieve emails newer than last_seen_uid.
+        Compress UIDs into an IMAP sequence set, collapsing consecutive runs into ranges.
 
         Args:
-            last_seen_uid (int): UID of the last seen email.
+            uids (list): UIDs as bytes, str or int, e.g. [b'101', b'102', b'103', b'300'].
 
         Returns:
-            list: A list of dictionaries containing email details.
+            str: The sequence set, e.g. "101:103,300".
+        """
+        ranges = []
+        for uid in sorted({int(uid) for uid in uids}):
+            if ranges and uid == ranges[-1][1] + 1:
+                ranges[-1][1] = uid
+            else:
+                ranges.append([uid, uid])
+        return ",".join(str(start) if start == end else f"{start}:{end}" for start, end in ranges)
+
+    @staticmethod
+    def parse_fetch_response(msg_data) -> list:
+        """
+        Parse the data returned by a (possibly multi-message) FETCH command in one pass.
+
+        Args:
+            msg_data (list): The data part of `imaplib.IMAP4.uid("fetch", ...)`. Literals arrive as
+                (header, literal) tuples, everything else as bytes.
+
+        Returns:
+            list: One dict per message mapping upper-cased item names (e.g. 'UID', 'RFC822') to their values.
+        """
+        tokens = []
+        for item in msg_data:
+            if isinstance(item, tuple):
+                header, literal = item
+                tokens.extend(_tokenize(header[:header.rfind(b"{")] if header.endswith(b"}") else header))
+                tokens.append(literal)
+            elif item:
+                tokens.extend(_tokenize(item))
+
+        messages = []
+        pos = 0
+        while pos < len(tokens):
+            if tokens[pos] is _OPEN:
+                items, pos = _parse_list(tokens, pos + 1)
+                messages.append({str(key).upper(): value for key, value in zip(items[::2], items[1::2])})
+            else:
+                # message sequence number preceding the item list
+                pos += 1
+        return messages
+
+    @staticmethod
+    def sender_search_criteria(senders) -> str:
+        """
+        Build an IMAP SEARCH criteria matching any of the given senders, e.g. `OR FROM "a@x.com" FROM "b@y.com"`.
+
+        Args:
+            senders (iterable): Sender email addresses.
+
+        Returns:
+            str: The SEARCH criteria.
+        """
+        criteria = [f'FROM "{sender}"' for sender in sorted(senders)]
+        # OR is a binary prefix operator, so n alternatives need n-1 ORs
+        return "OR " * (len(criteria) - 1) + " ".join(criteria)
+
+    def fetch_header_items(self, uids) -> dict:
+        """
+        Fetch the headers of a batch of emails, along with their BODYSTRUCTURE when `fetch_mode` is "partial",
+        so sender filtering and part selection share one round trip.
+
+        Args:
+            uids (list): UIDs to fetch, as returned by `get_email_uids`.
+
+        Returns:
+            dict: UID (int) to the items returned by `parse_fetch_response`, with the header under 'HEADER'.
+        """
+        fetch_items = f"(BODYSTRUCTURE {HEADER_FIELDS})" if self.fetch_mode == "partial" else f"({HEADER_FIELDS})"
+        status, msg_data = self.imapb.uid("fetch", self.compress_uids(uids), fetch_items)
+        if status != "OK":
+            raise Exception(f"Failed to fetch email headers for UIDs {self.compress_uids(uids)}")
+
+        header_items = {}
+        for items in self.parse_fetch_response(msg_data):
+            header = next((value for key, value in items.items() if key.startswith("BODY[HEADER")), None)
+            if items.get("UID") is None or header is None:
+                continue
+            items["HEADER"] = header
+            header_items[int(items["UID"])] = items
+        return header_items
+
+    def filter_uids(self, uids, header_items=None) -> list:
+        """
+        Keep only the UIDs of emails sent from an address in `sender_filter`, looking at headers only.
+
+        Args:
+            uids (list): UIDs to check, as returned by `get_email_uids`.
+            header_items (dict, optional): Headers already fetched with `fetch_header_items`.
+
+        Returns:
+            list: The UIDs whose `From` address is in `sender_filter`.
+        """
+        if not self.sender_filter or not uids:
+            return uids
+
+        if header_items is None:
+            header_items = self.fetch_header_items(uids)
+
+        candidates = set()
+        for uid, items in header_items.items():
+            _, from_address = parseaddr(email.message_from_bytes(items["HEADER"])["From"] or "")
+            if from_address.lower() in self.sender_filter:
+                candidates.add(uid)
+
+        self.logger.info(f"{len(candidates)} of {len(uids)} emails match the sender filter")
+        return [uid for uid in uids if int(uid) in candidates]
+
+    @staticmethod
+    def parse_email(uid, raw_email: bytes) -> dict:
+        """
+        Decode a raw RFC822 message into the dict shape used across transactsync.
+
+        Args:
+            uid (bytes): UID of the email.
+            raw_email (bytes): The raw RFC822 message.
+
+        Returns:
+            dict: Email details ('uid', 'message_id', 'subject', 'email_date', 'from_address', 'to_address', 'body').
+        """
+        msg = email.message_from_bytes(raw_email)
+
+        # Extract body
+        body = ""
+        if msg.is_multipart():
+            for part in msg.walk():
+                content_type = part.get_content_type()
+                if content_type == "text/plain":
+                    body = part.get_payload(decode=True).decode(errors="ignore")
+                    break
+                elif content_type == "text/html":
+                    html = part.get_payload(decode=True).decode(errors="ignore")
+                    body = EmailHandler.html_to_text(html)
+                    break
+        else:
+            content_type = msg.get_content_type()
+            if content_type == "text/html":
+                html = msg.get_payload(decode=True).decode(errors="ignore")
+                body = EmailHandler.html_to_text(html)
+            else:
+                body = msg.get_payload(decode=True).decode(errors="ignore")
+
+        return EmailHandler.email_details(uid, msg, body)
+
+    @staticmethod
+    def html_to_text(html: str) -> str:
+        """
+        Convert an HTML email body to plain text, dropping styles, scripts and hidden (preheader) content and
+        keeping block elements on separate lines.
+        """
+        soup = BeautifulSoup(html, HTML_PARSER)
+        for tag in soup(["style", "script", "head", "title", "noscript"]):
+            tag.decompose()
+        for tag in soup.find_all(style=HIDDEN_STYLE_RE):
+            tag.decompose()
+        for tag in soup.find_all(hidden=True):
+            tag.decompose()
+        for tag in soup.find_all(BLOCK_TAGS):
+            tag.append("\n")
+        return soup.get_text().strip()
+
+    @staticmethod
+    def email_details(uid, msg, body: str) -> dict:
+        """
+        Decode the headers of a message and combine them with an already extracted body.
+
+        Args:
+            uid (bytes): UID of the email.
+            msg (email.message.Message): The message (or just its headers).
+            body (str): The decoded text body.
+
+        Returns:
+            dict: Email details ('uid', 'message_id', 'subject', 'email_date', 'from_address', 'to_address', 'body').
+        """
+        # Decode subject
+        subject, encoding = decode_header(msg["Subject"])[0]
+        subject = subject.decode(encoding or "utf-8") if isinstance(subject, bytes) else subject
+
+        # Decode date
+        raw_date = msg["Date"]
+        parsed_date = parsedate_to_datetime(raw_date)
+        email_date = parsed_date.isoformat() if parsed_date else raw_date
+
+        # Decode from
+        from_address = msg["From"]
+
+        # Decode to
+        to_address = msg["To"]
+
+        return {
+            "uid": uid,
+            "message_id": (msg["Message-ID"] or "").strip() or None,
+            "subject": subject,
+            "email_date": email_date,
+            "from_address": from_address,
+            "to_address": to_address,
+            "body": body
+        }
+
+    @staticmethod
+    def select_text_part(bodystructure: list, section: str = "") -> dict:
+        """
+        Pick the MIME part that `parse_email` would use as body, from a parsed BODYSTRUCTURE.
+
+        Mirrors the `msg.walk()` loop: the first text/plain or text/html part in depth-first order, or
+        part 1 of a single-part message whatever its type.
+
+        Args:
+            bodystructure (list): The BODYSTRUCTURE value returned by `parse_fetch_response`.
+            section (str): Section number of `bodystructure` within the message (empty for the root).
+
+        Returns:
+            dict or None: 'section', 'content_type', 'encoding' and 'charset' of the part, or None if the
+                message has no text part.
+
+        Raises:
+            ValueError: If the structure contains an encapsulated message before any text part.
+        """
+        def text(value):
+            return (value.decode(errors="ignore") if isinstance(value, bytes) else value or "").lower()
+
+        # Multipart bodies list their children first, followed by the subtype
+        if isinstance(bodystructure[0], list):
+            for i, child in enumerate(bodystructure):
+                if not isinstance(child, list):
+                    break
+                part = EmailHandler.select_text_part(child, f"{section}.{i + 1}" if section else str(i + 1))
+                if part:
+                    return part
+            return None
+
+        content_type = f"{text(bodystructure[0])}/{text(bodystructure[1])}"
+        if content_type == "message/rfc822":
+            raise ValueError("Encapsulated messages are not supported")
+        if section and content_type not in ("text/plain", "text/html"):
+            return None
+
+        params = bodystructure[2] or []
+        params = {text(key): text(value) for key, value in zip(params[::2], params[1::2])}
+        return {
+            "section": section or "1",
+            "content_type": content_type,
+            "encoding": text(bodystructure[5]),
+            "charset": params.get("charset")
+        }
+
+    @staticmethod
+    def decode_part(payload: bytes, part: dict) -> str:
+        """
+        Undo the transfer encoding and charset of a part fetched with BODY.PEEK[<section>].
+
+        Args:
+            payload (bytes): The raw part contents.
+            part (dict): The part description returned by `select_text_part`.
+
+        Returns:
+            str: The decoded text, converted from HTML if needed.
         """
+        if part["encoding"] in ("base64", "quoted-printable"):
+            # Decode through the email package so truncated or badly padded parts are tolerated like in full fetches
+            message = email.message.Message()
+            message["Content-Transfer-Encoding"] = part["encoding"]
+            message.set_payload(payload.decode("ascii", errors="surrogateescape"))
+            payload = message.get_payload(decode=True)
+
         try:
-            self.imapb = self.imap_bridge()
-            uids = self.get_email_uids(last_seen_uid)
-            
-            e_mails = []
-            for uid in uids:
-                status, msg_data = self.imapb.uid("fetch", uid, "(RFC822)")
-                if status != "OK":
-                    self.logger.error(f"Failed to fetch email UID {uid}")
-                    continue
-
-                raw_email = msg_data[0][1]
-                msg = email.message_from_bytes(raw_email)
-
-                # Decode subject
-                subject, encoding = decode_header(msg["Subject"])[0]
-                subject = subject.decode(encoding or "utf-8") if isinstance(subject, bytes) else subject
-
-                # Decode date
-                raw_date = msg["Date"]
-                parsed_date = parsedate_to_datetime(raw_date)
-                email_date = parsed_date.isoformat() if parsed_date else raw_date
-
-                # Decode from
-                from_address = msg["From"]
-
-                # Decode to
-                to_address = msg["To"]
-
-                # Extract body
-                body = ""
-                if msg.is_multipart():
-                    for part in msg.walk():
-                        content_type = part.get_content_type()
-                        if content_type == "text/plain":
-                            body = part.get_payload(decode=True).decode(errors="ignore")
-                            break
-                        elif content_type == "text/html":
-                            html = part.get_payload(decode=True).decode(errors="ignore")
-                            soup = BeautifulSoup(html, "html.parser")
-                            body = soup.get_text()
-                            break
-                else:
-                    content_type = msg.get_content_type()
-                    if content_type == "text/html":
-                        html = msg.get_payload(decode=True).decode(errors="ignore")
-                        soup = BeautifulSoup(html, "html.parser")
-                        body = soup.get_text()
-                    else:
-                        body = msg.get_payload(decode=True).decode(errors="ignore")
-
-                e_mails.append({
-                    "uid": uid,
-                    "subject": subject,
-                    "email_date": email_date,
-                    "from_address": from_address,
-                    "to_address": to_address,
-                    "body": body
-                })
+            body = payload.decode(part["charset"] or "utf-8", errors="ignore")
+        except LookupError:
+            body = payload.decode(errors="ignore")
 
-            self.imapb.logout()
-            return e_mails
+        if part["content_type"] == "text/html":
+            return EmailHandler.html_to_text(body)
+        return body
+
+    @staticmethod
+    def parse_text_part(uid, header: bytes, payload: bytes, part: dict) -> dict:
+        """
+        Build the email dict from headers and a text part fetched with `fetch_text_parts`.
+
+        Args:
+            uid (bytes): UID of the email.
+            header (bytes): The raw headers.
+            payload (bytes): The raw part contents, or b"" when the email has no text part.
+            part (dict or None): The part description returned by `select_text_part`.
+
+        Returns:
+            dict: Email details ('uid', 'message_id', 'subject', 'email_date', 'from_address', 'to_address', 'body').
+        """
+        body = EmailHandler.decode_part(payload, part) if part else ""
+        return EmailHandler.email_details(uid, email.message_from_bytes(header), body)
+
+    def decode_emails(self, func, jobs) -> list:
+        """
+        Run `func(*args)` for each job, in the process pool when `parse_workers` > 1 and there is more than one job.
+
+        Emails that fail to decode are logged and left out.
+
+        Args:
+            func (callable): `parse_email` or `parse_text_part`; its first argument must be the UID.
+            jobs (list): Argument tuples for `func`.
+
+        Returns:
+            list: The decoded emails, in job order.
+        """
+        if self.parse_workers > 1 and len(jobs) > 1:
+            if self.parse_pool is None:
+                self.parse_pool = ProcessPoolExecutor(max_workers=self.parse_workers)
+            results = self.parse_pool.map(_call_safely, [func] * len(jobs), jobs)
+        else:
+            results = (_call_safely(func, args) for args in jobs)
+
+        e_mails = []
+        for args, (e_mail, error) in zip(jobs, results):
+            if error:
+                self.logger.error(f"Skipping email UID {args[0]}, failed to decode it: {error}")
+            else:
+                e_mails.append(e_mail)
+        return e_mails
+
+    def fetch_text_parts(self, uids, header_items=None) -> tuple:
+        """
+        Fetch only the headers and the text part of each email, instead of the whole message.
+
+        One round trip fetches BODYSTRUCTURE and headers for the batch (skipped when `header_items` already
+        has them), then one more round trip per distinct part section (usually just one or two per batch)
+        fetches the selected parts.
+
+        Args:
+            uids (list): UIDs to fetch, as returned by `get_email_uids`.
+            header_items (dict, optional): Headers and BODYSTRUCTURE already fetched with `fetch_header_items`.
+
+        Returns:
+            tuple: The decoded emails, and the UIDs whose structure is not supported and must be fetched in full.
+        """
+        if header_items is None:
+            try:
+                header_items = self.fetch_header_items(uids)
+            except Exception as e:
+                self.logger.error(f"{e}, fetching in full")
+                return [], uids
+
+        uid_map = {int(uid): uid for uid in uids}
+        headers, parts, full_uids = {}, {}, []
+        for uid, items in header_items.items():
+            if uid not in uid_map:
+                continue
+            try:
+                parts[uid] = self.select_text_part(items["BODYSTRUCTURE"])
+                headers[uid] = items["HEADER"]
+            except (KeyError, IndexError, TypeError, ValueError) as e:
+                self.logger.info(f"Fetching email UID {uid} in full: {e}")
+                full_uids.append(uid_map[uid])
+        # Let the full fetch report emails missing from the response
+        full_uids.extend(uid_map[uid] for uid in uid_map if uid not in parts and uid_map[uid] not in full_uids)
+
+        sections = defaultdict(list)
+        for uid, part in parts.items():
+            if part:
+                sections[part["section"]].append(uid)
+
+        payloads = {}
+        for section, section_uids in sections.items():
+            status, msg_data = self.imapb.uid("fetch", self.compress_uids(section_uids), f"(BODY.PEEK[{section}])")
+            if status != "OK":
+                self.logger.error(f"Failed to fetch part {section} for UIDs {self.compress_uids(section_uids)}")
+                continue
+            for items in self.parse_fetch_response(msg_data):
+                if items.get("UID") is not None and int(items["UID"]) in uid_map:
+                    payloads[int(items["UID"])] = items.get(f"BODY[{section}]") or b""
+
+        jobs = []
+        for uid, part in parts.items():
+            if part and uid not in payloads:
+                full_uids.append(uid_map[uid])
+                continue
+            jobs.append((uid_map[uid], headers[uid], payloads.get(uid, b""), part))
+        return self.decode_emails(self.parse_text_part, jobs), full_uids
+
+    def fetch_emails(self, uids, header_items=None) -> list:
+        """
+        Fetch and decode a batch of emails, using the text-part-only path when `fetch_mode` is "partial".
+
+        Args:
+            uids (list): UIDs to fetch, as returned by `get_email_uids`.
+            header_items (dict, optional): Headers and BODYSTRUCTURE already fetched with `fetch_header_items`.
+
+        Returns:
+            list: A list of dictionaries containing email details, ordered by UID.
+        """
+        if self.fetch_mode != "partial":
+            return self.fetch_full_emails(uids)
+
+        e_mails, full_uids = self.fetch_text_parts(uids, header_items)
+        if full_uids:
+            e_mails.extend(self.fetch_full_emails(full_uids))
+        return sorted(e_mails, key=lambda e_mail: int(e_mail["uid"]))
+
+    def fetch_full_emails(self, uids) -> list:
+        """
+        Fetch and decode a batch of emails with a single UID FETCH round trip.
+
+        Args:
+            uids (list): UIDs to fetch, as returned by `get_email_uids`.
+
+        Returns:
+            list: A list of dictionaries containing email details, ordered by UID.
+        """
+        status, msg_data = self.imapb.uid("fetch", self.compress_uids(uids), "(RFC822)")
+        if status != "OK":
+            self.logger.error(f"Failed to fetch email UIDs {self.compress_uids(uids)}")
+            return []
+
+        raw_emails = {}
+        for items in self.parse_fetch_response(msg_data):
+            if items.get("UID") is not None and items.get("RFC822") is not None:
+                raw_emails[int(items["UID"])] = items["RFC822"]
+
+        jobs = []
+        for uid in sorted(uids, key=int):
+            raw_email = raw_emails.get(int(uid))
+            if raw_email is None:
+                self.logger.error(f"Failed to fetch email UID {uid}")
+                continue
+            if self.raw_store is not None:
+                self.raw_store.put(self.store_key, self.uidvalidity, uid, raw_email)
+            jobs.append((uid, raw_email))
+        return self.decode_emails(self.parse_email, jobs)
+
+    def iter_emails(self, last_seen_uid=None, uidvalidity=None, highestmodseq=None):
+        """
+        Yield emails newer than last_seen_uid as they arrive, one `fetch_batch_size` batch at a time.
+
+        Only the batch being consumed is held in memory. If no connection is open, one is made for this call
+        and logged out once the generator is exhausted or closed; a connection opened beforehand with
+        `imap_bridge` is left open for reuse.
+
+        Args:
+            last_seen_uid (int): UID of the last seen email.
+            uidvalidity (int, optional): UIDVALIDITY the checkpoint was taken with (see `get_email_uids`).
+            highestmodseq (int, optional): HIGHESTMODSEQ of the folder when it was last fully synced.
+
+        Yields:
+            dict: Email details ('uid', 'message_id', 'subject', 'email_date', 'from_address', 'to_address', 'body', and the
+            'folder' (`store_key`) and 'uidvalidity' the email was fetched from), in UID order.
+        """
+        owns_connection = self.imapb is None
+        if owns_connection:
+            self.imap_bridge()
+        try:
+            uids = self.get_email_uids(last_seen_uid, uidvalidity, highestmodseq)
+            self.logger.info(f"Found {len(uids)} new emails")
+
+            for i in range(0, len(uids), self.fetch_batch_size):
+                self.keepalive()
+                batch = uids[i:i + self.fetch_batch_size]
+                # Headers (and BODYSTRUCTURE) are fetched once per batch for both filtering and part selection
+                header_items = self.fetch_header_items(batch) if self.sender_filter or self.fetch_mode == "partial" else None
+                batch = self.filter_uids(batch, header_items)
+                e_mails = self.fetch_emails(batch, header_items) if batch else []
+                self.last_command_time = time.monotonic()
+                for e_mail in e_mails:
+                    # Identity of the email, with its UID, for idempotent storage
+                    e_mail["folder"], e_mail["uidvalidity"] = self.store_key, self.uidvalidity
+                yield from e_mails
+        except CONNECTION_ERRORS:
+            # Left as is so callers can tell a lost connection from other failures
+            raise
         except Exception as e:
             raise RuntimeError(f"Failed to retrieve emails: {e}")
+        finally:
+            if owns_connection:
+                self.close()
+
+    def get_emails(self, last_seen_uid=None):
+        """
+        Retrieve emails newer than last_seen_uid, fetching up to `fetch_batch_size` messages per round trip.
+        When `sender_filter` is set, only headers are fetched first and bodies are downloaded for matching senders only.
+
+        Prefer `iter_emails` for large mailboxes, as this holds every email in memory.
+
+        Args:
+            last_seen_uid (int): UID of the last seen email.
+
+        Returns:
+            list: A list of dictionaries containing email details.
+        """
+        return list(self.iter_emails(last_seen_uid))
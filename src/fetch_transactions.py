@@ -1,24 +1,166 @@
-import re
 import json
+import time
+import hashlib
+import threading
 from ollama import Client
+from pydantic import BaseModel
+from json_scanner import JSONObjectScanner
 from typing import Optional, Tuple
 
+
+DEFAULT_PROMPT = """
+            extract the following fields from this email:
+            ```
+            - account name or account number or card number or last 4 #
+            - transaction date
+            - transaction amount
+            - merchant (if available)
+            ```
+
+            and return JSON with the following keys and data types: 
+            ```
+            - account string
+            - transaction_amount float
+            - transaction_date timestamp
+            - merchant string
+            - transaction_flag true if it is a transaction else false
+            ```       
+            """ 
+
+# Sent before the emails of a batch; constant, so it extends the reusable prefix after the system prompt
+BATCH_INSTRUCTIONS = """Apply the instructions to each of the emails below separately. Return only a JSON array with one
+object per email, in the same order, each with the email's `uid` and the keys described in the instructions."""
+
+# (model_host, model) to model digest, for models already checked (and pulled if needed) by this process
+_ready_models = {}
+_ready_lock = threading.Lock()
+
+
+class TransactionPrediction(BaseModel):
+    """
+    Model output schema used in structured output mode, sent to Ollama as the `format` JSON schema.
+    """
+    transaction_flag: bool
+    account_number: Optional[str] = None
+    transaction_amount: Optional[float] = None
+    transaction_date: Optional[str] = None
+    merchant: Optional[str] = None
+
+
+class TransactionBatchItem(TransactionPrediction):
+    """
+    One email's entry in the JSON array returned for a batch of emails.
+    """
+    uid: str
+
+
 class TransactionHandler:
 
-    def __init__(self, logger, model="qwen3:8b", model_host="http://localhost:11434"):
+    def __init__(self, logger, model="qwen3:8b", model_host="http://localhost:11434", compactor=None, extractor=None, cache=None, timeout=None, structured_output=False, num_predict=256, keep_alive=None, warm_up_prompt=None, classifier=None, templates=None, escalation_model=None, validator=None):
         self.logger = logger
         self.model = model
         self.model_host = model_host
-        self.llm_bridge = Client(host=self.model_host)
-        if self.model not in [m.model for m in self.llm_bridge.list().models]:
-            self.logger.info(f"Model not found in available models. Pulling model: {self.model}")
-            self.llm_bridge.pull(self.model)
-        self.logger.info(f"Using model: {self.model}")
+        # Optional BodyCompactor used to shrink email bodies before prompting
+        self.compactor = compactor
+        # Optional RuleExtractor tried before the model
+        self.extractor = extractor
+        # Optional pre-classifier (see pre_classifier.py) that rejects obvious non-transactions before the model
+        self.classifier = classifier
+        # Optional TemplateLearner reusing the model's output for structurally identical emails
+        self.templates = templates
+        # Larger model the email is sent to when `validator` (see prediction_validator.py) rejects the output of `model`
+        self.escalation_model = escalation_model
+        self.validator = validator
+        # Optional DB whose llm_cache table memoizes model outputs
+        self.cache = cache
+        # Constrain the output to TransactionPrediction JSON, without thinking, and at most `num_predict` tokens
+        self.structured_output = structured_output
+        self.num_predict = num_predict
+        # How long Ollama keeps the model loaded after a request (seconds or a duration like "30m"), None for its default
+        self.keep_alive = keep_alive
+        # Seconds before a request is abandoned; the client is thread-safe, so requests may run concurrently.
+        # The client's timeout only bounds the wait for each streamed chunk, `generate_until_json` the whole request
+        self.timeout = timeout
+        self.llm_bridge = Client(host=self.model_host, timeout=timeout)
+        # The model is checked, pulled and warmed up in the background while emails are downloaded
+        self.ready = threading.Event()
+        self.ready_error = None
+        # After a failed check, the next `wait_until_ready` from `ready_retry_at` checks again, backing off up to a minute
+        self.ready_lock = threading.Lock()
+        self.ready_retry_at = 0.0
+        self.ready_backoff = 1.0
+        threading.Thread(target=self.prepare_model, args=(warm_up_prompt,), name="prepare-model", daemon=True).start()
+
+    def prepare_model(self, warm_up_prompt=None):
+        """
+        Make sure the model is available, then warm it up with `warm_up_prompt` if given, and mark the handler ready.
+        """
+        try:
+            self.ensure_models()
+            if warm_up_prompt is not None:
+                self.warm_up(warm_up_prompt)
+        except Exception as e:
+            self.ready_error = e
+        finally:
+            self.ready.set()
+
+    def ensure_models(self):
+        """
+        Make sure the model and the escalation model, if any, are available.
+        """
+        self.ensure_model()
+        if self.escalation_model is not None:
+            self.ensure_model(self.escalation_model)
+
+    def ensure_model(self, model: Optional[str] = None):
+        """
+        Pull the model (default: `model`) if the Ollama server does not have it, once per model host and model in
+        this process.
+        """
+        model = model or self.model
+        with _ready_lock:
+            if (self.model_host, model) in _ready_models:
+                return
+            models = {m.model: m.digest for m in self.llm_bridge.list().models}
+            if model not in models:
+                self.logger.info(f"Model not found in available models. Pulling model: {model}")
+                self.llm_bridge.pull(model)
+                models = {m.model: m.digest for m in self.llm_bridge.list().models}
+            _ready_models[(self.model_host, model)] = models.get(model)
+        self.logger.info(f"Using model: {model}")
+
+    def wait_until_ready(self):
+        """
+        Block until `prepare_model` has finished. If the model check failed, check again (at most once per
+        backoff period), so a daemon recovers once the Ollama server is back.
+
+        Raises:
+            Exception: Whatever made the model check or pull fail (e.g. Ollama unreachable).
+        """
+        self.ready.wait()
+        if self.ready_error is None:
+            return
+        with self.ready_lock:
+            if self.ready_error is not None and time.monotonic() >= self.ready_retry_at:
+                try:
+                    self.ensure_models()
+                    self.ready_error, self.ready_backoff = None, 1.0
+                except Exception as e:
+                    self.ready_error = e
+                    self.ready_retry_at = time.monotonic() + self.ready_backoff
+                    self.ready_backoff = min(self.ready_backoff * 2, 60.0)
+            if self.ready_error is not None:
+                raise self.ready_error
     
     def get_transaction(self, e_mail: dict, llm_prompt: Optional[str] = None) -> Tuple[str, dict]:
         """
         Extract transaction details from an email using a language model.
 
+        When an `extractor` is set and its patterns for the sender's institution match, the model is not called;
+        neither is it for emails a `classifier` rejects, which come back with `transaction_flag` false, nor for
+        emails a template learned by `templates` from a similar email extracts (except for spot checks). With an
+        `escalation_model`, outputs of `model` the `validator` rejects are replaced by the escalation model's.
+
         Args:
             e_mail (dict): A dictionary containing the email's subject, date, sender, recipient, and body.
             llm_prompt (Optional[str]): An optional custom prompt to use with the language model.
@@ -30,39 +172,351 @@ class TransactionHandler:
             ValueError: If no JSON is found or JSON parsing fails.    
         """
 
+        shortcut, templated_prediction = self.try_shortcuts(e_mail)
+        if shortcut is not None:
+            return shortcut
+
+        llm_reasoning, llm_prediction = self.extract_with_routing(e_mail, llm_prompt)
+        if self.templates is not None:
+            self.templates.learn(e_mail, llm_prediction, templated_prediction)
+        return llm_reasoning, llm_prediction
+
+    def extract_with_routing(self, e_mail: dict, llm_prompt: Optional[str] = None,
+                             email_prompt: Optional[str] = None) -> Tuple[str, dict]:
+        """
+        Extract an email with `model`, escalating to `escalation_model` when the output does not parse or the
+        `validator` rejects it. Without an escalation model, this is `extract_with_model`.
+        """
+        if self.escalation_model is None or self.validator is None:
+            return self.extract_with_model(e_mail, llm_prompt, email_prompt=email_prompt)
         if llm_prompt is None:
             self.logger.info(f"Using default prompt")
-            llm_prompt = f"""
-            extract the following fields from this email:
-            ```
-            - account name or account number or card number or last 4 #
-            - transaction date
-            - transaction amount
-            - merchant (if available)
-            ```
+            llm_prompt = DEFAULT_PROMPT
 
-            and return JSON with the following keys and data types: 
-            ```
-            - account string
-            - transaction_amount float
-            - transaction_date timestamp
-            - merchant string
-            - transaction_flag true if it is a transaction else false
-            ```       
-            """ 
-        llm_prompt = llm_prompt + f"""
+        # Compacted once: the compactor learns boilerplate from every body it sees
+        if email_prompt is None:
+            email_prompt = self.email_prompt(e_mail)
+        try:
+            llm_reasoning, llm_prediction = self.extract_with_model(e_mail, llm_prompt, email_prompt=email_prompt)
+            problem = self.validator.validate(e_mail, llm_prediction)
+        except ValueError as e:
+            problem = f"unparsable output: {e}"
+        if problem is None:
+            return llm_reasoning, llm_prediction
+        return self.escalate(e_mail, llm_prompt, problem, email_prompt)
+
+    def escalate(self, e_mail: dict, llm_prompt: str, problem: str, email_prompt: Optional[str] = None) -> Tuple[str, dict]:
+        self.logger.info(f"Escalating email UID {e_mail.get('uid')} to {self.escalation_model}: {problem}")
+        return self.extract_with_model(e_mail, llm_prompt, model=self.escalation_model, email_prompt=email_prompt)
+
+    def get_transactions(self, e_mails: list, llm_prompt: Optional[str] = None, batch_size: int = 4,
+                         batch_tokens: int = 4000) -> list:
+        """
+        Extract transaction details from several emails, sending up to `batch_size` of them to the model in one
+        request so the instructions are evaluated once per batch instead of once per email.
+
+        Emails handled by the extractor, classifier, templates or cache never reach the model. The rest are packed
+        into batches of at most `batch_tokens` (estimated) email tokens, and the model is asked for a JSON array
+        with one object per email, keyed by UID. Emails missing from the answer or whose object does not validate
+        are retried one at a time with `get_transaction`; answers the `validator` rejects are escalated as there.
+
+        Args:
+            e_mails (list): Email dictionaries, as for `get_transaction`.
+            llm_prompt (Optional[str]): An optional custom prompt to use with the language model.
+            batch_size (int, optional): Maximum number of emails per model request. Default: 4.
+            batch_tokens (int, optional): Maximum estimated tokens of email content per model request. Default: 4000.
+
+        Returns:
+            list: For each email, in order, the (reasoning, prediction) tuple `get_transaction` would return, or the
+            ValueError, KeyError or TypeError it would have raised.
+        """
+        if llm_prompt is None:
+            self.logger.info(f"Using default prompt")
+            llm_prompt = DEFAULT_PROMPT
+        routing = self.escalation_model is not None and self.validator is not None
+        results = [None] * len(e_mails)
+        remaining, batches = [], []
+        for i, e_mail in enumerate(e_mails):
+            shortcut, templated_prediction = self.try_shortcuts(e_mail)
+            if shortcut is not None:
+                results[i] = shortcut
+                continue
+            cached = self.cached_output(e_mail, llm_prompt)
+            if cached is not None and routing and self.validator.validate(e_mail, cached[1]) is not None:
+                # Cached output to escalate: extracted on its own, so the model does not answer for it again
+                batches.append([(i, templated_prediction, self.email_prompt(e_mail))])
+            elif cached is not None:
+                if self.templates is not None:
+                    self.templates.learn(e_mail, cached[1], templated_prediction)
+                results[i] = cached
+            else:
+                remaining.append((i, templated_prediction, self.email_prompt(e_mail)))
+
+        batch = []
+        for item in remaining:
+            if batch and (len(batch) >= batch_size or
+                          sum(len(prompt) for _, _, prompt in batch) + len(item[2]) > batch_tokens * 4):
+                batches.append(batch)
+                batch = []
+            batch.append(item)
+        if batch:
+            batches.append(batch)
+
+        for batch in batches:
+            outputs = self.extract_batch_with_model([e_mails[i] for i, _, _ in batch], [p for _, _, p in batch],
+                                                    llm_prompt) if len(batch) > 1 else {}
+            for position, (i, templated_prediction, email_prompt) in enumerate(batch):
+                try:
+                    if position in outputs:
+                        llm_reasoning, llm_prediction = outputs[position]
+                        problem = self.validator.validate(e_mails[i], llm_prediction) if routing else None
+                        if problem is not None:
+                            llm_reasoning, llm_prediction = self.escalate(e_mails[i], llm_prompt, problem, email_prompt)
+                    else:
+                        llm_reasoning, llm_prediction = self.extract_with_routing(e_mails[i], llm_prompt, email_prompt)
+                    if self.templates is not None:
+                        self.templates.learn(e_mails[i], llm_prediction, templated_prediction)
+                    results[i] = (llm_reasoning, llm_prediction)
+                except (ValueError, KeyError, TypeError) as e:
+                    results[i] = e
+        return results
+
+    def try_shortcuts(self, e_mail: dict) -> tuple:
+        """
+        Extract an email without the model: with the extractor, the classifier or a learned template.
+
+        Returns:
+            tuple: ((reasoning, prediction) or None if the model is needed, the template's prediction to
+            spot-check the model's output against, or None).
+        """
+        if self.extractor is not None:
+            extracted = self.extractor.extract(e_mail)
+            if extracted is not None:
+                financial_institution, prediction = extracted
+                self.logger.info(f"Extracted with the {financial_institution} rules, skipping the model")
+                return (f"Extracted with the {financial_institution} extraction rules", prediction), None
+
+        if self.classifier is not None:
+            candidate, reason = self.classifier.classify(e_mail)
+            if not candidate:
+                self.logger.info(f"Pre-classifier skipped email UID {e_mail.get('uid')}: {reason}")
+                return (f"Skipped by the pre-classifier: {reason}", {"transaction_flag": False}), None
+
+        if self.templates is not None:
+            templated_prediction, spot_check = self.templates.match(e_mail)
+            if templated_prediction is not None and not spot_check:
+                self.logger.info(f"Extracted email UID {e_mail.get('uid')} with a learned template, skipping the model")
+                return ("Extracted with a template learned from a similar email", templated_prediction), None
+            return None, templated_prediction
+        return None, None
+
+    def model_cache_key(self, e_mail: dict, llm_prompt: str, model: Optional[str] = None) -> str:
+        model = model or self.model
+        return self.cache_key(f"{model} structured" if self.structured_output else model, llm_prompt, e_mail)
+
+    def cached_output(self, e_mail: dict, llm_prompt: str, model: Optional[str] = None):
+        """
+        The cached (reasoning, prediction) of the model (default: `model`) for an email, or None.
+        """
+        if self.cache is None:
+            return None
+        cached = self.cache.get_cached_prediction(self.model_cache_key(e_mail, llm_prompt, model))
+        if cached is not None:
+            self.logger.info("Using cached model output")
+        return cached
+
+    def email_prompt(self, e_mail: dict) -> str:
+        """
+        The per-email part of the prompt, with the body compacted by `compactor` if set.
+        """
+        body = e_mail["body"].strip()
+        if self.compactor is not None:
+            body = self.compactor.compact(e_mail["from_address"], body)
+        return f"""
             \n from_address: {e_mail["from_address"]}
             \n date: {e_mail["email_date"]}
             \n subject: {e_mail["subject"]}
-            \n body: \n{e_mail["body"].strip()}
+            \n body: \n{body}
             """.strip() 
 
-        llm_response = self.llm_bridge.generate(model=self.model, prompt=llm_prompt).response
+    def extract_with_model(self, e_mail: dict, llm_prompt: Optional[str] = None, model: Optional[str] = None,
+                           email_prompt: Optional[str] = None) -> Tuple[str, dict]:
+        """
+        Extract transaction details from an email with the language model, or its cached output for the email.
+
+        Args:
+            e_mail (dict): A dictionary containing the email's subject, date, sender, recipient, and body.
+            llm_prompt (Optional[str]): An optional custom prompt to use with the language model.
+            model (Optional[str]): Model to use instead of `model`.
+            email_prompt (Optional[str]): The email's prompt, if already built by `email_prompt`.
+
+        Returns:
+            Tuple[str, dict]: A tuple containing the reasoning text and the parsed JSON object.
+
+        Raises:
+            ValueError: If no JSON is found or JSON parsing fails.
+        """
+        if llm_prompt is None:
+            self.logger.info(f"Using default prompt")
+            llm_prompt = DEFAULT_PROMPT
+        model = model or self.model
+        cached = self.cached_output(e_mail, llm_prompt, model)
+        if cached is not None:
+            return cached
+
+        if email_prompt is None:
+            email_prompt = self.email_prompt(e_mail)
+        self.wait_until_ready()
+        start = time.perf_counter()
+        llm_response = self.generate_until_json(llm_prompt, email_prompt, model=model)
+        generation_seconds = time.perf_counter() - start
 
-        llm_reasoning, llm_prediction = self.parse_model_output(llm_response)
+        if self.structured_output:
+            llm_reasoning, llm_prediction = self.parse_model_output(llm_response, schema_class=TransactionPrediction)
+            llm_prediction = llm_prediction.model_dump()
+        else:
+            llm_reasoning, llm_prediction = self.parse_model_output(llm_response)
 
+        if self.cache is not None:
+            self.cache.cache_prediction(self.model_cache_key(e_mail, llm_prompt, model), model, llm_response,
+                                        llm_reasoning, llm_prediction, generation_seconds)
         return llm_reasoning, llm_prediction
 
+    def extract_batch_with_model(self, e_mails: list, email_prompts: list, llm_prompt: str) -> dict:
+        """
+        Extract several emails with one model request.
+
+        Args:
+            e_mails (list): Email dictionaries.
+            email_prompts (list): Their prompts, from `email_prompt`.
+            llm_prompt (str): The instructions, sent as the system prompt.
+
+        Returns:
+            dict: Position in `e_mails` to (reasoning, prediction), for the emails whose object in the model's
+            answer validated. An answer that cannot be parsed at all gives an empty dict.
+        """
+        uids = [self.uid_string(e_mail.get("uid")) for e_mail in e_mails]
+        batch_prompt = BATCH_INSTRUCTIONS + "\n\n" + "\n\n".join(
+            f"### email uid: {uid}\n{email_prompt}" for uid, email_prompt in zip(uids, email_prompts)
+        )
+
+        self.wait_until_ready()
+        start = time.perf_counter()
+        if self.structured_output:
+            llm_response = self.llm_bridge.generate(
+                model=self.model, system=llm_prompt, prompt=batch_prompt, keep_alive=self.keep_alive,
+                format={"type": "array", "items": TransactionBatchItem.model_json_schema()}, think=False,
+                options={"num_predict": self.num_predict * len(e_mails)}
+            ).response
+        else:
+            llm_response = self.llm_bridge.generate(model=self.model, system=llm_prompt, prompt=batch_prompt,
+                                                    keep_alive=self.keep_alive).response
+        generation_seconds = (time.perf_counter() - start) / len(e_mails)
+
+        # The first top-level array outside <think> blocks, which may mention brackets too
+        scanner = JSONObjectScanner(opening="[")
+        scanner.feed(llm_response)
+        if scanner.json_text is None:
+            self.logger.error("No JSON array found in the model's batch output, extracting one email at a time")
+            return {}
+        items = json.loads(scanner.json_text)
+        llm_reasoning = scanner.reasoning
+
+        outputs = {}
+        by_uid = {str(item.get("uid")): item for item in items if isinstance(item, dict)}
+        for position, uid in enumerate(uids):
+            item = by_uid.get(uid)
+            if item is None:
+                continue
+            prediction = {k: v for k, v in item.items() if k != "uid"}
+            try:
+                prediction = TransactionPrediction(**prediction).model_dump() if self.structured_output else prediction
+            except ValueError:
+                continue
+            if "transaction_flag" not in prediction or (prediction["transaction_flag"] is True and not all(
+                    prediction.get(k) not in (None, "") for k in ("account_number", "transaction_amount", "transaction_date"))):
+                continue
+            outputs[position] = (llm_reasoning, prediction)
+            if self.cache is not None:
+                self.cache.cache_prediction(self.model_cache_key(e_mails[position], llm_prompt), self.model,
+                                            json.dumps(item), llm_reasoning, prediction, generation_seconds)
+        return outputs
+
+    @staticmethod
+    def uid_string(uid) -> str:
+        return uid.decode() if isinstance(uid, bytes) else str(uid)
+
+    def generate(self, llm_prompt: str, email_prompt: str, model: Optional[str] = None, stream: bool = False, **options):
+        """
+        Send a request to the model with the static instructions as the system prompt and the email last.
+
+        The system prompt is byte-identical for every email of a run, so Ollama can reuse its evaluated prefix
+        (KV cache) instead of evaluating the instructions again for each email.
+        """
+        kwargs = {"stream": True} if stream else {}
+        if self.structured_output:
+            kwargs.update({"format": TransactionPrediction.model_json_schema(), "think": False})
+            options = {"num_predict": self.num_predict, **options}
+        return self.llm_bridge.generate(model=model or self.model, system=llm_prompt, prompt=email_prompt,
+                                        keep_alive=self.keep_alive, options=options or None, **kwargs)
+
+    def generate_until_json(self, llm_prompt: str, email_prompt: str, model: Optional[str] = None) -> str:
+        """
+        Stream the model's output and stop generating as soon as it has written a complete JSON object.
+
+        Returns:
+            str: The output up to the end of the first JSON object outside `<think>` blocks, or all of it if there
+            is none.
+
+        Raises:
+            TimeoutError: If the output is still streaming `timeout` seconds after the request was sent.
+        """
+        scanner = JSONObjectScanner()
+        deadline = time.monotonic() + self.timeout if self.timeout else None
+        chunks = self.generate(llm_prompt, email_prompt, model=model, stream=True)
+        try:
+            for chunk in chunks:
+                if scanner.feed(chunk.response or ""):
+                    break
+                if deadline is not None and time.monotonic() > deadline:
+                    raise TimeoutError(f"Model {model or self.model} still generating after {self.timeout}s")
+        finally:
+            # Closing the stream drops the connection, which makes Ollama cancel the rest of the generation
+            chunks.close()
+        return scanner.text[:scanner.end] if scanner.end is not None else scanner.text
+
+    def warm_up(self, llm_prompt: str):
+        """
+        Load the model and evaluate the system prompt once, so the first email does not pay for either.
+
+        Failures are only logged; the first email then loads the model as usual.
+        """
+        try:
+            start = time.perf_counter()
+            self.generate(llm_prompt, "Reply with OK.", num_predict=1)
+            self.logger.info(f"Model warmed up in {time.perf_counter() - start:.1f}s")
+        except Exception as e:
+            self.logger.warning(f"Failed to warm up model: {e!r}")
+
+    @staticmethod
+    def cache_key(model: str, llm_prompt: str, e_mail: dict) -> str:
+        """
+        Hash the model, prompt template and normalized email content into an llm_cache key.
+
+        Whitespace and the case of the sender address are ignored, so the same alert found in two folders (or
+        fetched again after a checkpoint reset) maps to the same key, while a new model or prompt does not.
+        """
+        normalize = lambda text: " ".join(str(text or "").split())
+        parts = [
+            model,
+            normalize(llm_prompt),
+            normalize(e_mail.get("from_address")).lower(),
+            normalize(e_mail.get("email_date")),
+            normalize(e_mail.get("subject")),
+            normalize(e_mail.get("body")),
+        ]
+        return hashlib.sha256("\0".join(parts).encode("utf-8")).hexdigest()
+
 
     @staticmethod
     def parse_model_output(raw_output: str, schema_class: Optional[type] = None) -> Tuple[str, dict]:
@@ -77,21 +531,16 @@ class TransactionHandler:
             Tuple[str, dict]: A tuple containing the reasoning text and the parsed JSON object.
 
         Raises:
-            ValueError: If no JSON is found or JSON parsing fails.
+            ValueError: If no complete JSON object is found or it does not match `schema_class` (pydantic's
+                ValidationError is a ValueError).
         """
-        # Match from the first '{' to the last '}' (greedy) — fallback if not recursive
-        json_match = re.search(r"\{(?:.|\n)*?\}", raw_output)
-        
-        if not json_match:
-            raise ValueError("No JSON object found in model output.")
+        # The first complete top-level object outside <think> blocks; nested objects are kept whole
+        scanner = JSONObjectScanner()
+        scanner.feed(raw_output)
+        if scanner.json_text is None:
+            raise ValueError(f"No JSON object found in model output: {raw_output[-200:]!r}")
 
-        json_str = json_match.group(0)
-        reasoning_text = raw_output[:json_match.start()].strip()
-
-        try:
-            parsed = json.loads(json_str)
-            if schema_class:
-                parsed = schema_class(**parsed)
-            return reasoning_text, parsed
-        except json.JSONDecodeError as e:
-            raise ValueError(f"Failed to parse JSON: {e}\nExtracted: {json_str}")
\ No newline at end of file
+        parsed = json.loads(scanner.json_text)
+        if schema_class:
+            parsed = schema_class(**parsed)
+        return scanner.reasoning, parsed
\ No newline at end of file
@@ -0,0 +1,114 @@
+import json
+
+THINK_OPEN = "<think>"
+THINK_CLOSE = "</think>"
+CLOSING = {"{": "}", "[": "]"}
+
+
+class JSONObjectScanner:
+    """
+    Find the first complete top-level JSON object (or, with `opening` "[", array) in model output, fed in chunks
+    as the model streams it.
+
+    Text inside `<think>` blocks is skipped, brackets inside JSON strings are ignored, and a balanced `{...}` that
+    is not valid JSON (e.g. braces in the reasoning text) is passed over. Each chunk is scanned once, so the
+    caller can stop generation as soon as `feed` returns True.
+    """
+
+    def __init__(self, opening="{"):
+        self.opening = opening
+        self.text = ""
+        self.position = 0
+        self.start = None
+        self.end = None
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+        self.in_think = False
+
+    @property
+    def json_text(self):
+        """
+        The JSON object's (or array's) text, or None until one has been found.
+        """
+        return None if self.end is None else self.text[self.start:self.end]
+
+    @property
+    def reasoning(self) -> str:
+        """
+        The text before the JSON object or array (including any `<think>` block), or all of it if none was found.
+        """
+        return (self.text if self.end is None else self.text[:self.start]).strip()
+
+    def feed(self, chunk: str) -> bool:
+        """
+        Scan the next chunk of output.
+
+        Returns:
+            bool: True once a complete JSON object or array has been found.
+        """
+        if self.end is not None:
+            return True
+        self.text += chunk
+        text, i = self.text, self.position
+        while i < len(text) and self.end is None:
+            if self.in_think:
+                j = text.find(THINK_CLOSE, i)
+                if j < 0:
+                    # The closing tag may be split across chunks
+                    i = max(i, len(text) - len(THINK_CLOSE) + 1)
+                    break
+                self.in_think = False
+                i = j + len(THINK_CLOSE)
+            elif self.depth == 0:
+                j = min((k for k in (text.find(self.opening, i), text.find("<", i)) if k >= 0), default=-1)
+                if j < 0:
+                    i = len(text)
+                elif text[j] == self.opening:
+                    self.start, self.depth = j, 1
+                    i = j + 1
+                elif text.startswith(THINK_OPEN, j):
+                    self.in_think = True
+                    i = j + len(THINK_OPEN)
+                elif THINK_OPEN.startswith(text[j:]):
+                    # Possibly the start of a tag split across chunks
+                    i = j
+                    break
+                else:
+                    i = j + 1
+            else:
+                i = self.scan_object(text, i)
+        self.position = i
+        return self.end is not None
+
+    def scan_object(self, text: str, i: int) -> int:
+        """
+        Scan inside the current candidate object or array from `i`, returning where to continue.
+        """
+        while i < len(text):
+            c = text[i]
+            i += 1
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif c == "\\":
+                    self.escaped = True
+                elif c == '"':
+                    self.in_string = False
+            elif c == '"':
+                self.in_string = True
+            elif c in CLOSING:
+                self.depth += 1
+            elif c in CLOSING.values():
+                self.depth -= 1
+                if self.depth == 0:
+                    try:
+                        json.loads(text[self.start:i])
+                        self.end = i
+                        return i
+                    except json.JSONDecodeError:
+                        # Not JSON after all (e.g. mismatched brackets): look for the next one after its opening one
+                        i, self.start = self.start + 1, None
+                        self.in_string = self.escaped = False
+                        return i
+        return i
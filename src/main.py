@@ -1,10 +1,22 @@
 import os
+import time
 import yaml
+import queue
+import signal
 import argparse
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from email.utils import parseaddr
-from fetch_emails import EmailHandler
+from fetch_emails import EmailHandler, CONNECTION_ERRORS
 from fetch_transactions import TransactionHandler
 from db import DB
+from raw_store import RawEmailStore
+from body_compactor import BodyCompactor
+from rule_extractor import RuleExtractor
+from pre_classifier import SubjectClassifier, ModelClassifier
+from template_learner import TemplateLearner
+from prediction_validator import PredictionValidator
 import logging
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
 logger = logging.getLogger(__name__)
@@ -46,36 +58,465 @@ def prompt_builder(transaction_filters, prompt_file):
     return llm_prompt
 
 
-def transactsync(email_host, email_port, username, password, folder, db_file, transaction_rules, prompt_file, model_host="http://localhost:11434", model="qwen3:8b"):
+def process_email(e_mail, transaction_handler, db_obj, llm_prompt, account_name_map, acct_ids_dict, replace=False):
+    """
+    Extract the transaction from one email with the LLM and store it if it is a credit card purchase.
+
+    Args:
+        e_mail (dict): Email details, as yielded by `EmailHandler.iter_emails`.
+        transaction_handler (TransactionHandler): Handler used to extract transactions with the LLM.
+        db_obj (DB): Database handler.
+        llm_prompt (str): Prompt built by `prompt_builder`.
+        account_name_map (dict): Lower-cased sender address to financial institution.
+        acct_ids_dict (dict): (financial_institution, account_number) to account ID, from `DB.get_account_ids_dict`.
+        replace (bool, optional): Replace what is stored for the email (see `store_transaction`). Default: False.
+    """
+    llm_reasoning, llm_prediction = transaction_handler.get_transaction(e_mail, llm_prompt)
+    store_transaction(e_mail, llm_reasoning, llm_prediction, db_obj, account_name_map, acct_ids_dict, replace=replace)
+
+
+def store_transaction(e_mail, llm_reasoning, llm_prediction, db_obj, account_name_map, acct_ids_dict, replace=False):
+    """
+    Store the transaction extracted from an email if it is a credit card purchase.
+
+    With `replace`, the transaction already stored for the email is overwritten, or removed if the email is not a
+    transaction after all, so reprocessing corrects earlier extractions.
+
+    Args:
+        e_mail (dict): Email details, as yielded by `EmailHandler.iter_emails`.
+        llm_reasoning (str): Reasoning returned by `TransactionHandler.get_transaction`.
+        llm_prediction (dict): Prediction returned by `TransactionHandler.get_transaction`.
+        db_obj (DB): Database handler.
+        account_name_map (dict): Lower-cased sender address to financial institution.
+        acct_ids_dict (dict): (financial_institution, account_number) to account ID, from `DB.get_account_ids_dict`.
+        replace (bool, optional): Replace what is stored for the email. Default: False.
+    """
+    _, e_mail['from_address'] = parseaddr(e_mail['from_address'])
+    _, e_mail['to_address'] = parseaddr(e_mail['to_address'])
+    if llm_prediction and llm_prediction["transaction_flag"] == True:
+        financial_institution = account_name_map[e_mail['from_address'].lower()]
+        account_id = acct_ids_dict[(financial_institution, llm_prediction['account_number'])]
+        llm_reasoning = llm_reasoning.replace('"', '`').replace("'", "`")
+        logger.info(f"from_address: {e_mail["from_address"]}")
+        logger.info(f"to_address: {e_mail["to_address"]}")
+        logger.info(f"email_uid: {e_mail['uid']}")
+        logger.info(f"email_date: {e_mail["email_date"]}")
+        logger.info(f"email_subject: {e_mail["subject"]}")
+        logger.info(f"llm_prediction: {llm_prediction}")
+        # logger.info(f"llm_reasoning: {llm_reasoning}")
+        db_obj.save_transaction(e_mail=e_mail, llm_reasoning=llm_reasoning, llm_prediction=llm_prediction, account_id=account_id,
+                                replace=replace)
+        logger.info("Transaction stored to DB")
+    elif llm_prediction["transaction_flag"] == False:
+        logger.info("Skipping non-transaction")
+        if replace:
+            db_obj.remove_transaction(e_mail)
+        # logger.info(f"from_address: {e_mail["from_address"]}")
+        # logger.info(f"email_subject: {e_mail["subject"]}")
+
+
+class ExtractionError(RuntimeError):
+    """
+    Extraction failed for a reason other than the email itself (e.g. the model host is unreachable).
+
+    Not an OSError, so the daemon does not take an unreachable model host for a lost IMAP connection.
+    """
+
+
+class BatchSlot:
+    """
+    An email's place in a batch extraction, standing in for its Future in `sync_folders`.
+    """
+
+    def __init__(self):
+        self.future = None
+        self.index = None
+
+    def done(self):
+        return self.future is not None and self.future.done()
+
+    def result(self):
+        result = self.future.result()[self.index]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+
+def sync_folders(email_handlers, transaction_handler, db_obj, llm_prompt, account_name_map, acct_ids_dict, max_connections=4, llm_concurrency=1, llm_batch_size=1, llm_batch_tokens=4000):
+    """
+    Fetch the emails received since each folder's checkpoint, extract transactions from them and store them.
+
+    Folders are downloaded in parallel over at most `max_connections` IMAP connections, and up to
+    `llm_concurrency` emails are sent to the model at the same time. Results are stored on the calling thread in
+    the order the emails arrived (UID order within each folder), and each folder's checkpoint is advanced as its
+    emails are stored. With `llm_batch_size` above 1, emails are grouped into batches sent to the model in one
+    request each (see `TransactionHandler.get_transactions`), and up to `llm_concurrency` batches run at a time.
+
+    Args:
+        email_handlers (dict): Checkpoint key (see `checkpoint_key`) to the EmailHandler of that folder.
+        transaction_handler (TransactionHandler): Handler used to extract transactions with the LLM.
+        db_obj (DB): Database handler.
+        llm_prompt (str): Prompt built by `prompt_builder`.
+        account_name_map (dict): Lower-cased sender address to financial institution.
+        acct_ids_dict (dict): (financial_institution, account_number) to account ID, from `DB.get_account_ids_dict`.
+        max_connections (int, optional): Maximum number of folders downloaded at the same time. Default: 4.
+        llm_concurrency (int, optional): Maximum number of emails being extracted at the same time. Default: 1.
+        llm_batch_size (int, optional): Maximum number of emails per model request. Default: 1.
+        llm_batch_tokens (int, optional): Maximum estimated tokens of email content per model request. Default: 4000.
+
+    Returns:
+        int: The number of emails processed.
+
+    Emails the model output cannot be stored for (unparsable JSON, unknown account) are logged and skipped;
+    any other extraction error (e.g. Ollama unreachable) stops the sync before the email is checkpointed.
+
+    Raises:
+        ExtractionError: If an email could not be extracted for another reason than its model output.
+        ConnectionError: If folders failed to download because their IMAP connection was lost.
+        RuntimeError: If any folder failed to download for another reason; the other folders are still synced.
+    """
+    max_uids, checkpoints = {}, {}
+    for key in email_handlers:
+        checkpoints[key] = db_obj.get_checkpoint(key) or {}
+        last_seen_uid = checkpoints[key].get("last_seen_uid")
+        logger.info(f"last_seen_uid ({key}): {last_seen_uid}")
+        max_uids[key] = -1 if last_seen_uid is None else last_seen_uid
+
+    # Bounded, so fast folders cannot buffer more than a few batches ahead of extraction
+    emails = queue.Queue(maxsize=max(handler.fetch_batch_size for handler in email_handlers.values()) * max_connections)
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                emails.put(item, timeout=1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def download(key, email_handler):
+        e_mails = email_handler.iter_emails(last_seen_uid=None if max_uids[key] < 0 else max_uids[key],
+                                            uidvalidity=checkpoints[key].get("uidvalidity"),
+                                            highestmodseq=checkpoints[key].get("highestmodseq"))
+        stored = None
+        try:
+            for e_mail in e_mails:
+                if email_handler.uidvalidity_changed:
+                    # The folder is rescanned: leave out the emails already stored as transactions
+                    if stored is None:
+                        stored = db_obj.get_stored_email_ids(key)
+                    if e_mail.get("message_id") in stored or DB.email_content_hash(e_mail) in stored:
+                        logger.info(f"Email UID {e_mail['uid']} in {key} is already stored, skipping it")
+                        continue
+                if not put((key, e_mail)):
+                    break
+            put((key, None))
+        except Exception as e:
+            put((key, e))
+        finally:
+            e_mails.close()
+
+    failed = {}
+    rescanned = set()
+
+    def finish(key, e_mail, extraction):
+        if isinstance(e_mail, Exception):
+            logger.error(f"Failed to sync {key}: {e_mail}")
+            failed[key] = e_mail
+            return 0
+        email_handler = email_handlers[key]
+        if email_handler.uidvalidity_changed and key not in rescanned:
+            # UIDs of the new UIDVALIDITY start over
+            rescanned.add(key)
+            max_uids[key] = -1
+        if e_mail is None:
+            # Move the checkpoint past emails skipped by the sender filter, and record the folder as fully synced
+            last_scanned_uid = email_handler.last_scanned_uid
+            if last_scanned_uid is not None and last_scanned_uid > max_uids[key]:
+                max_uids[key] = last_scanned_uid
+            if max_uids[key] >= 0:
+                db_obj.set_last_seen_uid(key, max_uids[key], uidvalidity=email_handler.uidvalidity,
+                                         highestmodseq=email_handler.highestmodseq)
+            return 0
+        try:
+            try:
+                llm_reasoning, llm_prediction = extraction.result()
+            except (ValueError, KeyError, TypeError):
+                raise
+            except Exception as e:
+                raise ExtractionError(f"Failed to extract email UID {e_mail['uid']} in {key}: {e!r}") from e
+            store_transaction(e_mail, llm_reasoning, llm_prediction, db_obj, account_name_map, acct_ids_dict)
+        except (ValueError, KeyError, TypeError) as e:
+            # Unparsable model output or unknown account: retrying would fail the same way
+            logger.error(f"Skipping email UID {e_mail['uid']} in {key}: {e!r}")
+        max_uids[key] = max(max_uids[key], int(e_mail["uid"]))
+        # No HIGHESTMODSEQ until the end of the folder, so an interrupted sync searches again
+        db_obj.set_last_seen_uid(key, max_uids[key], uidvalidity=email_handler.uidvalidity)
+        return 1
+
+    processed = 0
+    llm_concurrency = max(1, llm_concurrency)
+    llm_batch_size = max(1, llm_batch_size)
+    in_flight = llm_concurrency * llm_batch_size
+    extractor = ThreadPoolExecutor(max_workers=llm_concurrency, thread_name_prefix="extract")
+    # Emails waiting for their batch to fill up, with their slots
+    batch = []
+
+    def submit_batch():
+        if batch:
+            extraction = extractor.submit(transaction_handler.get_transactions, [e_mail for e_mail, _ in batch],
+                                          llm_prompt, batch_size=llm_batch_size, batch_tokens=llm_batch_tokens)
+            for index, (_, slot) in enumerate(batch):
+                slot.future, slot.index = extraction, index
+            batch.clear()
+    with ThreadPoolExecutor(max_workers=max(1, min(max_connections, len(email_handlers)))) as pool:
+        downloads = [pool.submit(download, key, email_handler) for key, email_handler in email_handlers.items()]
+
+        try:
+            pending = len(email_handlers)
+            # Emails (with their extraction) and end-of-folder markers, in arrival order
+            window = deque()
+            while pending or window:
+                # Never wait on an email whose batch has not been sent
+                if batch and (len(batch) >= llm_batch_size or len(window) >= in_flight or not pending):
+                    submit_batch()
+                # Store results in arrival order, waiting on the oldest once `in_flight` emails are being extracted
+                while window and (window[0][2] is None or window[0][2].done() or len(window) >= in_flight
+                                  or not pending):
+                    processed += finish(*window.popleft())
+                if not pending:
+                    continue
+                try:
+                    key, e_mail = emails.get(timeout=0.1 if window else 1)
+                except queue.Empty:
+                    # Nothing more to add to the batch for now
+                    submit_batch()
+                    # A download that died without reporting back would otherwise block forever
+                    if all(d.done() for d in downloads) and emails.empty():
+                        for d in downloads:
+                            d.result()
+                        raise RuntimeError("Email downloads ended without reporting completion")
+                    continue
+                if isinstance(e_mail, Exception) or e_mail is None:
+                    pending -= 1
+                    window.append((key, e_mail, None))
+                elif llm_batch_size > 1:
+                    slot = BatchSlot()
+                    batch.append((e_mail, slot))
+                    window.append((key, e_mail, slot))
+                else:
+                    window.append((key, e_mail, extractor.submit(transaction_handler.get_transaction, e_mail, llm_prompt)))
+        finally:
+            stop.set()
+            extractor.shutdown(cancel_futures=True)
+            # Results stored so far are written with their checkpoints even if the sync failed
+            db_obj.flush()
+
+    if failed:
+        message = f"Failed to sync {', '.join(failed)}"
+        if all(isinstance(e, CONNECTION_ERRORS) for e in failed.values()):
+            raise ConnectionError(message)
+        raise RuntimeError(message)
+    return processed
+
+
+def reprocess_emails(raw_store, keys, transaction_handler, db_obj, llm_prompt, account_name_map, acct_ids_dict):
+    """
+    Replay extraction over the emails kept in the raw email store, without contacting the IMAP server.
+
+    Checkpoints are left untouched. Emails from senders not in the transaction rules are skipped. Transactions
+    already stored for the emails are replaced by the new extraction (or removed, for emails now found not to be
+    transactions); an email whose extraction fails keeps what was stored.
+
+    Args:
+        raw_store (RawEmailStore): Store the emails were saved to while syncing.
+        keys (list): Checkpoint keys of the folders to replay (see `checkpoint_key`).
+        transaction_handler (TransactionHandler): Handler used to extract transactions with the LLM.
+        db_obj (DB): Database handler.
+        llm_prompt (str): Prompt built by `prompt_builder`.
+        account_name_map (dict): Lower-cased sender address to financial institution.
+        acct_ids_dict (dict): (financial_institution, account_number) to account ID, from `DB.get_account_ids_dict`.
+
+    Returns:
+        int: The number of emails processed.
+    """
+    processed = 0
+    for key in keys:
+        for uidvalidity, uid, raw_email in raw_store.iter_emails(key):
+            e_mail = EmailHandler.parse_email(str(uid).encode(), raw_email)
+            e_mail["folder"], e_mail["uidvalidity"] = key, uidvalidity
+            if parseaddr(e_mail["from_address"] or "")[1].lower() not in account_name_map:
+                continue
+            try:
+                process_email(e_mail, transaction_handler, db_obj, llm_prompt, account_name_map, acct_ids_dict, replace=True)
+            except (ValueError, KeyError, TypeError) as e:
+                logger.error(f"Skipping email UID {uid} in {key}: {e!r}")
+            processed += 1
+    db_obj.flush()
+    logger.info(f"Reprocessed {processed} stored emails")
+    return processed
+
+
+def checkpoint_key(folder, username=None):
+    """
+    Key of a folder in the email_checkpoints table.
+
+    Folders of the main mailbox are keyed by folder name alone, which keeps existing checkpoints valid;
+    folders of mailboxes from a mailboxes file are prefixed with their username.
+    """
+    return folder if username is None else f"{username}/{folder}"
+
+
+def split_watched_folders(email_handlers, max_connections):
+    """
+    Split folders between IMAP IDLE watchers and polling so daemon mode never holds more than `max_connections`
+    connections: every folder is watched with IDLE if they fit, otherwise `max_connections - 1` folders are and
+    the rest are polled over the last connection.
+
+    Returns:
+        tuple: The handlers watched with IDLE and the handlers polled, both keyed like `email_handlers`.
+    """
+    keys = list(email_handlers)
+    idle_count = len(keys) if len(keys) <= max_connections else max(0, max_connections - 1)
+    return ({key: email_handlers[key] for key in keys[:idle_count]},
+            {key: email_handlers[key] for key in keys[idle_count:]})
+
+
+def run_daemon(email_handler, sync, idle_timeout=29 * 60, max_backoff=300):
+    """
+    Keep the IMAP connection open and call `sync` whenever the server reports new emails via IMAP IDLE.
+
+    The IDLE command is renewed after a NOOP every `idle_timeout` seconds, and the connection is re-established
+    with exponential backoff when it drops. A failed sync (e.g. the model host is down) is logged and retried on
+    the next notification instead of ending the daemon. Runs until interrupted.
+
+    Args:
+        email_handler (EmailHandler): Handler for the folder to watch.
+        sync (callable): Called without arguments to process new emails; reuses `email_handler`'s connection.
+        idle_timeout (int, optional): Seconds before an IDLE command is renewed. Default: 1740 (29 minutes).
+        max_backoff (int, optional): Upper bound in seconds for the reconnect delay. Default: 300.
+    """
+    backoff = 1
+    new_emails = True
+    while True:
+        try:
+            if email_handler.imapb is None:
+                try:
+                    email_handler.imap_bridge()
+                except RuntimeError as e:
+                    raise ConnectionError(str(e)) from e
+                new_emails = True
+            if new_emails:
+                try:
+                    logger.info(f"Processed {sync()} new emails")
+                except CONNECTION_ERRORS:
+                    raise
+                except Exception as e:
+                    logger.error(f"Sync failed, retrying on the next notification: {e!r}")
+            logger.info("Waiting for new emails")
+            new_emails = email_handler.idle(timeout=idle_timeout)
+            if not new_emails:
+                email_handler.imapb.noop()
+            backoff = 1
+        except CONNECTION_ERRORS as e:
+            logger.error(f"Email connection lost: {e}. Reconnecting in {backoff}s")
+            email_handler.close()
+            time.sleep(backoff)
+            backoff = min(backoff * 2, max_backoff)
+
+
+def transactsync(email_host, email_port, username, password, folder, db_file, transaction_rules, prompt_file, model_host="http://localhost:11434", model="qwen3:8b", fetch_batch_size=100, server_side_filter=False, fetch_mode="partial", daemon=False, idle_timeout=29 * 60, mailboxes_file=None, max_connections=4, poll_interval=60, raw_store=None, reprocess=False, parse_workers=0, max_body_tokens=1000, llm_cache_max_entries=100000, llm_cache_max_age_days=365, llm_concurrency=1, llm_timeout=600, structured_output=False, num_predict=256, keep_alive="30m", pre_classifier=False, pre_classifier_model=None, template_spot_check=0, llm_batch_size=1, llm_batch_tokens=4000, escalation_model=None, write_batch_size=100):
     """
     Main synchronization routine for fetching emails, extracting transactions, and storing them in the database.
 
     - Loads transaction rules and builds the LLM prompt.
     - Bootstraps the database, including inserting/updating accounts from rules.
-    - Fetches new emails from the specified folder since the last checkpoint (UID).
-    - For each email, uses the LLM to extract transaction details and stores valid transactions in the DB.
-    - Updates the checkpoint (last seen UID) in the DB for the folder.
+    - Fetches new emails from each folder (of each mailbox) since its last checkpoint (UID), downloading folders in
+      parallel and bodies only for emails sent from an address listed in the transaction rules.
+    - For each email, extracts transaction details with the institution's extraction patterns when they match, otherwise
+      with the LLM, and stores valid transactions in the DB.
+    - Updates the checkpoint (last seen UID) in the DB for each folder.
+    - In daemon mode, keeps the connections and model warm and repeats the sync whenever IMAP IDLE reports new emails.
 
     Args:
         email_host (str): IMAP server address.
         email_port (int): IMAP server port.
         username (str): Email account username.
         password (str): Email account password.
-        folder (str): Email folder to fetch from.
+        folder (str or list): Email folder(s) to fetch from, as a list or a comma-separated string.
         db_file (str): Path to DuckDB database file.
         transaction_rules (str): Path to transaction rules YAML file.
         prompt_file (str): Path to prompt template file.
         model_host (str, optional): LLM model host URL. Default: "http://localhost:11434".
         model (str, optional): LLM model name. Default: "qwen3:8b".
-    """
-
-    """
-    Main synchronization routine for fetching emails, extracting transactions, and storing them in the database.
-    The checkpoint (last seen UID) is now stored in the database, not an external file.
+        fetch_batch_size (int, optional): Number of emails fetched per IMAP round trip. Default: 100.
+        server_side_filter (bool, optional): Also filter senders with IMAP SEARCH on the server. Default: False.
+        fetch_mode (str, optional): "partial" downloads only the text part of each email, "full" the whole message. Default: "partial".
+        daemon (bool, optional): Keep running and process new emails as they arrive. Default: False.
+        idle_timeout (int, optional): Seconds before an IMAP IDLE command is renewed in daemon mode. Default: 1740.
+        mailboxes_file (str, optional): YAML file listing additional mailboxes, each with `email_host`,
+            `email_port`, `username`, `password` and `folders`. Default: None.
+        max_connections (int, optional): Maximum number of IMAP connections used in parallel. Default: 4.
+        poll_interval (int, optional): Seconds between polls of folders that do not fit in `max_connections`
+            IDLE connections in daemon mode. Default: 60.
+        raw_store (str, optional): Directory where raw emails are kept for later reprocessing. Default: None.
+        reprocess (bool, optional): Replay extraction from `raw_store` instead of fetching emails. Default: False.
+        parse_workers (int, optional): Processes used per folder to decode emails and convert HTML to text,
+            0 decodes in the download thread. Default: 0.
+        max_body_tokens (int, optional): Token budget for each email body sent to the model, after whitespace and
+            learned per-sender boilerplate are removed; 0 removes only those. Default: 1000.
+        llm_cache_max_entries (int, optional): Model outputs kept in the database cache, least recently used
+            first out; 0 disables the cache. Default: 100000.
+        llm_cache_max_age_days (int, optional): Days a cached model output is kept after its last use. Default: 365.
+        llm_concurrency (int, optional): Emails sent to the model at the same time; match the Ollama server's
+            `OLLAMA_NUM_PARALLEL`. Default: 1.
+        llm_timeout (float, optional): Seconds before a model request is abandoned; the email is retried on the
+            next sync. Default: 600.
+        structured_output (bool, optional): Constrain the model output to the transaction JSON schema with thinking
+            disabled. Default: False.
+        num_predict (int, optional): Maximum tokens generated per email in structured output mode. Default: 256.
+        keep_alive (str or float, optional): How long Ollama keeps the model loaded after a request, as seconds or
+            a duration like "30m" (-1 keeps it loaded). Default: "30m".
+        pre_classifier (bool, optional): Skip the model for emails whose subject matches none of the `subject`
+            patterns of their sender in the transaction rules. Default: False.
+        pre_classifier_model (str, optional): Small Ollama model asked whether an email is a purchase before the
+            extraction model. Default: None.
+        template_spot_check (int, optional): Learn extraction templates from the model's output and reuse them for
+            structurally identical emails, checking every this many reuses against the model; 0 disables
+            templates. Default: 0.
+        llm_batch_size (int, optional): Emails sent to the model in one request; the instructions are then
+            evaluated once per batch. Default: 1.
+        llm_batch_tokens (int, optional): Maximum estimated tokens of email content per batched request. Default: 4000.
+        escalation_model (str, optional): Larger model the email is sent to when the output of `model` does not
+            parse or fails validation (amount, known account number, date near the email date, merchant). Default: None.
+        write_batch_size (int, optional): Transactions and checkpoints written to the database together, in one
+            database transaction (also every 5 seconds and at the end of each sync). Default: 100.
     """
     with open(transaction_rules, "r") as file:
         transaction_filters = yaml.safe_load(file)
 
+    llm_prompt = prompt_builder(transaction_filters, prompt_file)
+    db_obj = DB(db_file, write_batch_size=write_batch_size)
+    classifier = None
+    if pre_classifier_model:
+        classifier = ModelClassifier(logger, pre_classifier_model, model_host=model_host, timeout=llm_timeout,
+                                     keep_alive=keep_alive)
+    if pre_classifier:
+        classifier = SubjectClassifier(transaction_filters, next_classifier=classifier)
+    # Checks, pulls and warms up the model in the background, overlapping the database setup and email downloads
+    transaction_handler = TransactionHandler(logger=logger, model_host=model_host, model=model, timeout=llm_timeout,
+                                             structured_output=structured_output, num_predict=num_predict,
+                                             keep_alive=keep_alive, warm_up_prompt=llm_prompt,
+                                             compactor=BodyCompactor(max_tokens=max_body_tokens,
+                                                                     transaction_filters=transaction_filters),
+                                             extractor=RuleExtractor(transaction_filters), classifier=classifier,
+                                             templates=TemplateLearner(transaction_filters, spot_check_every=template_spot_check)
+                                             if template_spot_check else None,
+                                             cache=db_obj if llm_cache_max_entries else None,
+                                             escalation_model=escalation_model,
+                                             validator=PredictionValidator(transaction_filters) if escalation_model else None)
+
     # Prepare accounts for bootstrap
     accounts = []
     for account, details in transaction_filters["credit_cards"].items():
@@ -88,53 +529,92 @@ def transactsync(email_host, email_port, username, password, folder, db_file, tr
                 "comments": details.get("comments", "")
             })
 
-    db_obj = DB(db_file)
     db_obj.bootstrap(accounts=accounts)
     logger.info("Bootstrap Complete.")
 
-    llm_prompt = prompt_builder(transaction_filters, prompt_file)
-
-    last_seen_uid = db_obj.get_last_seen_uid(folder)
-    logger.info(f"last_seen_uid: {last_seen_uid}")
-    max_uid = -1 if last_seen_uid is None else last_seen_uid
-
-    email_handler = EmailHandler(logger, email_host, email_port, username, password, folder)
-    e_mails = email_handler.get_emails(last_seen_uid=last_seen_uid)
-
-    logger.info(f"Found {len(e_mails)} new emails")
-
     account_name_map = {}
     for account in transaction_filters["credit_cards"].keys():
         for from_address in transaction_filters["credit_cards"][account]["from_address"]:
-            account_name_map[from_address] = transaction_filters["credit_cards"][account]["financial_institution"]
+            account_name_map[from_address.lower()] = transaction_filters["credit_cards"][account]["financial_institution"]
 
     acct_ids_dict = db_obj.get_account_ids_dict()
-    transaction_handler = TransactionHandler(logger=logger, model_host=model_host, model=model)
-
-    for e_mail in e_mails:
-        llm_reasoning, llm_prediction = transaction_handler.get_transaction(e_mail, llm_prompt)
-        _, e_mail['from_address'] = parseaddr(e_mail['from_address'])
-        _, e_mail['to_address'] = parseaddr(e_mail['to_address'])
-        if llm_prediction and llm_prediction["transaction_flag"] == True:
-            financial_institution = account_name_map[e_mail['from_address']]
-            account_id = acct_ids_dict[(financial_institution, llm_prediction['account_number'])]
-            llm_reasoning = llm_reasoning.replace('"', '`').replace("'", "`")
-            logger.info(f"from_address: {e_mail["from_address"]}")
-            logger.info(f"to_address: {e_mail["to_address"]}")
-            logger.info(f"email_uid: {e_mail['uid']}")
-            logger.info(f"email_date: {e_mail["email_date"]}")
-            logger.info(f"email_subject: {e_mail["subject"]}")
-            logger.info(f"llm_prediction: {llm_prediction}")
-            # logger.info(f"llm_reasoning: {llm_reasoning}")
-            db_obj.save_transaction(e_mail=e_mail, llm_reasoning=llm_reasoning, llm_prediction=llm_prediction, account_id=account_id)
-            logger.info("Transaction stored to DB")
-        elif llm_prediction["transaction_flag"] == False:
-            logger.info("Skipping non-transaction")
-            # logger.info(f"from_address: {e_mail["from_address"]}")
-            # logger.info(f"email_subject: {e_mail["subject"]}")
-        # print("-" * 100)
-        max_uid = max(max_uid, int(e_mail["uid"]))
-        db_obj.set_last_seen_uid(folder, max_uid)
+    if llm_cache_max_entries:
+        evicted = db_obj.evict_llm_cache(max_entries=llm_cache_max_entries, max_age_days=llm_cache_max_age_days)
+        logger.info(f"Evicted {evicted} cached model outputs")
+
+    folders = [f.strip() for f in folder.split(",") if f.strip()] if isinstance(folder, str) else list(folder)
+    mailboxes = [{"email_host": email_host, "email_port": email_port, "username": username, "password": password,
+                  "folders": folders, "main": True}]
+    if mailboxes_file:
+        with open(mailboxes_file, "r") as file:
+            mailboxes.extend(yaml.safe_load(file)["mailboxes"])
+
+    store = RawEmailStore(raw_store) if raw_store else None
+
+    email_handlers = {}
+    for mailbox in mailboxes:
+        for mailbox_folder in mailbox["folders"]:
+            key = checkpoint_key(mailbox_folder, None if mailbox.get("main") else mailbox["username"])
+            email_handlers[key] = EmailHandler(logger, mailbox["email_host"], mailbox["email_port"], mailbox["username"],
+                                               mailbox["password"], mailbox_folder,
+                                               fetch_batch_size=fetch_batch_size, sender_filter=account_name_map.keys(),
+                                               server_side_filter=server_side_filter, fetch_mode=fetch_mode,
+                                               raw_store=store, store_key=key, parse_workers=parse_workers)
+
+    if reprocess:
+        if store is None:
+            raise ValueError("Reprocessing needs a raw email store (raw_store)")
+        reprocess_emails(store, list(email_handlers), transaction_handler, db_obj, llm_prompt, account_name_map, acct_ids_dict)
+        return
+
+    def sync(handlers):
+        return sync_folders(handlers, transaction_handler, db_obj, llm_prompt, account_name_map, acct_ids_dict,
+                            max_connections=max_connections, llm_concurrency=llm_concurrency,
+                            llm_batch_size=llm_batch_size, llm_batch_tokens=llm_batch_tokens)
+
+    if not daemon:
+        sync(email_handlers)
+        return
+
+    # IDLE watches a single folder over its own connection; syncs run one at a time
+    sync_lock = threading.Lock()
+    idle_handlers, polled_handlers = split_watched_folders(email_handlers, max_connections)
+
+    def watch(key, email_handler):
+        def sync_folder():
+            with sync_lock:
+                return sync({key: email_handler})
+        run_daemon(email_handler, sync_folder, idle_timeout=idle_timeout)
+
+    def poll():
+        # Folders beyond the IDLE budget share the one remaining connection
+        while True:
+            with sync_lock:
+                try:
+                    sync_folders(polled_handlers, transaction_handler, db_obj, llm_prompt, account_name_map,
+                                 acct_ids_dict, max_connections=1, llm_concurrency=llm_concurrency,
+                                 llm_batch_size=llm_batch_size, llm_batch_tokens=llm_batch_tokens)
+                except Exception as e:
+                    logger.error(f"Polling failed: {e!r}")
+            time.sleep(poll_interval)
+
+    # SIGTERM (e.g. `docker stop`) ends the daemon like Ctrl+C does
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    watchers = [threading.Thread(target=watch, args=item, name=f"watch-{item[0]}", daemon=True)
+                for item in idle_handlers.items()]
+    if polled_handlers:
+        logger.info(f"Polling {', '.join(polled_handlers)} every {poll_interval}s")
+        watchers.append(threading.Thread(target=poll, name="poll", daemon=True))
+    try:
+        for watcher in watchers:
+            watcher.start()
+        while any(watcher.is_alive() for watcher in watchers):
+            time.sleep(1)
+    except KeyboardInterrupt:
+        logger.info("Stopping daemon")
+    finally:
+        for email_handler in email_handlers.values():
+            email_handler.close()
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
@@ -166,7 +646,7 @@ if __name__ == "__main__":
     )
     parser.add_argument(
         "--folder", 
-        help="Folder Name", 
+        help="Folder Name, or a comma-separated list of folders synced in parallel", 
         default=os.environ.get("EMAIL_FOLDER", "INBOX"),
         required=False
     )
@@ -197,6 +677,178 @@ if __name__ == "__main__":
         default=os.environ.get("MODEL_NAME", "qwen3:8b"),
         required=False         
     )
+    parser.add_argument(
+        "--escalation_model", 
+        help="Larger model used when the output of --model fails validation (default: none)", 
+        default=os.environ.get("ESCALATION_MODEL") or None,
+        required=False
+    )
+    parser.add_argument(
+        "--server_side_filter", 
+        help="Also filter senders on the IMAP server with SEARCH FROM", 
+        action="store_true",
+        default=os.environ.get("SERVER_SIDE_FILTER", "").lower() in ("1", "true", "yes")
+    )
+    parser.add_argument(
+        "--mailboxes_file", 
+        help="YAML file listing additional mailboxes to sync", 
+        default=os.environ.get("MAILBOXES_FILE"),
+        required=False
+    )
+    parser.add_argument(
+        "--max_connections", 
+        help="Maximum number of IMAP connections used in parallel (default: 4)", 
+        type=int,
+        default=int(os.environ.get("MAX_CONNECTIONS", 4)),
+        required=False
+    )
+    parser.add_argument(
+        "--poll_interval", 
+        help="Seconds between polls of folders beyond max_connections in daemon mode (default: 60)", 
+        type=int,
+        default=int(os.environ.get("POLL_INTERVAL", 60)),
+        required=False
+    )
+    parser.add_argument(
+        "--raw_store", 
+        help="Directory where raw emails are kept, so extraction can be replayed with --reprocess", 
+        default=os.environ.get("RAW_STORE"),
+        required=False
+    )
+    parser.add_argument(
+        "--reprocess", 
+        help="Replay extraction from the raw email store instead of fetching emails from IMAP", 
+        action="store_true"
+    )
+    parser.add_argument(
+        "--daemon", 
+        help="Keep running and process new emails as soon as the IMAP server reports them (IMAP IDLE)", 
+        action="store_true",
+        default=os.environ.get("DAEMON", "").lower() in ("1", "true", "yes")
+    )
+    parser.add_argument(
+        "--idle_timeout", 
+        help="Seconds before an IMAP IDLE command is renewed in daemon mode (default: 1740)", 
+        type=int,
+        default=int(os.environ.get("IDLE_TIMEOUT", 29 * 60)),
+        required=False
+    )
+    parser.add_argument(
+        "--fetch_mode", 
+        help="partial: download only the text part of each email, full: download whole messages (default: partial)", 
+        choices=["partial", "full"],
+        default=os.environ.get("FETCH_MODE", "partial"),
+        required=False
+    )
+    parser.add_argument(
+        "--template_spot_check", 
+        help="Reuse extraction templates learned from the model for identical alerts, checking every N reuses against the model; 0 disables (default: 0)", 
+        type=int,
+        default=int(os.environ.get("TEMPLATE_SPOT_CHECK", 0)),
+        required=False
+    )
+    parser.add_argument(
+        "--pre_classifier", 
+        help="Skip the model for emails whose subject matches none of their sender's subject patterns", 
+        action="store_true",
+        default=os.environ.get("PRE_CLASSIFIER", "").lower() in ("1", "true", "yes")
+    )
+    parser.add_argument(
+        "--pre_classifier_model", 
+        help="Small Ollama model asked whether an email is a purchase before the extraction model, e.g. qwen3:0.6b", 
+        default=os.environ.get("PRE_CLASSIFIER_MODEL"),
+        required=False
+    )
+    parser.add_argument(
+        "--keep_alive", 
+        help="How long Ollama keeps the model loaded after a request, seconds or a duration like 30m, -1 for always (default: 30m)", 
+        type=lambda value: float(value) if value.lstrip("-").replace(".", "", 1).isdigit() else value,
+        default=os.environ.get("KEEP_ALIVE", "30m"),
+        required=False
+    )
+    parser.add_argument(
+        "--structured_output", 
+        help="Constrain the model output to the transaction JSON schema and disable thinking", 
+        action="store_true",
+        default=os.environ.get("STRUCTURED_OUTPUT", "").lower() in ("1", "true", "yes")
+    )
+    parser.add_argument(
+        "--num_predict", 
+        help="Maximum tokens generated per email with --structured_output (default: 256)", 
+        type=int,
+        default=int(os.environ.get("NUM_PREDICT", 256)),
+        required=False
+    )
+    parser.add_argument(
+        "--llm_concurrency", 
+        help="Emails sent to the model at the same time, e.g. OLLAMA_NUM_PARALLEL (default: 1)", 
+        type=int,
+        default=int(os.environ.get("LLM_CONCURRENCY", 1)),
+        required=False
+    )
+    parser.add_argument(
+        "--llm_batch_size", 
+        help="Emails sent to the model in one request (default: 1)", 
+        type=int,
+        default=int(os.environ.get("LLM_BATCH_SIZE", 1)),
+        required=False
+    )
+    parser.add_argument(
+        "--llm_batch_tokens", 
+        help="Maximum estimated tokens of email content per batched model request (default: 4000)", 
+        type=int,
+        default=int(os.environ.get("LLM_BATCH_TOKENS", 4000)),
+        required=False
+    )
+    parser.add_argument(
+        "--llm_timeout", 
+        help="Seconds before a model request is abandoned and the email left for the next sync (default: 600)", 
+        type=float,
+        default=float(os.environ.get("LLM_TIMEOUT", 600)),
+        required=False
+    )
+    parser.add_argument(
+        "--llm_cache_max_entries", 
+        help="Model outputs kept in the database cache, 0 disables the cache (default: 100000)", 
+        type=int,
+        default=int(os.environ.get("LLM_CACHE_MAX_ENTRIES", 100000)),
+        required=False
+    )
+    parser.add_argument(
+        "--llm_cache_max_age_days", 
+        help="Days a cached model output is kept after its last use (default: 365)", 
+        type=int,
+        default=int(os.environ.get("LLM_CACHE_MAX_AGE_DAYS", 365)),
+        required=False
+    )
+    parser.add_argument(
+        "--max_body_tokens", 
+        help="Token budget for each email body sent to the model, 0 for no limit (default: 1000)", 
+        type=int,
+        default=int(os.environ.get("MAX_BODY_TOKENS", 1000)),
+        required=False
+    )
+    parser.add_argument(
+        "--parse_workers", 
+        help="Processes used per folder to decode emails and convert HTML to text, 0 decodes inline (default: 0)", 
+        type=int,
+        default=int(os.environ.get("PARSE_WORKERS", 0)),
+        required=False
+    )
+    parser.add_argument(
+        "--write_batch_size", 
+        help="Transactions and checkpoints written to the database in one database transaction (default: 100)", 
+        type=int,
+        default=int(os.environ.get("WRITE_BATCH_SIZE", 100)),
+        required=False
+    )
+    parser.add_argument(
+        "--fetch_batch_size", 
+        help="Number of emails fetched per IMAP round trip (default: 100)", 
+        type=int,
+        default=int(os.environ.get("FETCH_BATCH_SIZE", 100)),
+        required=False
+    )
     args = parser.parse_args()
 
     # Validate required arguments (env or CLI)
@@ -213,9 +865,23 @@ if __name__ == "__main__":
         missing.append("folder (or EMAIL_FOLDER env var)")
     if missing:
         parser.error("Missing required arguments: " + ", ".join(missing))
+    if args.reprocess and not args.raw_store:
+        parser.error("--reprocess needs --raw_store (or RAW_STORE env var)")
 
     transactsync(
         args.email_host, args.email_port, args.username, args.password, args.folder, args.db_file,
         args.transaction_rules, args.prompt_file,
-        model_host=args.model_host, model=args.model
+        model_host=args.model_host, model=args.model, fetch_batch_size=args.fetch_batch_size,
+        server_side_filter=args.server_side_filter, fetch_mode=args.fetch_mode,
+        daemon=args.daemon, idle_timeout=args.idle_timeout,
+        mailboxes_file=args.mailboxes_file, max_connections=args.max_connections,
+        poll_interval=args.poll_interval, raw_store=args.raw_store, reprocess=args.reprocess,
+        parse_workers=args.parse_workers, max_body_tokens=args.max_body_tokens,
+        llm_cache_max_entries=args.llm_cache_max_entries, llm_cache_max_age_days=args.llm_cache_max_age_days,
+        llm_concurrency=args.llm_concurrency, llm_timeout=args.llm_timeout,
+        structured_output=args.structured_output, num_predict=args.num_predict, keep_alive=args.keep_alive,
+        pre_classifier=args.pre_classifier, pre_classifier_model=args.pre_classifier_model,
+        template_spot_check=args.template_spot_check, llm_batch_size=args.llm_batch_size,
+        llm_batch_tokens=args.llm_batch_tokens, escalation_model=args.escalation_model,
+        write_batch_size=args.write_batch_size
     )
\ No newline at end of file
@@ -0,0 +1,89 @@
+import re
+import json
+from ollama import Client
+from email.utils import parseaddr
+
+# Placeholders used in the `subject` lists of transaction_rules.yaml, e.g. "You made a $XX.XX transaction with X"
+PLACEHOLDER_RE = re.compile(r"\bX+(?:\.X+)?\b")
+MODEL_PROMPT = """You sort bank emails. Answer with JSON {"purchase": true} if the email reports a single credit card
+purchase or charge, and {"purchase": false} for anything else: statements, payments, transfers, deposits,
+withdrawals, security notices and marketing."""
+
+
+class SubjectClassifier:
+    """
+    Reject emails whose subject matches none of the `subject` patterns listed for their sender in
+    `transaction_rules.yaml`, before they reach the extraction model.
+
+    `X` runs in the patterns (`$XX.XX`, `with X`) match anything and patterns may match anywhere in the subject,
+    case-insensitively. Senders without subject patterns are not rejected. Emails that pass are handed to
+    `next_classifier`, when given.
+    """
+
+    def __init__(self, transaction_filters, next_classifier=None):
+        self.next_classifier = next_classifier
+        self.patterns = {}
+        for details in transaction_filters.get("credit_cards", {}).values():
+            for from_address in details.get("from_address", []):
+                patterns = self.patterns.setdefault(from_address.lower(), [])
+                patterns.extend(self.subject_pattern(subject) for subject in details.get("subject") or [])
+
+    @staticmethod
+    def subject_pattern(subject: str):
+        return re.compile(".+?".join(re.escape(part) for part in PLACEHOLDER_RE.split(str(subject).strip())),
+                          re.IGNORECASE)
+
+    def classify(self, e_mail: dict) -> tuple:
+        """
+        Decide whether an email may be a transaction.
+
+        Args:
+            e_mail (dict): Email details ('from_address', 'subject', 'body').
+
+        Returns:
+            tuple: (True if the email should go to the extraction model, reason for the decision).
+        """
+        patterns = self.patterns.get(parseaddr(e_mail.get("from_address") or "")[1].lower())
+        if patterns and not any(pattern.search(e_mail.get("subject") or "") for pattern in patterns):
+            return False, f"subject {e_mail.get('subject')!r} matches no subject pattern of the sender"
+        if self.next_classifier is not None:
+            return self.next_classifier.classify(e_mail)
+        return True, "subject matches"
+
+
+class ModelClassifier:
+    """
+    Ask a small local model whether an email reports a purchase, as a cheap filter before the extraction model.
+
+    Errors (e.g. the model is not pulled) let the email through, so a broken classifier never drops transactions.
+    """
+
+    def __init__(self, logger, model, model_host="http://localhost:11434", timeout=None, keep_alive=None, max_chars=2000):
+        self.logger = logger
+        self.model = model
+        self.keep_alive = keep_alive
+        self.max_chars = max_chars
+        self.llm_bridge = Client(host=model_host, timeout=timeout)
+
+    def classify(self, e_mail: dict) -> tuple:
+        """
+        Decide whether an email may be a transaction.
+
+        Args:
+            e_mail (dict): Email details ('subject', 'body').
+
+        Returns:
+            tuple: (True if the email should go to the extraction model, reason for the decision).
+        """
+        prompt = f"subject: {e_mail.get('subject')}\n\nbody:\n{(e_mail.get('body') or '')[:self.max_chars]}"
+        try:
+            response = self.llm_bridge.generate(
+                model=self.model, system=MODEL_PROMPT, prompt=prompt, think=False, keep_alive=self.keep_alive,
+                format={"type": "object", "properties": {"purchase": {"type": "boolean"}}, "required": ["purchase"]},
+                options={"num_predict": 16}
+            ).response
+            purchase = json.loads(response)["purchase"]
+        except Exception as e:
+            self.logger.warning(f"Pre-classifier model {self.model} failed, keeping the email: {e!r}")
+            return True, "classifier model failed"
+        return bool(purchase), f"{self.model} says {'purchase' if purchase else 'not a purchase'}"
@@ -0,0 +1,72 @@
+from datetime import datetime, timedelta
+from email.utils import parseaddr
+from rule_extractor import RuleExtractor
+
+
+class PredictionValidator:
+    """
+    Check a model's prediction before it is trusted, to decide whether to escalate the email to a larger model.
+
+    A transaction is valid when its amount is a positive number, its account number is one of the sender's
+    `account_numbers` in `transaction_rules.yaml` (the accounts bootstrapped into the database), its date parses
+    and falls within `max_date_days` before the email date (or a day after, for time zones), and its merchant is
+    not empty. Non-transactions only need a boolean `transaction_flag`.
+    """
+
+    def __init__(self, transaction_filters, max_date_days=7):
+        self.max_date_days = max_date_days
+        self.account_numbers = {}
+        for details in transaction_filters.get("credit_cards", {}).values():
+            for from_address in details.get("from_address", []):
+                account_numbers = self.account_numbers.setdefault(from_address.lower(), set())
+                account_numbers.update(str(n) for n in details.get("account_numbers", []))
+
+    @staticmethod
+    def parse_date(value, email_date: str) -> datetime:
+        value = str(value).strip()
+        try:
+            return datetime.fromisoformat(value)
+        except ValueError:
+            parsed = RuleExtractor.parse_date(value, None, email_date)
+        if parsed is None:
+            raise ValueError(f"unrecognized date {value!r}")
+        return parsed
+
+    def validate(self, e_mail: dict, prediction) -> str:
+        """
+        Validate a prediction for an email.
+
+        Args:
+            e_mail (dict): Email details ('from_address', 'email_date').
+            prediction (dict): The model's prediction.
+
+        Returns:
+            str: Why the prediction is not valid, or None if it is.
+        """
+        if not isinstance(prediction, dict) or not isinstance(prediction.get("transaction_flag"), bool):
+            return "no boolean transaction_flag"
+        if not prediction["transaction_flag"]:
+            return None
+
+        try:
+            amount = float(str(prediction.get("transaction_amount")).replace(",", "").lstrip("$"))
+        except ValueError:
+            return f"amount {prediction.get('transaction_amount')!r} is not a number"
+        if amount <= 0:
+            return f"amount {amount} is not positive"
+
+        account_numbers = self.account_numbers.get(parseaddr(e_mail.get("from_address") or "")[1].lower(), set())
+        if str(prediction.get("account_number")) not in account_numbers:
+            return f"account number {prediction.get('account_number')!r} is not a known account of the sender"
+
+        try:
+            email_date = datetime.fromisoformat(e_mail["email_date"]).replace(tzinfo=None)
+            transaction_date = self.parse_date(prediction.get("transaction_date"), e_mail["email_date"]).replace(tzinfo=None)
+        except (KeyError, TypeError, ValueError) as e:
+            return f"date does not parse: {e}"
+        if not email_date.date() - timedelta(days=self.max_date_days) <= transaction_date.date() <= email_date.date() + timedelta(days=1):
+            return f"date {transaction_date.date()} is too far from the email date {email_date.date()}"
+
+        if not str(prediction.get("merchant") or "").strip():
+            return "merchant is empty"
+        return None
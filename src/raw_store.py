@@ -0,0 +1,85 @@
+import os
+import gzip
+import json
+import hashlib
+import threading
+from urllib.parse import quote
+
+class RawEmailStore:
+    """
+    Local, content-addressed store of raw email bytes, so extraction can be replayed without refetching from IMAP.
+
+    Layout under `root`:
+    - `objects/<sha256[:2]>/<sha256>.eml.gz`: gzip-compressed raw messages, stored once per distinct content.
+    - `index/<folder>.jsonl`: one line per stored email with its `uidvalidity`, `uid` and `sha256`.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.lock = threading.Lock()
+        os.makedirs(os.path.join(self.root, "objects"), exist_ok=True)
+        os.makedirs(os.path.join(self.root, "index"), exist_ok=True)
+
+    def object_path(self, sha256):
+        return os.path.join(self.root, "objects", sha256[:2], f"{sha256}.eml.gz")
+
+    def index_path(self, folder):
+        return os.path.join(self.root, "index", f"{quote(folder, safe='')}.jsonl")
+
+    def put(self, folder, uidvalidity, uid, raw_email: bytes) -> str:
+        """
+        Store a raw email and record it in the folder's index.
+
+        Args:
+            folder (str): Folder key the email was fetched from.
+            uidvalidity (int or None): UIDVALIDITY of the folder when the email was fetched.
+            uid (bytes or int): UID of the email.
+            raw_email (bytes): The raw RFC822 message.
+
+        Returns:
+            str: The SHA-256 content hash of the email.
+        """
+        sha256 = hashlib.sha256(raw_email).hexdigest()
+        path = self.object_path(sha256)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write to a temporary file first so a crash never leaves a truncated object behind
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with gzip.open(tmp_path, "wb") as f:
+                f.write(raw_email)
+            os.replace(tmp_path, path)
+
+        entry = {"uidvalidity": uidvalidity, "uid": int(uid), "sha256": sha256}
+        with self.lock, open(self.index_path(folder), "a") as f:
+            f.write(json.dumps(entry) + "\n")
+        return sha256
+
+    def get(self, sha256) -> bytes:
+        """
+        Read a stored email by content hash.
+        """
+        with gzip.open(self.object_path(sha256), "rb") as f:
+            return f.read()
+
+    def iter_emails(self, folder):
+        """
+        Yield the emails stored for a folder in (uidvalidity, uid) order, each (uidvalidity, uid) only once.
+
+        Args:
+            folder (str): Folder key the emails were fetched from.
+
+        Yields:
+            tuple: (uidvalidity, uid, raw_email) for each stored email.
+        """
+        if not os.path.exists(self.index_path(folder)):
+            return
+
+        entries = {}
+        with open(self.index_path(folder), "r") as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    entries[(entry["uidvalidity"] or 0, entry["uid"])] = entry["sha256"]
+
+        for (uidvalidity, uid), sha256 in sorted(entries.items()):
+            yield uidvalidity, uid, self.get(sha256)
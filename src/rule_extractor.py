@@ -0,0 +1,137 @@
+import re
+from datetime import datetime
+from email.utils import parseaddr
+
+# Formats tried, in order, for dates captured by the `date` pattern when no `date_format` is configured
+DATE_FORMATS = ["%m/%d/%Y", "%m/%d/%y", "%Y-%m-%d", "%b %d, %Y", "%B %d, %Y", "%d %b %Y", "%m/%d", "%b %d", "%B %d"]
+FIELDS = ["amount", "date", "merchant", "account_number"]
+
+
+class RuleExtractor:
+    """
+    Extract transactions from alert emails with per-institution regex patterns, without calling the model.
+
+    Patterns are read from the optional `extraction` section of each credit card in `transaction_rules.yaml`:
+
+        extraction:
+          subject: 'You made a credit card purchase of \\$'   # optional, the subject must match
+          amount: 'Amount:\\s*\\$([\\d,]+\\.\\d{2})'
+          date: 'Date:\\s*(\\d{2}/\\d{2}/\\d{4})'            # optional, defaults to the email date
+          date_format: '%m/%d/%Y'                          # optional
+          merchant: 'Merchant:\\s*(.+)'
+          account_number: 'ending in (\\d{4})'              # optional when the card has one account number
+
+    Each pattern is searched in the email body; its `value` group (or else its first group) is the field value.
+    An email is only extracted when every configured pattern matches and the values validate; otherwise
+    `extract` returns None and the caller falls back to the model.
+    """
+
+    def __init__(self, transaction_filters):
+        self.rules = {}
+        for details in transaction_filters.get("credit_cards", {}).values():
+            extraction = details.get("extraction")
+            if not extraction:
+                continue
+            rule = {
+                "financial_institution": details["financial_institution"],
+                "account_numbers": [str(n) for n in details.get("account_numbers", [])],
+                "date_format": extraction.get("date_format"),
+                "patterns": {
+                    field: re.compile(extraction[field], re.IGNORECASE | re.MULTILINE)
+                    for field in ["subject"] + FIELDS if extraction.get(field)
+                }
+            }
+            for from_address in details.get("from_address", []):
+                self.rules.setdefault(from_address.lower(), []).append(rule)
+
+    @staticmethod
+    def search(pattern, text):
+        match = pattern.search(text or "")
+        if match is None:
+            return None
+        if "value" in pattern.groupindex:
+            return match.group("value").strip()
+        return (match.group(1) if pattern.groups else match.group(0)).strip()
+
+    @staticmethod
+    def parse_date(value, date_format, email_date):
+        """
+        Parse a captured date, taking the year from the email when the alert leaves it out.
+        """
+        reference = datetime.fromisoformat(email_date) if email_date else datetime.now()
+        for fmt in [date_format] if date_format else DATE_FORMATS:
+            if "%y" in fmt.lower():
+                candidates = [(value, fmt)]
+            else:
+                # An alert for late December read in early January is from the previous year
+                candidates = [(f"{value} {year}", f"{fmt} %Y") for year in (reference.year, reference.year - 1)]
+            for candidate, candidate_fmt in candidates:
+                try:
+                    parsed = datetime.strptime(candidate, candidate_fmt)
+                except ValueError:
+                    continue
+                if len(candidates) == 1 or parsed.date() <= reference.date():
+                    return parsed
+        return None
+
+    def apply(self, rule, e_mail) -> dict:
+        patterns = rule["patterns"]
+        if "subject" in patterns and not patterns["subject"].search(e_mail.get("subject") or ""):
+            return None
+
+        values = {}
+        for field in FIELDS:
+            if field in patterns:
+                values[field] = self.search(patterns[field], e_mail.get("body"))
+                if not values[field]:
+                    return None
+
+        try:
+            amount = float(values["amount"].replace(",", "").lstrip("$"))
+        except (KeyError, ValueError):
+            return None
+        if amount <= 0:
+            return None
+
+        account_number = values.get("account_number")
+        if account_number is None and len(rule["account_numbers"]) == 1:
+            account_number = rule["account_numbers"][0]
+        if account_number not in rule["account_numbers"]:
+            return None
+
+        email_date = e_mail.get("email_date")
+        if "date" in values:
+            transaction_date = self.parse_date(values["date"], rule["date_format"], email_date)
+            if transaction_date is None:
+                return None
+        else:
+            transaction_date = datetime.fromisoformat(email_date)
+
+        return {
+            "account_number": account_number,
+            "transaction_amount": amount,
+            "transaction_date": transaction_date.replace(tzinfo=None).isoformat(),
+            "merchant": values.get("merchant", ""),
+            "transaction_flag": True
+        }
+
+    def extract(self, e_mail: dict):
+        """
+        Extract the transaction from an email with the patterns of its sender's institution.
+
+        Args:
+            e_mail (dict): Email details ('from_address', 'email_date', 'subject', 'body').
+
+        Returns:
+            tuple or None: (financial_institution, prediction dict in the model's output format), or None when
+            no pattern set matches the email.
+        """
+        sender = parseaddr(e_mail.get("from_address") or "")[1].lower()
+        for rule in self.rules.get(sender, []):
+            try:
+                prediction = self.apply(rule, e_mail)
+            except (TypeError, ValueError):
+                prediction = None
+            if prediction is not None:
+                return rule["financial_institution"], prediction
+        return None
@@ -0,0 +1,67 @@
+import argparse
+from db import DB
+
+
+def spend_report(db_file, grain="month", by=(), start=None, end=None, rebuild=False) -> list:
+    """
+    Read spend totals from the rollups of a transactsync database, optionally rebuilding them first.
+
+    Args:
+        db_file (str): Path to DuckDB database file.
+        grain (str, optional): "day" or "month". Default: "month".
+        by (list[str], optional): Also group by "account" and/or "merchant". Default: ().
+        start (str, optional): First day included, as YYYY-MM-DD. Default: None.
+        end (str, optional): Last day included, as YYYY-MM-DD. Default: None.
+        rebuild (bool, optional): Recompute the rollups from the transactions first. Default: False.
+
+    Returns:
+        list[dict]: The rows returned by `DB.get_spend`.
+    """
+    db_obj = DB(db_file)
+    db_obj.migrate()
+    if rebuild:
+        db_obj.rebuild_rollups()
+    return db_obj.get_spend(grain=grain, by=by, start=start, end=end)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Spend totals per day or month from the transactsync database")
+    parser.add_argument(
+        "--db_file",
+        help="Duckdb database File",
+        default="/workspace/db/finances.db"
+    )
+    parser.add_argument(
+        "--grain",
+        help="Period of each row (default: month)",
+        choices=["day", "month"],
+        default="month"
+    )
+    parser.add_argument(
+        "--by",
+        help="Comma-separated columns to group by besides the period: account, merchant (default: none)",
+        default=""
+    )
+    parser.add_argument(
+        "--start",
+        help="First day included, as YYYY-MM-DD",
+        required=False
+    )
+    parser.add_argument(
+        "--end",
+        help="Last day included, as YYYY-MM-DD",
+        required=False
+    )
+    parser.add_argument(
+        "--rebuild",
+        help="Recompute the rollups from the transactions first, e.g. after correcting transactions by hand",
+        action="store_true"
+    )
+    args = parser.parse_args()
+
+    rows = spend_report(args.db_file, grain=args.grain, by=[c.strip() for c in args.by.split(",") if c.strip()],
+                        start=args.start, end=args.end, rebuild=args.rebuild)
+    if rows:
+        print("\t".join(rows[0]))
+    for row in rows:
+        print("\t".join(f"{value:.2f}" if isinstance(value, float) else str(value) for value in row.values()))
@@ -0,0 +1,227 @@
+import re
+import threading
+from datetime import datetime
+from email.utils import parseaddr
+from rule_extractor import RuleExtractor, DATE_FORMATS
+
+DIGITS_RE = re.compile(r"\d+")
+SPACE_RE = re.compile(r"\s+")
+NUMBER_RE = re.compile(r"\d+(?:[.,]\d+)*")
+
+
+class TemplateLearner:
+    """
+    Learn extraction patterns from the model's output on one email and reuse them for structurally identical ones.
+
+    Emails are grouped by a signature: sender, subject with numbers masked, and the first words of each body line
+    with numbers masked. When the model extracts a transaction, the extracted values are located in the body
+    and turned into `RuleExtractor` patterns (the text around each value, with numbers masked); the patterns are
+    kept for the signature only if they reproduce the model's output on that same email. Non-transactions are
+    remembered per signature too.
+
+    Every `spot_check_every`-th email handled by a template is also sent to the model, and the template is
+    dropped if the two disagree. Templates live in memory for the run.
+    """
+
+    def __init__(self, transaction_filters, spot_check_every=20, context_chars=30):
+        self.spot_check_every = spot_check_every
+        self.context_chars = context_chars
+        self.rule_extractor = RuleExtractor({})
+        self.templates = {}
+        self.uses = {}
+        self.lock = threading.Lock()
+        self.accounts = {}
+        for details in transaction_filters.get("credit_cards", {}).values():
+            for from_address in details.get("from_address", []):
+                institution, account_numbers = self.accounts.get(from_address.lower(), (details["financial_institution"], []))
+                account_numbers = account_numbers + [str(n) for n in details.get("account_numbers", [])]
+                self.accounts[from_address.lower()] = (institution, account_numbers)
+
+    @staticmethod
+    def signature(e_mail: dict) -> tuple:
+        """
+        Structural signature of an email: sender, masked subject and the masked first words of each body line.
+        """
+        sender = parseaddr(e_mail.get("from_address") or "")[1].lower()
+        subject = NUMBER_RE.sub("#", e_mail.get("subject") or "").strip().lower()
+        lines = [SPACE_RE.sub(" ", line).strip() for line in (e_mail.get("body") or "").splitlines()]
+        skeleton = tuple(" ".join(NUMBER_RE.sub("#", line).split(" ")[:3]) for line in lines if line)
+        return sender, subject, skeleton
+
+    def match(self, e_mail: dict) -> tuple:
+        """
+        Extract an email with the template learned for its signature.
+
+        Args:
+            e_mail (dict): Email details ('from_address', 'email_date', 'subject', 'body').
+
+        Returns:
+            tuple: (prediction or None, True if the prediction must be spot-checked against the model).
+        """
+        signature = self.signature(e_mail)
+        with self.lock:
+            template = self.templates.get(signature)
+            if template is None:
+                return None, False
+            self.uses[signature] = self.uses.get(signature, 0) + 1
+            spot_check = self.spot_check_every > 0 and self.uses[signature] % self.spot_check_every == 0
+        if template.get("negative"):
+            return {"transaction_flag": False}, spot_check
+        try:
+            prediction = self.rule_extractor.apply(template, e_mail)
+        except (TypeError, ValueError):
+            prediction = None
+        return prediction, spot_check
+
+    def learn(self, e_mail: dict, prediction: dict, templated_prediction=None):
+        """
+        Record the model's output for an email: spot-check the template's prediction against it, or learn a
+        template for the email's signature if there is none yet.
+
+        Args:
+            e_mail (dict): Email details ('from_address', 'email_date', 'subject', 'body').
+            prediction (dict): The model's prediction for the email.
+            templated_prediction (dict, optional): What the template predicted, when this was a spot check.
+        """
+        signature = self.signature(e_mail)
+        if templated_prediction is not None:
+            if not self.same_prediction(templated_prediction, prediction):
+                with self.lock:
+                    self.templates.pop(signature, None)
+                    self.uses.pop(signature, None)
+            return
+
+        with self.lock:
+            if signature in self.templates:
+                return
+        template = self.build_template(e_mail, prediction)
+        if template is not None:
+            with self.lock:
+                self.templates.setdefault(signature, template)
+
+    def build_template(self, e_mail: dict, prediction: dict):
+        """
+        Turn the model's prediction for an email into a template, or None if its values cannot be located in the body.
+        """
+        if not isinstance(prediction, dict) or "transaction_flag" not in prediction:
+            return None
+        if prediction["transaction_flag"] is not True:
+            return {"negative": True}
+
+        sender = parseaddr(e_mail.get("from_address") or "")[1].lower()
+        if sender not in self.accounts:
+            return None
+        institution, account_numbers = self.accounts[sender]
+        body = e_mail.get("body") or ""
+        try:
+            amount = float(prediction["transaction_amount"])
+            account_number = str(prediction["account_number"])
+            transaction_date = self.parse_prediction_date(prediction["transaction_date"])
+        except (KeyError, TypeError, ValueError):
+            return None
+
+        patterns = {}
+        for text in (f"{amount:,.2f}", f"{amount:.2f}"):
+            patterns["amount"] = self.value_pattern(body, text, r"([\d,]+\.\d{2})")
+            if patterns["amount"]:
+                break
+        patterns["account_number"] = self.value_pattern(body, account_number, r"(\d+)")
+        merchant = (prediction.get("merchant") or "").strip()
+        if merchant:
+            patterns["merchant"] = self.value_pattern(body, merchant, r"(.+?)")
+        if not all(patterns.values()):
+            return None
+
+        template = {"financial_institution": institution, "account_numbers": account_numbers, "date_format": None}
+        date_match = self.date_pattern(body, transaction_date)
+        if date_match is not None:
+            patterns["date"], template["date_format"] = date_match
+        elif transaction_date.date() != datetime.fromisoformat(e_mail["email_date"]).date():
+            return None
+        template["patterns"] = {field: re.compile(pattern, re.IGNORECASE | re.MULTILINE) for field, pattern in patterns.items()}
+
+        # Only keep templates that reproduce the model's output on the email they were learned from
+        try:
+            if self.same_prediction(self.rule_extractor.apply(template, e_mail), prediction):
+                return template
+        except (TypeError, ValueError):
+            pass
+        return None
+
+    def value_pattern(self, body: str, value: str, group: str):
+        """
+        Pattern capturing `value` in `body` by the text around it on its line, with numbers masked.
+        """
+        match = re.search(rf"(?<![\w.,]){re.escape(value)}(?![\w]|[.,]\d)", body, re.IGNORECASE)
+        if match is None:
+            return None
+        line_start = body.rfind("\n", 0, match.start()) + 1
+        line_end = body.find("\n", match.end())
+        line_end = len(body) if line_end < 0 else line_end
+        before = body[max(line_start, match.start() - self.context_chars):match.start()]
+        after = body[match.end():min(line_end, match.end() + self.context_chars)]
+        prefix = self.masked(before) if before.strip() or match.start() - line_start > self.context_chars else "^" + self.masked(before)
+        if group == r"(.+?)":
+            # Free text needs a right anchor: the following text, or the end of the line
+            suffix = self.masked(after) if after.strip() else r"\s*$"
+        else:
+            suffix = ""
+        return prefix + group + suffix
+
+    @staticmethod
+    def masked(text: str) -> str:
+        return NUMBER_RE.pattern.join(re.escape(part) for part in NUMBER_RE.split(text))
+
+    @staticmethod
+    def parse_prediction_date(value) -> datetime:
+        value = str(value).strip()
+        try:
+            return datetime.fromisoformat(value)
+        except ValueError:
+            pass
+        for fmt in DATE_FORMATS:
+            try:
+                return datetime.strptime(value, fmt)
+            except ValueError:
+                continue
+        raise ValueError(f"Unrecognized date {value!r}")
+
+    def date_pattern(self, body: str, transaction_date: datetime):
+        """
+        Pattern and strptime format for the first rendering of `transaction_date` found in `body`, or None.
+        """
+        for fmt in DATE_FORMATS:
+            padded = transaction_date.strftime(fmt)
+            for text in dict.fromkeys([padded, re.sub(r"\b0(\d)", r"\1", padded)]):
+                match = re.search(rf"(?<!\d){re.escape(text)}(?!\d)", body)
+                if match is None:
+                    continue
+                shape = r"\d+".join(
+                    r"[A-Za-z]+".join(re.escape(p) for p in re.split(r"[A-Za-z]+", part)) for part in DIGITS_RE.split(text)
+                )
+                line_start = body.rfind("\n", 0, match.start()) + 1
+                before = body[max(line_start, match.start() - self.context_chars):match.start()]
+                return f"{self.masked(before)}({shape})", fmt
+        return None
+
+    @staticmethod
+    def same_prediction(a, b) -> bool:
+        """
+        Whether two predictions agree on the transaction flag and, for transactions, on the extracted values.
+        """
+        if not isinstance(a, dict) or not isinstance(b, dict):
+            return False
+        if bool(a.get("transaction_flag")) != bool(b.get("transaction_flag")):
+            return False
+        if not a.get("transaction_flag"):
+            return True
+        try:
+            return (
+                abs(float(a["transaction_amount"]) - float(b["transaction_amount"])) < 0.005
+                and str(a["account_number"]) == str(b["account_number"])
+                and (a.get("merchant") or "").strip().casefold() == (b.get("merchant") or "").strip().casefold()
+                and TemplateLearner.parse_prediction_date(a["transaction_date"]).date()
+                == TemplateLearner.parse_prediction_date(b["transaction_date"]).date()
+            )
+        except (KeyError, TypeError, ValueError):
+            return False
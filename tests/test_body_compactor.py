@@ -0,0 +1,52 @@
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
+
+from body_compactor import BodyCompactor
+
+FOOTER = "You are receiving this email because you enrolled in account alerts.\nPrivacy notice: we never ask for your password by email."
+
+def alert(merchant, amount):
+    return f"   Purchase   alert\n\n\nA charge of ${amount} at {merchant} was made on your card ending in 1234.\n\n{FOOTER}\n"
+
+def test_collapses_whitespace():
+    compactor = BodyCompactor()
+    assert compactor.compact("bank@example.com", "  Hello \t  there \n\n\n  You spent $5.00  ") == "Hello there\nYou spent $5.00"
+
+def test_drops_boilerplate_repeated_by_sender():
+    compactor = BodyCompactor(min_repeats=2)
+    for i in range(2):
+        assert "Privacy notice" in compactor.compact("Bank <alerts@bank.com>", alert("ACME", f"1{i}.00"))
+
+    body = compactor.compact("alerts@bank.com", alert("ACME", "12.00"))
+    assert "Privacy notice" not in body and "enrolled" not in body
+    # The transaction line repeats too but carries an amount, so it is kept
+    assert "A charge of $12.00 at ACME was made on your card ending in 1234." in body
+    # Learned per sender
+    assert "Privacy notice" in compactor.compact("alerts@other.com", alert("ACME", "12.00"))
+
+def test_keeps_repeated_card_line():
+    transaction_filters = {"credit_cards": {"chase": {"from_address": ["alerts@chase.com"], "account_numbers": [1234]}}}
+    compactor = BodyCompactor(min_repeats=2, transaction_filters=transaction_filters)
+    card_line = "Your Chase Sapphire card x1234 was used online just now, see details."
+    for i in range(6):
+        body = compactor.compact("alerts@chase.com", f"Card alert\n{card_line}\nMerchant: ACME\n{FOOTER}\n")
+    assert card_line in body
+    assert "Privacy notice" not in body
+    # Without the account number configured, a line saying "ending in" is still kept by its keyword
+    compactor = BodyCompactor(min_repeats=2)
+    for i in range(6):
+        body = compactor.compact("alerts@chase.com", "Your Chase Sapphire card ending in 1234 was used.\n")
+    assert "ending in 1234" in body
+
+def test_token_budget_keeps_lines_around_amount():
+    compactor = BodyCompactor(max_tokens=30)
+    filler = [f"Marketing line number {i} with some words" for i in range(20)]
+    body = "\n".join(filler[:10] + ["Merchant: ACME", "Amount: $42.10"] + filler[10:])
+
+    compacted = compactor.compact("alerts@bank.com", body)
+
+    assert "Merchant: ACME\nAmount: $42.10" in compacted
+    assert compactor.estimate_tokens(compacted) <= 30
+    assert "number 0 " not in compacted and "number 19" not in compacted
@@ -26,11 +26,13 @@ def test_get_last_seen_uid_returns_none_for_unknown_folder():
     db.bootstrap()
     assert db.get_last_seen_uid('NonExistentFolder') is None
 import sys
+import duckdb
+import pytest
 from pathlib import Path
 
 sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
 
-from db import DB
+from db import DB, MIGRATIONS
 
 def test_bootstrap():
     db = DB(':memory:')
@@ -150,3 +152,239 @@ def test_bootstrap_with_accounts_deduplicates_on_rerun():
     assert ('111', 'Bank X') in rows
     assert ('333', 'Bank Z') in rows
     assert len(rows) == 2
+
+def test_llm_cache_roundtrip():
+    db = DB(':memory:')
+    db.bootstrap()
+    assert db.get_cached_prediction('key1') is None
+
+    db.cache_prediction('key1', 'qwen3:8b', 'raw {"transaction_flag": false}', 'raw', {"transaction_flag": False}, 1.5)
+    assert db.get_cached_prediction('key1') == ('raw', {"transaction_flag": False})
+    assert db.con.execute("SELECT hits FROM llm_cache WHERE cache_key='key1'").fetchone()[0] == 1
+
+def test_llm_cache_hit_survives_concurrent_update():
+    db = DB(':memory:')
+    db.bootstrap()
+    db.cache_prediction('key1', 'qwen3:8b', 'raw {"transaction_flag": false}', 'raw', {"transaction_flag": False}, 1.5)
+    # Another extraction thread is recording a hit on the same entry
+    other = db.con.cursor()
+    other.execute("BEGIN TRANSACTION")
+    other.execute("UPDATE llm_cache SET hits=hits + 1 WHERE cache_key='key1'")
+
+    assert db.get_cached_prediction('key1') == ('raw', {"transaction_flag": False})
+    other.execute("COMMIT")
+
+def test_evict_llm_cache_by_age_and_size():
+    db = DB(':memory:')
+    db.bootstrap()
+    for i in range(4):
+        db.cache_prediction(f'key{i}', 'qwen3:8b', '', '', {}, 0.0)
+    db.con.execute("UPDATE llm_cache SET created_at = CURRENT_TIMESTAMP - INTERVAL 40 DAY WHERE cache_key='key0'")
+    db.con.execute("UPDATE llm_cache SET last_hit_at = CURRENT_TIMESTAMP + INTERVAL 1 MINUTE WHERE cache_key='key1'")
+
+    assert db.evict_llm_cache(max_age_days=30) == 1
+    assert db.get_cached_prediction('key0') is None
+    # key1 was used most recently
+    assert db.evict_llm_cache(max_entries=1) == 2
+    assert db.get_cached_prediction('key1') is not None
+
+def test_buffered_writes_are_flushed_with_their_checkpoint():
+    db = DB(':memory:', write_batch_size=3, write_interval=60)
+    db.bootstrap(accounts=[{'account_number': '1111', 'financial_institution': 'Bank A'}])
+    account_id = db.get_account_ids_dict()[('Bank A', '1111')]
+    e_mail = {'from_address': 'a@bank.com', 'to_address': 'me@example.com', 'uid': b'7', 'email_date': '2025-06-28T12:00:00'}
+    llm_prediction = {'transaction_date': '2025-06-28T12:00:00', 'transaction_amount': 5.0, 'merchant': 'ACME'}
+    count = lambda: db.con.execute("SELECT COUNT(*) FROM fact_transactions").fetchone()[0]
+
+    db.save_transaction(e_mail, "reasoning", llm_prediction, account_id)
+    db.set_last_seen_uid('INBOX', 7)
+    # Buffered, but visible to get_last_seen_uid
+    assert count() == 0
+    assert db.get_last_seen_uid('INBOX') == 7
+    assert db.con.execute("SELECT COUNT(*) FROM email_checkpoints").fetchone()[0] == 0
+
+    db.set_last_seen_uid('INBOX', 8)
+    assert count() == 1
+    assert db.con.execute("SELECT last_seen_uid FROM email_checkpoints WHERE folder='INBOX'").fetchone()[0] == 8
+
+    db.save_transaction(e_mail, "reasoning", llm_prediction, account_id)
+    db.set_last_seen_uid('INBOX', 9)
+    db.flush()
+    assert count() == 2
+    assert db.get_last_seen_uid('INBOX') == 9
+
+def test_failed_flush_writes_neither_transactions_nor_checkpoint():
+    db = DB(':memory:', write_batch_size=10)
+    db.bootstrap()
+    db.set_last_seen_uid('INBOX', 1)
+    db.flush()
+    e_mail = {'from_address': 'a@bank.com', 'to_address': 'me@example.com', 'uid': b'2', 'email_date': '2025-06-28T12:00:00'}
+    # Unknown account: the foreign key fails at flush
+    db.save_transaction(e_mail, "reasoning", {'transaction_date': '2025-06-28', 'transaction_amount': 5.0, 'merchant': 'ACME'}, 42)
+    db.set_last_seen_uid('INBOX', 2)
+
+    with pytest.raises(duckdb.ConstraintException):
+        db.flush()
+    assert db.con.execute("SELECT COUNT(*) FROM fact_transactions").fetchone()[0] == 0
+    assert db.get_last_seen_uid('INBOX') == 1
+
+def test_bootstrap_applies_migrations_once():
+    db = DB(':memory:')
+    db.bootstrap()
+    assert db.schema_version() == len(MIGRATIONS)
+
+    db.con.execute("DROP TABLE llm_cache")
+    db.bootstrap()
+    # Up to date: no DDL ran, so the dropped table was not recreated
+    with pytest.raises(duckdb.CatalogException):
+        db.con.execute("SELECT * FROM llm_cache")
+
+def test_bootstrap_migrates_database_created_before_versioning():
+    db = DB(':memory:')
+    for statement in MIGRATIONS[0]:
+        db.con.execute(statement)
+    db.con.execute("INSERT INTO dim_accounts (account_number, financial_institution) VALUES ('111', 'Bank X')")
+
+    db.bootstrap(accounts=[{'account_number': 111, 'financial_institution': 'Bank X', 'account_name': 'Renamed'}])
+
+    assert db.schema_version() == len(MIGRATIONS)
+    assert db.con.execute("SELECT account_id, account_name FROM dim_accounts").fetchall() == [(1, 'Renamed')]
+
+def test_save_transaction_is_idempotent_by_email_identity():
+    db = DB(':memory:', write_batch_size=10)
+    db.bootstrap(accounts=[{'account_number': '1111', 'financial_institution': 'Bank A'}])
+    account_id = db.get_account_ids_dict()[('Bank A', '1111')]
+    e_mail = {'from_address': 'a@bank.com', 'to_address': 'me@example.com', 'uid': b'7', 'email_date': '2025-06-28T12:00:00',
+              'subject': 'Alert', 'body': 'You spent $5.00', 'folder': 'INBOX', 'uidvalidity': 42}
+    llm_prediction = {'transaction_date': '2025-06-28T12:00:00', 'transaction_amount': 5.0, 'merchant': 'ACME'}
+
+    db.save_transaction(e_mail, "reasoning", llm_prediction, account_id)
+    db.save_transaction(e_mail, "reasoning", llm_prediction, account_id)
+    db.flush()
+    # Replayed after the checkpoint was reset
+    db.save_transaction(e_mail, "other reasoning", llm_prediction, account_id)
+    db.flush()
+    assert db.con.execute("SELECT COUNT(*) FROM fact_transactions").fetchone()[0] == 1
+
+    # Same UID in another folder, after a UIDVALIDITY change, or reused for another email
+    db.save_transaction(dict(e_mail, folder='Archive'), "reasoning", llm_prediction, account_id)
+    db.save_transaction(dict(e_mail, uidvalidity=43), "reasoning", llm_prediction, account_id)
+    db.save_transaction(dict(e_mail, body='You spent $6.00'), "reasoning", llm_prediction, account_id)
+    db.flush()
+    assert db.con.execute("SELECT COUNT(*) FROM fact_transactions").fetchone()[0] == 4
+
+def test_checkpoint_records_uidvalidity_and_highestmodseq():
+    db = DB(':memory:', write_batch_size=10)
+    db.bootstrap()
+    assert db.get_checkpoint('INBOX') is None
+
+    db.set_last_seen_uid('INBOX', 42, uidvalidity=7)
+    assert db.get_checkpoint('INBOX') == {'last_seen_uid': 42, 'uidvalidity': 7, 'highestmodseq': None}
+    db.set_last_seen_uid('INBOX', 43, uidvalidity=7, highestmodseq=100)
+    db.flush()
+    assert db.get_checkpoint('INBOX') == {'last_seen_uid': 43, 'uidvalidity': 7, 'highestmodseq': 100}
+    assert db.get_last_seen_uid('INBOX') == 43
+
+def test_get_stored_email_ids():
+    db = DB(':memory:')
+    db.bootstrap(accounts=[{'account_number': '1111', 'financial_institution': 'Bank A'}])
+    account_id = db.get_account_ids_dict()[('Bank A', '1111')]
+    e_mail = {'from_address': 'a@bank.com', 'to_address': 'me@example.com', 'uid': b'7', 'email_date': '2025-06-28T12:00:00',
+              'subject': 'Alert', 'body': 'You spent $5.00', 'folder': 'INBOX', 'uidvalidity': 42,
+              'message_id': '<abc@bank.com>'}
+    llm_prediction = {'transaction_date': '2025-06-28T12:00:00', 'transaction_amount': 5.0, 'merchant': 'ACME'}
+    db.save_transaction(e_mail, "reasoning", llm_prediction, account_id)
+
+    assert db.get_stored_email_ids('INBOX') == {'<abc@bank.com>', DB.email_content_hash(e_mail)}
+    assert db.get_stored_email_ids('Archive') == set()
+
+def save_spend(db, uid, transaction_date, amount, merchant, account_id):
+    e_mail = {'from_address': 'a@bank.com', 'to_address': 'me@example.com', 'uid': str(uid).encode(),
+              'email_date': transaction_date, 'subject': 'Alert', 'body': f'Alert {uid}', 'folder': 'INBOX', 'uidvalidity': 1}
+    llm_prediction = {'transaction_date': transaction_date, 'transaction_amount': amount, 'merchant': merchant}
+    db.save_transaction(e_mail, "reasoning", llm_prediction, account_id)
+
+def test_rollups_are_updated_incrementally_and_queried():
+    db = DB(':memory:', write_batch_size=10)
+    db.bootstrap(accounts=[{'account_number': '1111', 'financial_institution': 'Bank A'},
+                           {'account_number': '2222', 'financial_institution': 'Bank B'}])
+    ids = db.get_account_ids_dict()
+    save_spend(db, 1, '2025-06-01T10:00:00', 5.0, 'ACME', ids[('Bank A', '1111')])
+    save_spend(db, 2, '2025-06-01T18:00:00', 7.5, 'ACME', ids[('Bank A', '1111')])
+    save_spend(db, 3, '2025-06-20T10:00:00', 3.0, 'Shop', ids[('Bank B', '2222')])
+    db.flush()
+    # A replayed email is not inserted, so not counted again
+    save_spend(db, 1, '2025-06-01T10:00:00', 5.0, 'ACME', ids[('Bank A', '1111')])
+    save_spend(db, 4, '2025-07-02T10:00:00', 1.0, 'ACME', ids[('Bank A', '1111')])
+    db.flush()
+
+    assert [(r['period_start'].isoformat(), r['transaction_count'], r['total_amount']) for r in db.get_spend()] == [
+        ('2025-06-01', 3, 15.5), ('2025-07-01', 1, 1.0)
+    ]
+    assert [(r['period_start'].isoformat(), r['total_amount']) for r in db.get_spend('day', start='2025-06-02')] == [
+        ('2025-06-20', 3.0), ('2025-07-02', 1.0)
+    ]
+    by_account = db.get_spend('month', by=['account', 'merchant'], start='2025-06-15', end='2025-06-30')
+    assert [(r['financial_institution'], r['account_number'], r['merchant'], r['total_amount']) for r in by_account] == [
+        ('Bank A', '1111', 'ACME', 12.5), ('Bank B', '2222', 'Shop', 3.0)
+    ]
+    with pytest.raises(ValueError):
+        db.get_spend('week')
+
+    # Corrections made by hand are picked up by a rebuild
+    db.con.execute("DELETE FROM fact_transactions WHERE merchant = 'Shop'")
+    db.rebuild_rollups()
+    assert [r['merchant'] for r in db.get_spend('day', by=['merchant'])] == ['ACME', 'ACME']
+
+def test_rollups_migration_fills_them_from_existing_transactions():
+    db = DB(':memory:')
+    # A database at schema version 4, before rollups
+    db.con.execute("CREATE TABLE schema_version (version INTEGER PRIMARY KEY, applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)")
+    for version, statements in enumerate(MIGRATIONS[:4], start=1):
+        for statement in statements:
+            db.con.execute(statement)
+        db.con.execute("INSERT INTO schema_version (version) VALUES (?)", (version,))
+    db.upsert_accounts([{'account_number': '1111', 'financial_institution': 'Bank A'}])
+    db.con.execute("""
+        INSERT INTO fact_transactions (transaction_date, transaction_amount, merchant, account_id)
+        VALUES ('2025-06-01 10:00:00', 5.0, 'ACME', 1), ('2025-06-03 10:00:00', 2.5, 'ACME', 1)
+    """)
+
+    db.bootstrap()
+
+    assert [(r['merchant'], r['transaction_count'], r['total_amount']) for r in db.get_spend('month', by=['merchant'])] == [
+        ('ACME', 2, 7.5)
+    ]
+
+def test_replace_transaction_corrects_stored_row_and_rollups():
+    db = DB(':memory:', write_batch_size=10)
+    db.bootstrap(accounts=[{'account_number': '1111', 'financial_institution': 'Bank A'}])
+    account_id = db.get_account_ids_dict()[('Bank A', '1111')]
+    e_mail = {'from_address': 'a@bank.com', 'to_address': 'me@example.com', 'uid': b'7', 'email_date': '2025-06-28T12:00:00',
+              'subject': 'Alert', 'body': 'You spent $5.00', 'folder': 'INBOX', 'uidvalidity': 42}
+    other = dict(e_mail, uid=b'8', body='You spent $2.00')
+    db.save_transaction(e_mail, "reasoning", {'transaction_date': '2025-06-28T12:00:00', 'transaction_amount': 50.0, 'merchant': 'ACME'}, account_id)
+    db.save_transaction(other, "reasoning", {'transaction_date': '2025-06-28T12:00:00', 'transaction_amount': 2.0, 'merchant': 'Shop'}, account_id)
+    db.flush()
+    transaction_id = db.con.execute("SELECT transaction_id FROM fact_transactions WHERE email_uid = '7'").fetchone()[0]
+
+    # Reprocessing with a better prompt
+    db.save_transaction(e_mail, "new reasoning", {'transaction_date': '2025-06-28T12:00:00', 'transaction_amount': 5.0, 'merchant': 'ACME'},
+                        account_id, replace=True)
+    db.remove_transaction(other)
+    db.flush()
+
+    assert db.con.execute("SELECT transaction_id, transaction_amount, llm_reasoning FROM fact_transactions").fetchall() == [
+        (transaction_id, 5.0, 'new reasoning')
+    ]
+    assert [(r['merchant'], r['transaction_count'], r['total_amount']) for r in db.get_spend('day', by=['merchant'])] == [
+        ('ACME', 1, 5.0)
+    ]
+    # Replacing an email not stored yet inserts it
+    db.save_transaction(dict(e_mail, uid=b'9', body='You spent $1.00'), "reasoning",
+                        {'transaction_date': '2025-06-28T12:00:00', 'transaction_amount': 1.0, 'merchant': 'ACME'}, account_id, replace=True)
+    db.flush()
+    assert db.get_spend('day')[0]['total_amount'] == 6.0
+    before = db.con.execute("SELECT * FROM rollup_monthly_spend ORDER BY ALL").fetchall()
+    db.rebuild_rollups()
+    assert db.con.execute("SELECT * FROM rollup_monthly_spend ORDER BY ALL").fetchall() == before
@@ -72,8 +72,10 @@ def test_get_emails():
     
     mock_connection.uid.side_effect = [
         ('OK', [b'1 2']),
-        ('OK', [(b'', raw_email1)]),
-        ('OK', [(b'', raw_email2)])
+        ('OK', [
+            (b'1 (UID 1 RFC822 {%d}' % len(raw_email1), raw_email1), b')',
+            (b'2 (UID 2 RFC822 {%d}' % len(raw_email2), raw_email2), b')'
+        ])
     ]
     
     with patch('imaplib.IMAP4', return_value=mock_connection):
@@ -94,6 +96,434 @@ def test_get_emails():
         mock_connection.select.assert_called_once_with('"INBOX"')
         mock_connection.uid.assert_has_calls([
             call("search", None, "ALL"),
-            call("fetch", b'1', "(RFC822)"),
-            call("fetch", b'2', "(RFC822)")
+            call("fetch", "1:2", "(RFC822)")
+        ])
+        assert mock_connection.uid.call_count == 2, "Expected a single batched FETCH"
+
+def test_compress_uids():
+    assert EmailHandler.compress_uids([b'101', b'102', b'103', b'300', b'105', b'104']) == "101:105,300"
+    assert EmailHandler.compress_uids([7]) == "7"
+    assert EmailHandler.compress_uids([]) == ""
+
+def test_get_emails_respects_fetch_batch_size():
+    mock_connection = MagicMock()
+    mock_connection.select.return_value = ('OK', [])
+
+    def raw_email(n):
+        return "\r\n".join([
+            "Date: Wed, 28 Jun 2025 11:47:20 -0400 (EDT)",
+            "From: Sender Name <sender@example.com>",
+            "To: Recipient Name <recipient@example.com>",
+            f"Subject: Test Email {n}",
+            "Content-Type: text/plain; charset=\"UTF-8\"",
+            "",
+            f"Body {n}"
+        ]).encode("utf-8")
+
+    def fetch_response(uids):
+        # Servers may answer out of order and place UID after the literal
+        data = []
+        for uid in reversed(uids):
+            raw = raw_email(uid)
+            data.extend([(b'%d (RFC822 {%d}' % (uid, len(raw)), raw), b' UID %d)' % uid])
+        return ('OK', data)
+
+    mock_connection.uid.side_effect = [
+        ('OK', [b'1 2 3 5']),
+        fetch_response([1, 2]),
+        fetch_response([3, 5])
+    ]
+
+    with patch('imaplib.IMAP4', return_value=mock_connection):
+        dummy_logger = logging.getLogger("dummy")
+        email_handler = EmailHandler(dummy_logger, host='imap.example.com', port=143, username='user', password='pass', folder='INBOX', fetch_batch_size=2)
+        emails = email_handler.get_emails(last_seen_uid=None)
+
+        assert [e['uid'] for e in emails] == [b'1', b'2', b'3', b'5']
+        assert [e['body'] for e in emails] == ['Body 1', 'Body 2', 'Body 3', 'Body 5']
+        mock_connection.uid.assert_has_calls([
+            call("fetch", "1:2", "(RFC822)"),
+            call("fetch", "3,5", "(RFC822)")
+        ])
+
+def test_get_emails_with_sender_filter_fetches_only_matching_bodies():
+    mock_connection = MagicMock()
+    mock_connection.select.return_value = ('OK', [])
+
+    header1 = b"From: Bank Alerts <alerts@bank.com>\r\nSubject: Purchase\r\n\r\n"
+    header2 = b"From: Newsletter <news@shop.com>\r\nSubject: Sale\r\n\r\n"
+    raw_email1 = "\r\n".join([
+        "Date: Wed, 28 Jun 2025 11:47:20 -0400 (EDT)",
+        "From: Bank Alerts <alerts@bank.com>",
+        "To: Recipient Name <recipient@example.com>",
+        "Subject: Purchase",
+        "Content-Type: text/plain; charset=\"UTF-8\"",
+        "",
+        "You spent $10.00"
+    ]).encode("utf-8")
+
+    mock_connection.uid.side_effect = [
+        ('OK', [b'1 2']),
+        ('OK', [
+            (b'1 (UID 1 BODY[HEADER.FIELDS (FROM TO SUBJECT DATE MESSAGE-ID)] {%d}' % len(header1), header1), b')',
+            (b'2 (UID 2 BODY[HEADER.FIELDS (FROM TO SUBJECT DATE MESSAGE-ID)] {%d}' % len(header2), header2), b')'
+        ]),
+        ('OK', [(b'1 (UID 1 RFC822 {%d}' % len(raw_email1), raw_email1), b')'])
+    ]
+
+    with patch('imaplib.IMAP4', return_value=mock_connection):
+        dummy_logger = logging.getLogger("dummy")
+        email_handler = EmailHandler(dummy_logger, host='imap.example.com', port=143, username='user', password='pass',
+                                     folder='INBOX', sender_filter=['ALERTS@bank.com'])
+        emails = email_handler.get_emails(last_seen_uid=None)
+
+        assert [e['uid'] for e in emails] == [b'1']
+        assert email_handler.last_scanned_uid == 2, "Skipped emails should still count as scanned"
+        mock_connection.uid.assert_has_calls([
+            call("search", None, "ALL"),
+            call("fetch", "1:2", "(BODY.PEEK[HEADER.FIELDS (FROM TO SUBJECT DATE MESSAGE-ID)])"),
+            call("fetch", "1", "(RFC822)")
+        ])
+
+def test_get_email_uids_with_server_side_filter():
+    mock_connection = MagicMock()
+    mock_connection.select.return_value = ('OK', [])
+    mock_connection.uid.return_value = ('OK', [b'11 12'])
+
+    with patch('imaplib.IMAP4', return_value=mock_connection):
+        dummy_logger = logging.getLogger("dummy")
+        email_handler = EmailHandler(dummy_logger, host='imap.example.com', port=143, username='user', password='pass',
+                                     folder='INBOX', sender_filter=['b@y.com', 'a@x.com', 'c@z.com'], server_side_filter=True)
+        email_handler.imap_bridge()
+        uids = email_handler.get_email_uids(last_seen_uid=10)
+
+        assert uids == [b'11', b'12']
+        mock_connection.uid.assert_called_once_with(
+            "search", None, 'UID 11:* OR OR FROM "a@x.com" FROM "b@y.com" FROM "c@z.com"'
+        )
+
+def select_responses(uidvalidity, highestmodseq):
+    return lambda code: (code, [str({"UIDVALIDITY": uidvalidity, "HIGHESTMODSEQ": highestmodseq}[code]).encode()])
+
+def test_get_email_uids_rescans_folder_when_uidvalidity_changed():
+    mock_connection = MagicMock()
+    mock_connection.select.return_value = ('OK', [])
+    mock_connection.response.side_effect = select_responses(8, 100)
+    mock_connection.uid.return_value = ('OK', [b'1 2'])
+
+    with patch('imaplib.IMAP4', return_value=mock_connection):
+        email_handler = EmailHandler(logging.getLogger("dummy"), host='imap.example.com', port=143, username='user', password='pass', folder='INBOX')
+        email_handler.imap_bridge()
+        uids = email_handler.get_email_uids(last_seen_uid=50, uidvalidity=7, highestmodseq=100)
+
+        assert uids == [b'1', b'2']
+        assert email_handler.uidvalidity_changed
+        mock_connection.uid.assert_called_once_with("search", None, "ALL")
+
+        # A later empty rescan does not report the UIDs of the earlier search
+        mock_connection.uid.return_value = ('OK', [b''])
+        mock_connection.response.side_effect = select_responses(9, 100)
+        assert email_handler.get_email_uids(last_seen_uid=2, uidvalidity=8, highestmodseq=100) == []
+        assert email_handler.last_scanned_uid is None
+
+def test_get_email_uids_skips_search_when_highestmodseq_unchanged():
+    mock_connection = MagicMock()
+    mock_connection.select.return_value = ('OK', [])
+    mock_connection.response.side_effect = select_responses(7, 100)
+
+    with patch('imaplib.IMAP4', return_value=mock_connection):
+        email_handler = EmailHandler(logging.getLogger("dummy"), host='imap.example.com', port=143, username='user', password='pass', folder='INBOX')
+        email_handler.imap_bridge()
+
+        assert email_handler.get_email_uids(last_seen_uid=50, uidvalidity=7, highestmodseq=100) == []
+        assert not email_handler.uidvalidity_changed
+        mock_connection.uid.assert_not_called()
+
+        # The folder changed since the last sync: search for newer UIDs, without the newest old one `50:*` returns
+        mock_connection.uid.return_value = ('OK', [b'50'])
+        assert email_handler.get_email_uids(last_seen_uid=50, uidvalidity=7, highestmodseq=99) == []
+        mock_connection.uid.assert_called_once_with("search", None, "UID 51:*")
+
+def test_get_email_uids_lets_connection_errors_through():
+    import pytest
+    mock_connection = MagicMock()
+    mock_connection.select.return_value = ('OK', [])
+    abort = imaplib.IMAP4.abort
+    mock_connection.uid.side_effect = abort("socket error: EOF")
+
+    with patch('imaplib.IMAP4', return_value=mock_connection):
+        email_handler = EmailHandler(logging.getLogger("dummy"), host='imap.example.com', port=143, username='user', password='pass', folder='INBOX')
+        email_handler.imap_bridge()
+        with pytest.raises(abort):
+            email_handler.get_email_uids(last_seen_uid=None)
+
+        mock_connection.uid.side_effect = None
+        mock_connection.uid.return_value = ('NO', [b'search failed'])
+        with pytest.raises(RuntimeError):
+            email_handler.get_email_uids(last_seen_uid=None)
+
+def test_iter_emails_streams_batches_and_logs_out():
+    mock_connection = MagicMock()
+    mock_connection.select.return_value = ('OK', [])
+
+    def fetch_response(uid):
+        raw = "\r\n".join([
+            "Date: Wed, 28 Jun 2025 11:47:20 -0400 (EDT)",
+            "From: Sender Name <sender@example.com>",
+            "To: Recipient Name <recipient@example.com>",
+            f"Subject: Test Email {uid}",
+            "",
+            f"Body {uid}"
+        ]).encode("utf-8")
+        return ('OK', [(b'%d (UID %d RFC822 {%d}' % (uid, uid, len(raw)), raw), b')'])
+
+    mock_connection.uid.side_effect = [('OK', [b'1 2']), fetch_response(1), fetch_response(2)]
+
+    with patch('imaplib.IMAP4', return_value=mock_connection):
+        dummy_logger = logging.getLogger("dummy")
+        email_handler = EmailHandler(dummy_logger, host='imap.example.com', port=143, username='user', password='pass', folder='INBOX', fetch_batch_size=1)
+        emails = email_handler.iter_emails(last_seen_uid=None)
+
+        assert next(emails)['subject'] == 'Test Email 1'
+        assert mock_connection.uid.call_count == 2, "Second batch should not be fetched before it is needed"
+        mock_connection.logout.assert_not_called()
+
+        emails.close()
+        mock_connection.logout.assert_called_once()
+
+def test_get_emails_partial_fetch_downloads_only_text_parts():
+    mock_connection = MagicMock()
+    mock_connection.select.return_value = ('OK', [])
+
+    header = b"Date: Wed, 28 Jun 2025 11:47:20 -0400\r\nFrom: Bank <alerts@bank.com>\r\nTo: me@example.com\r\nSubject: Purchase %d\r\n\r\n"
+    header1, header2 = header % 1, header % 2
+    # multipart/mixed( multipart/related( image/png, text/html ), application/pdf )
+    structure1 = (b'((("IMAGE" "PNG" ("NAME" "logo.png") NIL NIL "BASE64" 1000)'
+                  b'("TEXT" "HTML" ("CHARSET" "UTF-8") NIL NIL "BASE64" 80) "RELATED" ("BOUNDARY" "b2") NIL NIL)'
+                  b'("APPLICATION" "PDF" ("NAME" "statement.pdf") NIL NIL "BASE64" 500000) "MIXED" ("BOUNDARY" "b1") NIL NIL)')
+    structure2 = b'("TEXT" "PLAIN" ("CHARSET" "ISO-8859-1") NIL NIL "QUOTED-PRINTABLE" 40 2 NIL NIL NIL)'
+    html_part = b"PHA+WW91IHNwZW50IDxiPiQxMC4wMDwvYj48L3A+"  # base64 of <p>You spent <b>$10.00</b></p>
+    text_part = b"Caf=E9 purchase of $5.00"
+
+    mock_connection.uid.side_effect = [
+        ('OK', [b'1 2']),
+        ('OK', [
+            (b'1 (UID 1 BODYSTRUCTURE ' + structure1 + b' BODY[HEADER.FIELDS (FROM TO SUBJECT DATE MESSAGE-ID)] {%d}' % len(header1), header1), b')',
+            (b'2 (UID 2 BODYSTRUCTURE ' + structure2 + b' BODY[HEADER.FIELDS (FROM TO SUBJECT DATE MESSAGE-ID)] {%d}' % len(header2), header2), b')'
+        ]),
+        ('OK', [(b'1 (UID 1 BODY[1.2] {%d}' % len(html_part), html_part), b')']),
+        ('OK', [(b'2 (UID 2 BODY[1] {%d}' % len(text_part), text_part), b')'])
+    ]
+
+    with patch('imaplib.IMAP4', return_value=mock_connection):
+        dummy_logger = logging.getLogger("dummy")
+        email_handler = EmailHandler(dummy_logger, host='imap.example.com', port=143, username='user', password='pass',
+                                     folder='INBOX', fetch_mode='partial')
+        emails = email_handler.get_emails(last_seen_uid=None)
+
+        assert [e['uid'] for e in emails] == [b'1', b'2']
+        assert emails[0]['subject'] == 'Purchase 1'
+        assert emails[0]['body'] == 'You spent $10.00'
+        assert emails[1]['body'] == 'Café purchase of $5.00'
+        assert emails[1]['from_address'] == 'Bank <alerts@bank.com>'
+        mock_connection.uid.assert_has_calls([
+            call("fetch", "1:2", "(BODYSTRUCTURE BODY.PEEK[HEADER.FIELDS (FROM TO SUBJECT DATE MESSAGE-ID)])"),
+            call("fetch", "1", "(BODY.PEEK[1.2])"),
+            call("fetch", "2", "(BODY.PEEK[1])")
         ])
+        assert all("RFC822" not in str(c) for c in mock_connection.uid.call_args_list)
+
+def test_select_text_part():
+    structure = EmailHandler.parse_fetch_response([
+        b'1 (UID 1 BODYSTRUCTURE ((("TEXT" "PLAIN" ("CHARSET" "UTF-8") NIL NIL "7BIT" 10 1)'
+        b'("TEXT" "HTML" ("CHARSET" "UTF-8") NIL NIL "7BIT" 20 1) "ALTERNATIVE")'
+        b'("IMAGE" "GIF" NIL NIL NIL "BASE64" 30) "MIXED"))'
+    ])[0]["BODYSTRUCTURE"]
+    assert EmailHandler.select_text_part(structure) == {
+        "section": "1.1", "content_type": "text/plain", "encoding": "7bit", "charset": "utf-8"
+    }
+
+    no_text = [["IMAGE", "GIF", None, None, None, "BASE64", "30"], "MIXED"]
+    assert EmailHandler.select_text_part(no_text) is None
+
+    forwarded = [["MESSAGE", "RFC822", None, None, None, "7BIT", "30"], ["TEXT", "PLAIN", None, None, None, "7BIT", "10"], "MIXED"]
+    try:
+        EmailHandler.select_text_part(forwarded)
+        assert False, "Encapsulated messages should not be supported"
+    except ValueError:
+        pass
+
+def test_idle_reports_new_emails():
+    mock_connection = MagicMock()
+    mock_connection.capabilities = ('IMAP4REV1', 'IDLE')
+    mock_connection._new_tag.return_value = b'A001'
+    mock_connection.readline.side_effect = [b'+ idling\r\n', b'* 4 EXISTS\r\n', b'A001 OK IDLE terminated\r\n']
+    mock_connection.file.peek.return_value = b''
+
+    with patch('imaplib.IMAP4', return_value=mock_connection), \
+         patch('fetch_emails.select.select', return_value=([mock_connection.sock], [], [])):
+        dummy_logger = logging.getLogger("dummy")
+        email_handler = EmailHandler(dummy_logger, host='imap.example.com', port=143, username='user', password='pass', folder='INBOX')
+        email_handler.imap_bridge()
+
+        assert email_handler.idle(timeout=10) is True
+        mock_connection.send.assert_has_calls([call(b'A001 IDLE\r\n'), call(b'DONE\r\n')])
+
+def test_idle_times_out_without_new_emails():
+    mock_connection = MagicMock()
+    mock_connection.capabilities = ('IMAP4REV1', 'IDLE')
+    mock_connection._new_tag.return_value = b'A002'
+    mock_connection.readline.side_effect = [b'+ idling\r\n', b'A002 OK IDLE terminated\r\n']
+    mock_connection.file.peek.return_value = b''
+
+    with patch('imaplib.IMAP4', return_value=mock_connection), \
+         patch('fetch_emails.select.select', return_value=([], [], [])):
+        dummy_logger = logging.getLogger("dummy")
+        email_handler = EmailHandler(dummy_logger, host='imap.example.com', port=143, username='user', password='pass', folder='INBOX')
+        email_handler.imap_bridge()
+
+        assert email_handler.idle(timeout=10) is False
+        mock_connection.send.assert_has_calls([call(b'A002 IDLE\r\n'), call(b'DONE\r\n')])
+
+def test_iter_emails_reconnects_when_connection_dropped_between_batches():
+    first_connection, second_connection = MagicMock(), MagicMock()
+    for connection in (first_connection, second_connection):
+        connection.select.return_value = ('OK', [])
+
+    def fetch_response(uid):
+        raw = f"Subject: Test Email {uid}\r\nDate: Wed, 28 Jun 2025 11:47:20 -0400\r\n\r\nBody {uid}".encode("utf-8")
+        return ('OK', [(b'%d (UID %d RFC822 {%d}' % (uid, uid, len(raw)), raw), b')'])
+
+    first_connection.uid.side_effect = [('OK', [b'1 2']), fetch_response(1)]
+    first_connection.noop.side_effect = [("OK", [b""]), imaplib.IMAP4.abort("autologout")]
+    second_connection.uid.side_effect = [fetch_response(2)]
+
+    with patch('imaplib.IMAP4', side_effect=[first_connection, second_connection]):
+        dummy_logger = logging.getLogger("dummy")
+        email_handler = EmailHandler(dummy_logger, host='imap.example.com', port=143, username='user', password='pass', folder='INBOX', fetch_batch_size=1)
+        # Pretend every batch takes longer than the keepalive interval to process
+        email_handler.keepalive_interval = 0
+        emails = list(email_handler.iter_emails(last_seen_uid=None))
+
+        assert [e['subject'] for e in emails] == ['Test Email 1', 'Test Email 2']
+        second_connection.select.assert_called_once_with('"INBOX"')
+        second_connection.logout.assert_called_once()
+
+def test_decode_part_tolerates_malformed_base64():
+    part = {"section": "1", "content_type": "text/plain", "encoding": "base64", "charset": "utf-8"}
+    assert EmailHandler.decode_part(b"WW91IHNwZW50ICQxMC4wMA==", part) == "You spent $10.00"
+    # Truncated part: no exception, like get_payload(decode=True) on a full message
+    assert isinstance(EmailHandler.decode_part(b"PHA+WW91I", part), str)
+
+def test_partial_fetch_with_sender_filter_fetches_headers_once():
+    mock_connection = MagicMock()
+    mock_connection.select.return_value = ('OK', [])
+
+    header1 = b"Date: Wed, 28 Jun 2025 11:47:20 -0400\r\nFrom: Bank <alerts@bank.com>\r\nSubject: Purchase\r\n\r\n"
+    header2 = b"Date: Wed, 28 Jun 2025 11:48:20 -0400\r\nFrom: Shop <news@shop.com>\r\nSubject: Sale\r\n\r\n"
+    structure = b'("TEXT" "PLAIN" ("CHARSET" "UTF-8") NIL NIL "7BIT" 16 1)'
+    text_part = b"You spent $10.00"
+
+    mock_connection.uid.side_effect = [
+        ('OK', [b'1 2']),
+        ('OK', [
+            (b'1 (UID 1 BODYSTRUCTURE ' + structure + b' BODY[HEADER.FIELDS (FROM TO SUBJECT DATE MESSAGE-ID)] {%d}' % len(header1), header1), b')',
+            (b'2 (UID 2 BODYSTRUCTURE ' + structure + b' BODY[HEADER.FIELDS (FROM TO SUBJECT DATE MESSAGE-ID)] {%d}' % len(header2), header2), b')'
+        ]),
+        ('OK', [(b'1 (UID 1 BODY[1] {%d}' % len(text_part), text_part), b')'])
+    ]
+
+    with patch('imaplib.IMAP4', return_value=mock_connection):
+        dummy_logger = logging.getLogger("dummy")
+        email_handler = EmailHandler(dummy_logger, host='imap.example.com', port=143, username='user', password='pass',
+                                     folder='INBOX', sender_filter=['alerts@bank.com'], fetch_mode='partial')
+        emails = email_handler.get_emails(last_seen_uid=None)
+
+        assert [(e['uid'], e['body']) for e in emails] == [(b'1', 'You spent $10.00')]
+        assert mock_connection.uid.call_args_list == [
+            call("search", None, "ALL"),
+            call("fetch", "1:2", "(BODYSTRUCTURE BODY.PEEK[HEADER.FIELDS (FROM TO SUBJECT DATE MESSAGE-ID)])"),
+            call("fetch", "1", "(BODY.PEEK[1])")
+        ]
+
+def test_idle_reads_notification_already_buffered():
+    mock_connection = MagicMock()
+    mock_connection.capabilities = ('IMAP4REV1', 'IDLE')
+    mock_connection._new_tag.return_value = b'A003'
+    # EXISTS arrived in the same packet as the continuation, so it sits in imaplib's read buffer
+    mock_connection.readline.side_effect = [b'+ idling\r\n', b'* 5 EXISTS\r\n', b'A003 OK IDLE terminated\r\n']
+    mock_connection.file.peek.return_value = b'* 5 EXISTS\r\n'
+
+    with patch('imaplib.IMAP4', return_value=mock_connection), \
+         patch('fetch_emails.select.select', return_value=([], [], [])) as mock_select:
+        dummy_logger = logging.getLogger("dummy")
+        email_handler = EmailHandler(dummy_logger, host='imap.example.com', port=143, username='user', password='pass', folder='INBOX')
+        email_handler.imap_bridge()
+
+        assert email_handler.idle(timeout=1740) is True
+        mock_select.assert_not_called()
+
+def test_get_emails_keeps_raw_emails_in_store():
+    mock_connection = MagicMock()
+    mock_connection.select.return_value = ('OK', [])
+    mock_connection.response.return_value = ('UIDVALIDITY', [b'42'])
+    raw_email = b"Subject: Test\r\nDate: Wed, 28 Jun 2025 11:47:20 -0400\r\n\r\nBody"
+    mock_connection.uid.side_effect = [
+        ('OK', [b'5']),
+        ('OK', [(b'1 (UID 5 RFC822 {%d}' % len(raw_email), raw_email), b')'])
+    ]
+    raw_store = MagicMock()
+
+    with patch('imaplib.IMAP4', return_value=mock_connection):
+        dummy_logger = logging.getLogger("dummy")
+        email_handler = EmailHandler(dummy_logger, host='imap.example.com', port=143, username='user', password='pass',
+                                     folder='INBOX', fetch_mode='partial', raw_store=raw_store, store_key='user/INBOX')
+        emails = email_handler.get_emails(last_seen_uid=None)
+
+        assert len(emails) == 1
+        # The store needs whole messages, so partial fetches are turned off
+        assert email_handler.fetch_mode == 'full'
+        raw_store.put.assert_called_once_with('user/INBOX', 42, b'5', raw_email)
+        # Emails carry their identity for idempotent storage
+        assert (emails[0]['folder'], emails[0]['uidvalidity']) == ('user/INBOX', 42)
+
+def test_html_to_text_drops_styles_scripts_and_hidden_preheaders():
+    html = (
+        "<html><head><title>Alert</title><style>p {color: red}</style></head><body>"
+        "<div style=\"display:none; max-height:0\">Preview text you never see</div>"
+        "<script>track()</script>"
+        "<table><tr><td>Merchant</td><td>ACME</td></tr><tr><td>Amount</td><td>$10.00</td></tr></table>"
+        "<p>You spent <b>$10.00</b></p></body></html>"
+    )
+    text = EmailHandler.html_to_text(html)
+
+    assert "Preview text" not in text
+    assert "color" not in text and "track" not in text and "Alert" not in text
+    assert "You spent $10.00" in text
+    # Table rows stay on separate lines
+    assert "MerchantACME\nAmount$10.00" in text
+
+def test_get_emails_decodes_in_process_pool():
+    mock_connection = MagicMock()
+    mock_connection.select.return_value = ('OK', [])
+    raw_emails = [
+        b"Subject: Test %d\r\nDate: Wed, 28 Jun 2025 11:47:20 -0400\r\nContent-Type: text/html\r\n\r\n<p>Body %d</p>" % (i, i)
+        for i in (1, 2, 3)
+    ]
+    # UID 2 has a date that cannot be parsed and is skipped without failing the batch
+    raw_emails[1] = raw_emails[1].replace(b"Wed, 28 Jun 2025 11:47:20 -0400", b"not a date")
+    mock_connection.uid.side_effect = [
+        ('OK', [b'1 2 3']),
+        ('OK', [item for i, raw in enumerate(raw_emails, 1)
+                for item in ((b'%d (UID %d RFC822 {%d}' % (i, i, len(raw)), raw), b')')])
+    ]
+
+    with patch('imaplib.IMAP4', return_value=mock_connection):
+        dummy_logger = logging.getLogger("dummy")
+        email_handler = EmailHandler(dummy_logger, host='imap.example.com', port=143, username='user', password='pass',
+                                     folder='INBOX', parse_workers=2)
+        emails = email_handler.get_emails(last_seen_uid=None)
+
+        assert [(e['uid'], e['subject'], e['body']) for e in emails] == [(b'1', 'Test 1', 'Body 1'), (b'3', 'Test 3', 'Body 3')]
+        # The pool is shut down with the connection
+        assert email_handler.parse_pool is None
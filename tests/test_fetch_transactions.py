@@ -9,12 +9,21 @@ import logging
 from unittest.mock import patch, MagicMock
 from fetch_transactions import TransactionHandler
 
+def model_output(text):
+    """
+    Side effect for a mocked `generate` answering `text`, in small chunks when streamed.
+    """
+    def generate(**kwargs):
+        if kwargs.get("stream"):
+            return (MagicMock(response=text[i:i + 8]) for i in range(0, len(text), 8))
+        return MagicMock(response=text)
+    return generate
+
 def test_get_transaction():
     # Patch Client in fetch_transactions to prevent real network calls
     with patch("fetch_transactions.Client", autospec=True) as mock_client:
         mock_llm_bridge = MagicMock()
-        mock_generate = MagicMock()
-        mock_generate.response = """
+        response = """
         Reasoning text goes here.
         {
             \"account\": \"123456789\",
@@ -24,7 +33,7 @@ def test_get_transaction():
             \"transaction_flag\": true
         }
         """
-        mock_llm_bridge.generate.return_value = mock_generate
+        mock_llm_bridge.generate.side_effect = model_output(response)
         # Also patch list().models to avoid model check
         mock_llm_bridge.list.return_value.models = [MagicMock(model="qwen3:8b")]
         mock_client.return_value = mock_llm_bridge
@@ -82,3 +91,346 @@ def test_parse_model_output():
             "transaction_flag": True
         }
         assert llm_prediction == expected_prediction, f"Expected prediction to match {expected_prediction}, but got {llm_prediction}"
+
+
+def test_get_transaction_uses_extractor_before_model():
+    with patch("fetch_transactions.Client", autospec=True) as mock_client:
+        mock_llm_bridge = MagicMock()
+        mock_llm_bridge.list.return_value.models = [MagicMock(model="qwen3:8b")]
+        mock_llm_bridge.generate.side_effect = model_output('{"transaction_flag": false}')
+        mock_client.return_value = mock_llm_bridge
+        extractor = MagicMock()
+        prediction = {"account_number": "1111", "transaction_amount": 5.0, "transaction_date": "2025-06-28T00:00:00",
+                      "merchant": "ACME", "transaction_flag": True}
+        extractor.extract.side_effect = [("bank a", prediction), None]
+
+        dummy_logger = logging.getLogger("dummy")
+        transaction_handler = TransactionHandler(dummy_logger, model_host="http://localhost:11434", model="qwen3:8b",
+                                                 extractor=extractor)
+        e_mail = {"from_address": "alerts@banka.com", "email_date": "2025-06-28T11:47:20", "subject": "Alert", "body": "Body"}
+
+        assert transaction_handler.get_transaction(e_mail)[1] == prediction
+        mock_llm_bridge.generate.assert_not_called()
+        # No match: the model is called
+        assert transaction_handler.get_transaction(e_mail)[1] == {"transaction_flag": False}
+        mock_llm_bridge.generate.assert_called_once()
+
+
+def test_get_transaction_caches_model_output():
+    from db import DB
+    with patch("fetch_transactions.Client", autospec=True) as mock_client:
+        mock_llm_bridge = MagicMock()
+        mock_llm_bridge.list.return_value.models = [MagicMock(model="qwen3:8b")]
+        mock_llm_bridge.generate.side_effect = model_output('Not a purchase. {"transaction_flag": false}')
+        mock_client.return_value = mock_llm_bridge
+        db = DB(':memory:')
+        db.bootstrap()
+
+        dummy_logger = logging.getLogger("dummy")
+        transaction_handler = TransactionHandler(dummy_logger, model_host="http://localhost:11434", model="qwen3:8b", cache=db)
+        e_mail = {"from_address": "Alerts@Bank.com", "email_date": "2025-06-28T11:47:20", "subject": "Alert", "body": "Body  text"}
+
+        expected = ("Not a purchase.", {"transaction_flag": False})
+        assert transaction_handler.get_transaction(e_mail, "prompt") == expected
+        # Same email found in another folder, differing only in whitespace and sender case
+        assert transaction_handler.get_transaction(dict(e_mail, from_address="alerts@bank.com", body=" Body text\n"), "prompt") == expected
+        assert mock_llm_bridge.generate.call_count == 1
+        # A different prompt is a cache miss
+        transaction_handler.get_transaction(e_mail, "new prompt")
+        assert mock_llm_bridge.generate.call_count == 2
+
+
+def test_get_transaction_structured_output():
+    with patch("fetch_transactions.Client", autospec=True) as mock_client:
+        mock_llm_bridge = MagicMock()
+        mock_llm_bridge.list.return_value.models = [MagicMock(model="qwen3:8b")]
+        mock_llm_bridge.generate.side_effect = model_output(json.dumps({
+            "transaction_flag": True, "account_number": "1111", "transaction_amount": 12.5,
+            "transaction_date": "2025-06-28", "merchant": "ACME"
+        }))
+        mock_client.return_value = mock_llm_bridge
+
+        dummy_logger = logging.getLogger("dummy")
+        transaction_handler = TransactionHandler(dummy_logger, model_host="http://localhost:11434", model="qwen3:8b",
+                                                 structured_output=True, num_predict=64)
+        e_mail = {"from_address": "alerts@bank.com", "email_date": "2025-06-28T11:47:20", "subject": "Alert", "body": "Body"}
+
+        llm_reasoning, llm_prediction = transaction_handler.get_transaction(e_mail, "prompt")
+
+        assert llm_reasoning == ""
+        assert llm_prediction == {"transaction_flag": True, "account_number": "1111", "transaction_amount": 12.5,
+                                  "transaction_date": "2025-06-28", "merchant": "ACME"}
+        kwargs = mock_llm_bridge.generate.call_args.kwargs
+        assert kwargs["think"] is False
+        assert kwargs["options"] == {"num_predict": 64}
+        assert kwargs["format"]["properties"]["transaction_flag"]["type"] == "boolean"
+
+
+def test_parse_model_output_with_schema_class():
+    from fetch_transactions import TransactionPrediction
+    import pytest
+
+    _, parsed = TransactionHandler.parse_model_output('{"transaction_flag": false}', schema_class=TransactionPrediction)
+    assert parsed.transaction_flag is False and parsed.merchant is None
+    # Output not matching the schema is rejected like unparsable JSON
+    with pytest.raises(ValueError):
+        TransactionHandler.parse_model_output('{"transaction_amount": "lots"}', schema_class=TransactionPrediction)
+
+
+def test_get_transaction_sends_static_prompt_as_system_prefix():
+    with patch("fetch_transactions.Client", autospec=True) as mock_client:
+        mock_llm_bridge = MagicMock()
+        mock_llm_bridge.list.return_value.models = [MagicMock(model="qwen3:8b")]
+        mock_llm_bridge.generate.side_effect = model_output('{"transaction_flag": false}')
+        mock_client.return_value = mock_llm_bridge
+
+        dummy_logger = logging.getLogger("dummy")
+        transaction_handler = TransactionHandler(dummy_logger, model_host="http://localhost:11434", model="qwen3:8b",
+                                                 keep_alive="1h")
+        transaction_handler.warm_up("rules prompt")
+        for subject in ("First", "Second"):
+            e_mail = {"from_address": "alerts@bank.com", "email_date": "2025-06-28T11:47:20", "subject": subject, "body": "Body"}
+            transaction_handler.get_transaction(e_mail, "rules prompt")
+
+        calls = mock_llm_bridge.generate.call_args_list
+        assert len(calls) == 3
+        # Same system prefix for the warm-up and every email, email fields only in the prompt
+        assert all(c.kwargs["system"] == "rules prompt" and c.kwargs["keep_alive"] == "1h" for c in calls)
+        assert calls[0].kwargs["options"] == {"num_predict": 1}
+        assert "subject: Second" in calls[2].kwargs["prompt"] and "rules prompt" not in calls[2].kwargs["prompt"]
+
+
+def test_warm_up_failure_is_not_fatal():
+    with patch("fetch_transactions.Client", autospec=True) as mock_client:
+        mock_llm_bridge = MagicMock()
+        mock_llm_bridge.list.return_value.models = [MagicMock(model="qwen3:8b")]
+        mock_llm_bridge.generate.side_effect = ConnectionError("refused")
+        mock_client.return_value = mock_llm_bridge
+
+        transaction_handler = TransactionHandler(logging.getLogger("dummy"), model="qwen3:8b")
+        transaction_handler.warm_up("rules prompt")
+
+
+def test_model_is_prepared_in_background():
+    import time
+    import threading
+    with patch("fetch_transactions.Client", autospec=True) as mock_client:
+        mock_llm_bridge = MagicMock()
+        release = threading.Event()
+        def list_models():
+            release.wait(5)
+            models = MagicMock()
+            models.models = [MagicMock(model="background-model:1b", digest="abc")]
+            return models
+        mock_llm_bridge.list.side_effect = list_models
+        mock_llm_bridge.generate.side_effect = model_output('{"transaction_flag": false}')
+        mock_client.return_value = mock_llm_bridge
+
+        start = time.perf_counter()
+        transaction_handler = TransactionHandler(logging.getLogger("dummy"), model="background-model:1b",
+                                                 warm_up_prompt="rules prompt")
+        # Construction does not wait for the Ollama server
+        assert time.perf_counter() - start < 1
+        assert not transaction_handler.ready.is_set()
+
+        release.set()
+        e_mail = {"from_address": "alerts@bank.com", "email_date": "2025-06-28T11:47:20", "subject": "Alert", "body": "Body"}
+        assert transaction_handler.get_transaction(e_mail, "rules prompt")[1] == {"transaction_flag": False}
+        # Warm-up first, then the email
+        assert mock_llm_bridge.generate.call_count == 2
+        assert mock_llm_bridge.generate.call_args_list[0].kwargs["options"] == {"num_predict": 1}
+
+        # Checked once per process
+        TransactionHandler(logging.getLogger("dummy"), model="background-model:1b").wait_until_ready()
+        assert mock_llm_bridge.list.call_count == 1
+
+
+def test_model_check_failure_surfaces_on_first_extraction():
+    import pytest
+    with patch("fetch_transactions.Client", autospec=True) as mock_client:
+        mock_llm_bridge = MagicMock()
+        mock_llm_bridge.list.side_effect = ConnectionError("Ollama unreachable")
+        mock_client.return_value = mock_llm_bridge
+
+        transaction_handler = TransactionHandler(logging.getLogger("dummy"), model="unreachable-model:1b")
+        e_mail = {"from_address": "alerts@bank.com", "email_date": "2025-06-28T11:47:20", "subject": "Alert", "body": "Body"}
+        with pytest.raises(ConnectionError):
+            transaction_handler.get_transaction(e_mail, "rules prompt")
+        mock_llm_bridge.generate.assert_not_called()
+
+
+def test_get_transaction_skips_model_for_rejected_emails():
+    with patch("fetch_transactions.Client", autospec=True) as mock_client:
+        mock_llm_bridge = MagicMock()
+        mock_llm_bridge.list.return_value.models = [MagicMock(model="qwen3:8b")]
+        mock_client.return_value = mock_llm_bridge
+        classifier = MagicMock()
+        classifier.classify.return_value = (False, "statement")
+
+        transaction_handler = TransactionHandler(logging.getLogger("dummy"), model="qwen3:8b", classifier=classifier)
+        e_mail = {"uid": b"1", "from_address": "alerts@bank.com", "email_date": "2025-06-28T11:47:20", "subject": "Statement", "body": "Body"}
+
+        llm_reasoning, llm_prediction = transaction_handler.get_transaction(e_mail, "prompt")
+        assert llm_prediction == {"transaction_flag": False}
+        assert "statement" in llm_reasoning
+        mock_llm_bridge.generate.assert_not_called()
+
+
+def test_get_transaction_uses_learned_templates():
+    with patch("fetch_transactions.Client", autospec=True) as mock_client:
+        mock_llm_bridge = MagicMock()
+        mock_llm_bridge.list.return_value.models = [MagicMock(model="qwen3:8b")]
+        mock_llm_bridge.generate.side_effect = model_output('{"transaction_flag": false}')
+        mock_client.return_value = mock_llm_bridge
+        templates = MagicMock()
+        templates.match.side_effect = [(None, False), ({"transaction_flag": False}, False), ({"transaction_flag": True}, True)]
+
+        transaction_handler = TransactionHandler(logging.getLogger("dummy"), model="qwen3:8b", templates=templates)
+        e_mail = {"uid": b"1", "from_address": "alerts@bank.com", "email_date": "2025-06-28T11:47:20", "subject": "Alert", "body": "Body"}
+
+        # No template: the model's output is learned
+        transaction_handler.get_transaction(e_mail, "prompt")
+        templates.learn.assert_called_with(e_mail, {"transaction_flag": False}, None)
+        # Template match: no model call
+        transaction_handler.get_transaction(e_mail, "prompt")
+        assert mock_llm_bridge.generate.call_count == 1
+        # Spot check: the model is called and compared with the template
+        assert transaction_handler.get_transaction(e_mail, "prompt")[1] == {"transaction_flag": False}
+        templates.learn.assert_called_with(e_mail, {"transaction_flag": False}, {"transaction_flag": True})
+
+
+def test_get_transactions_batches_emails_and_retries_missing_ones():
+    with patch("fetch_transactions.Client", autospec=True) as mock_client:
+        mock_llm_bridge = MagicMock()
+        mock_llm_bridge.list.return_value.models = [MagicMock(model="qwen3:8b")]
+        batch_response = MagicMock(response='<think>Emails [1] and [3] are alerts</think>Two of three. [{"uid": "1", "transaction_flag": false}, '
+                                            '{"uid": "3", "transaction_flag": true, "account_number": "1111", '
+                                            '"transaction_amount": 5.0, "transaction_date": "2025-06-28"}]')
+        mock_llm_bridge.generate.side_effect = [batch_response, model_output('{"transaction_flag": false}')(stream=True),
+                                                model_output("no json")(stream=True)]
+        mock_client.return_value = mock_llm_bridge
+
+        transaction_handler = TransactionHandler(logging.getLogger("dummy"), model="qwen3:8b")
+        e_mails = [
+            {"uid": str(uid).encode(), "from_address": "alerts@bank.com", "email_date": "2025-06-28T11:47:20",
+             "subject": f"Alert {uid}", "body": "Body"}
+            for uid in range(1, 5)
+        ]
+
+        results = transaction_handler.get_transactions(e_mails, "prompt", batch_size=3)
+
+        assert results[0] == ("<think>Emails [1] and [3] are alerts</think>Two of three.", {"transaction_flag": False})
+        # Left out of the batch answer: retried alone
+        assert results[1] == ("", {"transaction_flag": False})
+        assert results[2][1]["transaction_amount"] == 5.0
+        # Failures of single emails are returned, not raised
+        assert isinstance(results[3], ValueError)
+        calls = mock_llm_bridge.generate.call_args_list
+        assert len(calls) == 3
+        assert calls[0].kwargs["system"] == "prompt"
+        assert "### email uid: 1" in calls[0].kwargs["prompt"] and "### email uid: 3" in calls[0].kwargs["prompt"]
+        assert "Alert 2" in calls[1].kwargs["prompt"] and "Alert 4" in calls[2].kwargs["prompt"]
+
+
+def test_get_transaction_escalates_invalid_output():
+    with patch("fetch_transactions.Client", autospec=True) as mock_client:
+        mock_llm_bridge = MagicMock()
+        mock_llm_bridge.list.return_value.models = [MagicMock(model="small"), MagicMock(model="large")]
+        outputs = {"small": '{"transaction_flag": true, "account_number": "9999"}',
+                   "large": '{"transaction_flag": true, "account_number": "1111"}'}
+        mock_llm_bridge.generate.side_effect = lambda **kwargs: model_output(outputs[kwargs["model"]])(**kwargs)
+        mock_client.return_value = mock_llm_bridge
+        validator = MagicMock()
+        validator.validate.side_effect = lambda e_mail, prediction: None if prediction["account_number"] == "1111" else "unknown account"
+        compactor = MagicMock()
+        compactor.compact.return_value = "Body"
+
+        transaction_handler = TransactionHandler(logging.getLogger("dummy"), model="small", escalation_model="large",
+                                                 validator=validator, compactor=compactor)
+        e_mail = {"uid": b"1", "from_address": "alerts@bank.com", "email_date": "2025-06-28T11:47:20", "subject": "Alert", "body": "Body"}
+
+        assert transaction_handler.get_transaction(e_mail, "prompt")[1]["account_number"] == "1111"
+        assert [c.kwargs["model"] for c in mock_llm_bridge.generate.call_args_list] == ["small", "large"]
+        # The body is compacted once for both models
+        assert compactor.compact.call_count == 1
+
+        # Valid output of the small model is kept
+        outputs["small"] = outputs["large"]
+        mock_llm_bridge.generate.reset_mock()
+        transaction_handler.get_transaction(e_mail, "prompt")
+        assert [c.kwargs["model"] for c in mock_llm_bridge.generate.call_args_list] == ["small"]
+
+
+def test_generation_stops_after_the_json_object():
+    with patch("fetch_transactions.Client", autospec=True) as mock_client:
+        mock_llm_bridge = MagicMock()
+        mock_llm_bridge.list.return_value.models = [MagicMock(model="qwen3:8b")]
+        consumed = []
+
+        def stream():
+            for text in ['<think>{"draft": 1}</think>', 'Not a purchase. {"transaction_flag":', ' false}', " Anything else?"]:
+                consumed.append(text)
+                yield MagicMock(response=text)
+
+        mock_llm_bridge.generate.return_value = stream()
+        mock_client.return_value = mock_llm_bridge
+
+        transaction_handler = TransactionHandler(logging.getLogger("dummy"), model="qwen3:8b")
+        e_mail = {"from_address": "alerts@bank.com", "email_date": "2025-06-28T11:47:20", "subject": "Alert", "body": "Body"}
+
+        llm_reasoning, llm_prediction = transaction_handler.get_transaction(e_mail, "prompt")
+
+        assert llm_prediction == {"transaction_flag": False}
+        assert llm_reasoning == '<think>{"draft": 1}</think>Not a purchase.'
+        assert mock_llm_bridge.generate.call_args.kwargs["stream"] is True
+        assert len(consumed) == 3
+
+
+def test_model_check_is_retried_after_failure():
+    import pytest
+    with patch("fetch_transactions.Client", autospec=True) as mock_client:
+        mock_llm_bridge = MagicMock()
+        models = MagicMock()
+        models.models = [MagicMock(model="flaky-model:1b", digest="abc")]
+        mock_llm_bridge.list.side_effect = [ConnectionError("down"), ConnectionError("down"), models]
+        mock_llm_bridge.generate.side_effect = model_output('{"transaction_flag": false}')
+        mock_client.return_value = mock_llm_bridge
+
+        transaction_handler = TransactionHandler(logging.getLogger("dummy"), model="flaky-model:1b")
+        e_mail = {"from_address": "alerts@bank.com", "email_date": "2025-06-28T11:47:20", "subject": "Alert", "body": "Body"}
+        with pytest.raises(ConnectionError):
+            transaction_handler.get_transaction(e_mail, "rules prompt")
+        # Within the backoff period the stored error is raised without checking again
+        with pytest.raises(ConnectionError):
+            transaction_handler.get_transaction(e_mail, "rules prompt")
+        assert mock_llm_bridge.list.call_count == 2
+
+        transaction_handler.ready_retry_at = 0
+        assert transaction_handler.get_transaction(e_mail, "rules prompt")[1] == {"transaction_flag": False}
+        assert transaction_handler.ready_error is None
+
+
+def test_streamed_generation_is_cut_off_after_timeout():
+    import pytest
+    import time
+    with patch("fetch_transactions.Client", autospec=True) as mock_client:
+        mock_llm_bridge = MagicMock()
+        mock_llm_bridge.list.return_value.models = [MagicMock(model="qwen3:8b")]
+        closed = []
+
+        def endless_thinking(**kwargs):
+            try:
+                yield MagicMock(response="<think>")
+                while True:
+                    time.sleep(0.01)
+                    yield MagicMock(response="hmm ")
+            finally:
+                closed.append(True)
+        mock_llm_bridge.generate.side_effect = endless_thinking
+        mock_client.return_value = mock_llm_bridge
+
+        transaction_handler = TransactionHandler(logging.getLogger("dummy"), model="qwen3:8b", timeout=0.1)
+        e_mail = {"from_address": "alerts@bank.com", "email_date": "2025-06-28T11:47:20", "subject": "Alert", "body": "Body"}
+        with pytest.raises(TimeoutError):
+            transaction_handler.get_transaction(e_mail, "rules prompt")
+        assert closed == [True]
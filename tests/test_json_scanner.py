@@ -0,0 +1,45 @@
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
+
+import json
+from json_scanner import JSONObjectScanner
+
+def scan(text, chunk_size):
+    scanner = JSONObjectScanner()
+    for i in range(0, len(text), chunk_size):
+        if scanner.feed(text[i:i + chunk_size]):
+            break
+    return scanner
+
+def test_finds_nested_object_after_think_block():
+    text = ('<think>Draft: {"transaction_flag": false}</think>\nThe charge is {shown} below.\n'
+            '{"transaction_flag": true, "details": {"merchant": "A}B \\"C\\""}} trailing {"x": 1}')
+    for chunk_size in (1, 3, 7, len(text)):
+        scanner = scan(text, chunk_size)
+        assert json.loads(scanner.json_text) == {"transaction_flag": True, "details": {"merchant": 'A}B "C"'}}
+        assert scanner.reasoning.startswith("<think>") and scanner.reasoning.endswith("below.")
+
+def test_stops_at_the_end_of_the_object():
+    scanner = JSONObjectScanner()
+    assert not scanner.feed('Answer: {"a": ')
+    assert scanner.feed('1} and more')
+    assert scanner.text[:scanner.end] == 'Answer: {"a": 1}'
+    assert scanner.feed("ignored")
+
+def test_no_object():
+    for text in ('<think>{"a": 1}', '{"a": 1', "no json", "a <thin"):
+        scanner = scan(text, 2)
+        assert scanner.json_text is None
+        assert scanner.reasoning == text.strip()
+
+def test_finds_array_after_think_block():
+    text = '<think>Emails [1] and [2] look like {"purchases"}, see [x]</think>\n[{"uid": "1", "a": [1, 2]}, {"uid": "2"}] done'
+    for chunk_size in (1, 4, len(text)):
+        scanner = JSONObjectScanner(opening="[")
+        for i in range(0, len(text), chunk_size):
+            if scanner.feed(text[i:i + chunk_size]):
+                break
+        assert json.loads(scanner.json_text) == [{"uid": "1", "a": [1, 2]}, {"uid": "2"}]
+        assert scanner.reasoning.endswith("</think>")
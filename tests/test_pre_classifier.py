@@ -0,0 +1,58 @@
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
+
+import logging
+from unittest.mock import patch, MagicMock
+from pre_classifier import SubjectClassifier, ModelClassifier
+
+RULES = {
+    "credit_cards": {
+        "chase": {
+            "from_address": ["no.reply.alerts@chase.com"],
+            "subject": ["You made a $XX.XX transaction with X"],
+        },
+        "citi": {
+            "from_address": ["alerts@info6.citi.com"],
+            "subject": ["A $X transaction was made on your Costco Anywhere account"],
+        },
+        "other": {
+            "from_address": ["alerts@other.com"],
+        }
+    }
+}
+
+def make_email(from_address, subject):
+    return {"uid": b"1", "from_address": from_address, "subject": subject, "body": "Body"}
+
+def test_subject_classifier():
+    classifier = SubjectClassifier(RULES)
+
+    assert classifier.classify(make_email("Chase <no.reply.alerts@chase.com>", "You made a $12.34 transaction with ACME"))[0]
+    assert classifier.classify(make_email("alerts@info6.citi.com", "A $5.00 transaction was made on your Costco Anywhere account"))[0]
+    candidate, reason = classifier.classify(make_email("no.reply.alerts@chase.com", "Your statement is ready"))
+    assert not candidate and "statement" in reason
+    # No subject patterns for the sender: nothing is rejected
+    assert classifier.classify(make_email("alerts@other.com", "Anything"))[0]
+
+def test_subject_classifier_hands_matches_to_next_classifier():
+    next_classifier = MagicMock()
+    next_classifier.classify.return_value = (False, "not a purchase")
+    classifier = SubjectClassifier(RULES, next_classifier=next_classifier)
+
+    assert classifier.classify(make_email("no.reply.alerts@chase.com", "You made a $1.00 transaction with ACME")) == (False, "not a purchase")
+    classifier.classify(make_email("no.reply.alerts@chase.com", "Your statement is ready"))
+    next_classifier.classify.assert_called_once()
+
+def test_model_classifier():
+    with patch("pre_classifier.Client", autospec=True) as mock_client:
+        mock_llm_bridge = MagicMock()
+        mock_llm_bridge.generate.return_value.response = '{"purchase": false}'
+        mock_client.return_value = mock_llm_bridge
+        classifier = ModelClassifier(logging.getLogger("dummy"), "qwen3:0.6b")
+
+        assert classifier.classify(make_email("alerts@other.com", "Statement"))[0] is False
+        # Failures let the email through
+        mock_llm_bridge.generate.side_effect = ConnectionError("refused")
+        assert classifier.classify(make_email("alerts@other.com", "Statement"))[0] is True
@@ -0,0 +1,38 @@
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
+
+from prediction_validator import PredictionValidator
+
+RULES = {
+    "credit_cards": {
+        "chase": {
+            "financial_institution": "chase",
+            "from_address": ["no.reply.alerts@chase.com"],
+            "account_numbers": [1111, 2222],
+        }
+    }
+}
+E_MAIL = {"uid": b"1", "from_address": "Chase <no.reply.alerts@chase.com>", "email_date": "2025-06-28T11:47:20"}
+VALID = {"transaction_flag": True, "account_number": "1111", "transaction_amount": "1,234.50",
+         "transaction_date": "06/27/2025", "merchant": "ACME"}
+
+def test_valid_predictions():
+    validator = PredictionValidator(RULES)
+
+    assert validator.validate(E_MAIL, VALID) is None
+    assert validator.validate(E_MAIL, dict(VALID, transaction_date="2025-06-28T23:10:00")) is None
+    assert validator.validate(E_MAIL, {"transaction_flag": False}) is None
+
+def test_invalid_predictions():
+    validator = PredictionValidator(RULES)
+
+    assert "transaction_flag" in validator.validate(E_MAIL, {"transaction_flag": "yes"})
+    assert "not a number" in validator.validate(E_MAIL, dict(VALID, transaction_amount="twelve"))
+    assert "not positive" in validator.validate(E_MAIL, dict(VALID, transaction_amount=0))
+    assert "account" in validator.validate(E_MAIL, dict(VALID, account_number="9999"))
+    assert "account" in validator.validate(dict(E_MAIL, from_address="other@bank.com"), VALID)
+    assert "does not parse" in validator.validate(E_MAIL, dict(VALID, transaction_date="yesterday"))
+    assert "too far" in validator.validate(E_MAIL, dict(VALID, transaction_date="2024-06-27"))
+    assert "merchant" in validator.validate(E_MAIL, dict(VALID, merchant=" "))
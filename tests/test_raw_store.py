@@ -0,0 +1,33 @@
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
+
+import os
+from raw_store import RawEmailStore
+
+def test_put_and_get(tmp_path):
+    store = RawEmailStore(str(tmp_path))
+    sha256 = store.put("INBOX", 7, b"12", b"Subject: Test\r\n\r\nBody")
+
+    assert store.get(sha256) == b"Subject: Test\r\n\r\nBody"
+    assert os.path.exists(store.object_path(sha256))
+
+def test_identical_content_is_stored_once(tmp_path):
+    store = RawEmailStore(str(tmp_path))
+    first = store.put("INBOX", 7, b"1", b"same bytes")
+    second = store.put("Alerts", 3, b"9", b"same bytes")
+
+    assert first == second
+    objects = [f for _, _, files in os.walk(tmp_path / "objects") for f in files]
+    assert len(objects) == 1
+
+def test_iter_emails_orders_and_deduplicates(tmp_path):
+    store = RawEmailStore(str(tmp_path))
+    store.put("user@example.com/INBOX", 7, b"3", b"third")
+    store.put("user@example.com/INBOX", 7, b"1", b"first")
+    store.put("user@example.com/INBOX", 7, b"3", b"third again")
+    store.put("Other", 7, b"2", b"other folder")
+
+    assert list(store.iter_emails("user@example.com/INBOX")) == [(7, 1, b"first"), (7, 3, b"third again")]
+    assert list(store.iter_emails("Missing")) == []
@@ -0,0 +1,65 @@
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
+
+from rule_extractor import RuleExtractor
+
+RULES = {
+    "credit_cards": {
+        "bank_a": {
+            "financial_institution": "bank a",
+            "from_address": ["Alerts@BankA.com"],
+            "subject": ["Purchase alert"],
+            "account_numbers": ["1111", "2222"],
+            "extraction": {
+                "subject": "purchase alert",
+                "amount": r"Amount:\s*\$([\d,]+\.\d{2})",
+                "merchant": r"Merchant:\s*(?P<value>.+)",
+                "account_number": r"card ending in (\d{4})",
+                "date": r"Date:\s*(\w+ \d{1,2})",
+            }
+        },
+        "bank_b": {
+            "financial_institution": "bank b",
+            "from_address": ["alerts@bankb.com"],
+            "subject": ["Transaction"],
+            "account_numbers": ["3333"],
+        }
+    }
+}
+
+def make_email(body, subject="Purchase alert", from_address="Bank A <alerts@banka.com>"):
+    return {"from_address": from_address, "subject": subject, "email_date": "2025-01-03T09:00:00-05:00", "body": body}
+
+def test_extracts_matching_email():
+    extractor = RuleExtractor(RULES)
+    body = "Your card ending in 2222 was charged.\nMerchant: ACME Store \nAmount: $1,234.50\nDate: Dec 30"
+
+    financial_institution, prediction = extractor.extract(make_email(body))
+
+    assert financial_institution == "bank a"
+    assert prediction == {
+        "account_number": "2222",
+        "transaction_amount": 1234.5,
+        # No year in the alert: the most recent Dec 30 before the email
+        "transaction_date": "2024-12-30T00:00:00",
+        "merchant": "ACME Store",
+        "transaction_flag": True
+    }
+
+def test_falls_back_when_patterns_miss_or_values_do_not_validate():
+    extractor = RuleExtractor(RULES)
+    body = "Your card ending in 2222 was charged.\nMerchant: ACME\nAmount: $5.00\nDate: Jan 2"
+
+    assert extractor.extract(make_email(body)) is not None
+    # Subject does not match (e.g. a payment notice)
+    assert extractor.extract(make_email(body, subject="Payment received")) is None
+    # Account number not configured
+    assert extractor.extract(make_email(body.replace("2222", "9999"))) is None
+    # Missing merchant
+    assert extractor.extract(make_email(body.replace("Merchant: ACME\n", ""))) is None
+    # Unparsable date
+    assert extractor.extract(make_email(body.replace("Jan 2", "Foo 2"))) is None
+    # Institutions without patterns always go to the model
+    assert extractor.extract(make_email(body, from_address="alerts@bankb.com")) is None
@@ -0,0 +1,25 @@
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
+
+from db import DB
+from spend_report import spend_report
+
+
+def test_spend_report_rebuilds_rollups(tmp_path):
+    db_file = str(tmp_path / "finances.db")
+    db = DB(db_file)
+    db.bootstrap(accounts=[{'account_number': '1111', 'financial_institution': 'Bank A'}])
+    # Inserted by hand, bypassing the rollups
+    db.con.execute("""
+        INSERT INTO fact_transactions (transaction_date, transaction_amount, merchant, account_id)
+        VALUES ('2025-06-01 10:00:00', 5.0, 'ACME', 1)
+    """)
+    db.con.close()
+
+    assert spend_report(db_file, by=['account']) == []
+    rows = spend_report(db_file, grain='day', by=['account'], rebuild=True)
+    assert [(r['period_start'].isoformat(), r['account_number'], r['total_amount']) for r in rows] == [
+        ('2025-06-01', '1111', 5.0)
+    ]
@@ -0,0 +1,68 @@
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
+
+from template_learner import TemplateLearner
+
+RULES = {
+    "credit_cards": {
+        "bank_a": {
+            "financial_institution": "bank a",
+            "from_address": ["alerts@banka.com"],
+            "account_numbers": ["1111", "2222"],
+        }
+    }
+}
+
+def make_email(merchant, amount, account="1111", date="06/28/2025", subject="Purchase of $XX"):
+    body = "\n".join([
+        "Bank A",
+        f"A charge of ${amount} at {merchant} was made on your card ending in {account}.",
+        f"Transaction date: {date}",
+        "You are receiving this email because you enrolled in alerts.",
+    ])
+    return {"uid": b"1", "from_address": "Bank A <alerts@banka.com>", "subject": subject.replace("XX", amount),
+            "email_date": "2025-06-28T10:00:00-04:00", "body": body}
+
+def prediction(merchant, amount, account="1111", date="2025-06-28T00:00:00"):
+    return {"account_number": account, "transaction_amount": float(amount.replace(",", "")), "transaction_date": date,
+            "merchant": merchant, "transaction_flag": True}
+
+def test_learns_template_and_applies_it_to_similar_emails():
+    learner = TemplateLearner(RULES)
+    first = make_email("ACME", "12.50")
+    assert learner.match(first) == (None, False)
+    learner.learn(first, prediction("ACME", "12.50"))
+
+    predicted, spot_check = learner.match(make_email("Corner Cafe & Bakery", "1,204.99", account="2222", date="07/01/2025"))
+    assert not spot_check
+    assert predicted == prediction("Corner Cafe & Bakery", "1,204.99", account="2222", date="2025-07-01T00:00:00")
+
+def test_does_not_learn_values_missing_from_body():
+    learner = TemplateLearner(RULES)
+    first = make_email("ACME", "12.50")
+    # The model normalized the merchant name, which cannot be located in the body
+    learner.learn(first, prediction("Acme Corporation", "12.50"))
+    assert learner.match(first) == (None, False)
+
+def test_spot_check_drops_template_on_disagreement():
+    learner = TemplateLearner(RULES, spot_check_every=2)
+    learner.learn(make_email("ACME", "12.50"), prediction("ACME", "12.50"))
+
+    assert learner.match(make_email("ACME", "3.00")) == (prediction("ACME", "3.00"), False)
+    e_mail = make_email("ACME", "4.00")
+    templated, spot_check = learner.match(e_mail)
+    assert spot_check
+    learner.learn(e_mail, prediction("ACME", "4.00", account="2222"), templated)
+    assert learner.match(make_email("ACME", "5.00")) == (None, False)
+
+def test_remembers_non_transactions_per_signature():
+    learner = TemplateLearner(RULES)
+    statement = {"uid": b"2", "from_address": "alerts@banka.com", "subject": "Your June statement",
+                 "email_date": "2025-06-28T10:00:00", "body": "Your statement is ready.\nBalance: $1,000.00"}
+    learner.learn(statement, {"transaction_flag": False})
+
+    assert learner.match(dict(statement, body="Your statement is ready.\nBalance: $9.00")) == ({"transaction_flag": False}, False)
+    # Different layout
+    assert learner.match(make_email("ACME", "12.50")) == (None, False)
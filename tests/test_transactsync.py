@@ -7,9 +7,65 @@ if os.path.abspath(str(Path(__file__).parent.parent / "src")) not in sys.path:
     sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
 print(sys.path)
 
+import time
+import tempfile
+import threading
 import unittest
 from unittest.mock import patch, MagicMock
-from main import transactsync
+from main import transactsync, run_daemon, sync_folders, checkpoint_key, split_watched_folders, ExtractionError
+
+
+def make_email(uid, from_address="sender@example.com"):
+    return {
+        "uid": str(uid).encode(),
+        "subject": "Test Subject",
+        "email_date": "2025-06-28T11:47:20",
+        "from_address": f"<{from_address}>",
+        "to_address": "<recipient@example.com>",
+        "body": "This is a test email body."
+    }
+
+
+def make_email_handler(uids, last_scanned_uid=None, error=None, delay=0, tracker=None, uidvalidity=None,
+                       uidvalidity_changed=False, highestmodseq=None):
+    email_handler = MagicMock()
+    email_handler.fetch_batch_size = 10
+    email_handler.last_scanned_uid = last_scanned_uid
+    email_handler.uidvalidity = uidvalidity
+    email_handler.uidvalidity_changed = uidvalidity_changed
+    email_handler.highestmodseq = highestmodseq
+
+    def iter_emails(last_seen_uid=None, uidvalidity=None, highestmodseq=None):
+        if tracker is not None:
+            with tracker["lock"]:
+                tracker["active"] += 1
+                tracker["max_active"] = max(tracker["max_active"], tracker["active"])
+        try:
+            for uid in uids:
+                time.sleep(delay)
+                yield make_email(uid)
+            if error:
+                raise error
+        finally:
+            if tracker is not None:
+                with tracker["lock"]:
+                    tracker["active"] -= 1
+    email_handler.iter_emails.side_effect = iter_emails
+    return email_handler
+
+
+def make_db(checkpoints=None):
+    checkpoints = dict(checkpoints or {})
+    db_mock = MagicMock()
+    db_mock.get_checkpoint.side_effect = lambda key: {"last_seen_uid": checkpoints[key]} if key in checkpoints else None
+    db_mock.set_last_seen_uid.side_effect = lambda key, uid, **kwargs: checkpoints.__setitem__(key, uid)
+    return db_mock, checkpoints
+
+
+def non_transaction_handler():
+    transaction_handler = MagicMock()
+    transaction_handler.get_transaction.return_value = ("reasoning", {"transaction_flag": False})
+    return transaction_handler
 
 class TestMain(unittest.TestCase):
 
@@ -30,7 +86,12 @@ class TestMain(unittest.TestCase):
     def test_transactsync(self, mock_prompt_builder, mock_yaml_safe_load, MockDB, MockTransactionHandler, MockEmailHandler):
         # Mock EmailHandler
         email_handler_mock = MockEmailHandler.return_value
-        email_handler_mock.get_emails.return_value = [
+        email_handler_mock.last_scanned_uid = 1
+        email_handler_mock.fetch_batch_size = 100
+        email_handler_mock.uidvalidity = 7
+        email_handler_mock.uidvalidity_changed = False
+        email_handler_mock.highestmodseq = 42
+        email_handler_mock.iter_emails.return_value = iter([
             {
                 "uid": "1",
                 "subject": "Test Subject",
@@ -39,7 +100,7 @@ class TestMain(unittest.TestCase):
                 "to_address": "<recipient@example.com>",
                 "body": "This is a test email body."
             }
-        ]
+        ])
 
         # Mock TransactionHandler
         transaction_handler_mock = MockTransactionHandler.return_value
@@ -59,7 +120,7 @@ class TestMain(unittest.TestCase):
         db_mock = MockDB.return_value
         db_mock.get_account_ids_dict.return_value = {('Bank A', '123456789'): 1}
         db_mock.save_transaction = MagicMock()
-        db_mock.get_last_seen_uid.return_value = None
+        db_mock.get_checkpoint.return_value = None
         db_mock.set_last_seen_uid = MagicMock()
 
         # Call the main function (no ckpt_file argument needed)
@@ -75,12 +136,12 @@ class TestMain(unittest.TestCase):
         )
 
         # Debug prints to verify the call arguments
-        print(f"Called with args: {email_handler_mock.get_emails.call_args.args}")
-        print(f"Called with kwargs: {email_handler_mock.get_emails.call_args.kwargs}")
+        print(f"Called with args: {email_handler_mock.iter_emails.call_args.args}")
+        print(f"Called with kwargs: {email_handler_mock.iter_emails.call_args.kwargs}")
 
         # Assertions
-        assert 'last_seen_uid' in email_handler_mock.get_emails.call_args.kwargs, "last_seen_uid not found in call arguments"
-        args, kwargs = email_handler_mock.get_emails.call_args
+        assert 'last_seen_uid' in email_handler_mock.iter_emails.call_args.kwargs, "last_seen_uid not found in call arguments"
+        args, kwargs = email_handler_mock.iter_emails.call_args
         transaction_handler_mock.get_transaction.assert_called_once_with(
             {
                 "uid": "1",
@@ -110,6 +171,286 @@ class TestMain(unittest.TestCase):
                 "transaction_flag": True,
                 "account_number": "123456789"
             },
-            account_id = 1
+            account_id = 1,
+            replace = False
+        )
+        db_mock.set_last_seen_uid.assert_called_with("INBOX", 1, uidvalidity=7, highestmodseq=42)
+
+
+    @patch('main.time.sleep')
+    def test_run_daemon_reconnects_and_renews_idle(self, mock_sleep):
+        email_handler = MagicMock()
+        email_handler.imapb = None
+
+        def imap_bridge():
+            email_handler.imapb = MagicMock()
+        email_handler.imap_bridge.side_effect = imap_bridge
+
+        def close():
+            email_handler.imapb = None
+        email_handler.close.side_effect = close
+
+        # new email, IDLE timeout, dropped connection, new email, then stop
+        email_handler.idle.side_effect = [True, False, OSError("connection reset"), True, KeyboardInterrupt]
+        sync = MagicMock(return_value=0)
+
+        with self.assertRaises(KeyboardInterrupt):
+            run_daemon(email_handler, sync, idle_timeout=5)
+
+        # initial sync, after the first notification, after reconnecting and after the last notification
+        assert sync.call_count == 4
+        assert email_handler.imap_bridge.call_count == 2
+        mock_sleep.assert_called_once_with(1)
+
+
+    def test_sync_folders_keeps_per_folder_checkpoints(self):
+        db_mock, checkpoints = make_db({"INBOX": 4})
+        email_handlers = {
+            "INBOX": make_email_handler([5, 6], last_scanned_uid=9),
+            "Alerts": make_email_handler([1, 2, 3]),
+        }
+
+        processed = sync_folders(email_handlers, non_transaction_handler(), db_mock, "prompt", {}, {}, max_connections=2)
+
+        assert processed == 5
+        assert checkpoints == {"INBOX": 9, "Alerts": 3}
+        email_handlers["INBOX"].iter_emails.assert_called_once_with(last_seen_uid=4, uidvalidity=None, highestmodseq=None)
+        email_handlers["Alerts"].iter_emails.assert_called_once_with(last_seen_uid=None, uidvalidity=None, highestmodseq=None)
+
+    @patch('main.DB.email_content_hash', side_effect=lambda e_mail: f"hash-{int(e_mail['uid'])}")
+    def test_sync_folders_skips_stored_emails_after_uidvalidity_change(self, mock_email_content_hash):
+        db_mock, checkpoints = make_db({"INBOX": 50})
+        db_mock.get_stored_email_ids.return_value = {"hash-2"}
+        transaction_handler = non_transaction_handler()
+        email_handlers = {"INBOX": make_email_handler([1, 2, 3], last_scanned_uid=3, uidvalidity=8,
+                                                      uidvalidity_changed=True, highestmodseq=100)}
+
+        processed = sync_folders(email_handlers, transaction_handler, db_mock, "prompt", {}, {})
+
+        assert processed == 2
+        assert [int(c.args[0]["uid"]) for c in transaction_handler.get_transaction.call_args_list] == [1, 3]
+        db_mock.get_stored_email_ids.assert_called_once_with("INBOX")
+        # The checkpoint starts over with the new UIDVALIDITY
+        assert checkpoints == {"INBOX": 3}
+        db_mock.set_last_seen_uid.assert_called_with("INBOX", 3, uidvalidity=8, highestmodseq=100)
+
+    def test_sync_folders_continues_when_one_folder_fails(self):
+        db_mock, checkpoints = make_db()
+        email_handlers = {
+            "Broken": make_email_handler([1], error=RuntimeError("Failed to retrieve emails")),
+            "Alerts": make_email_handler([7, 8]),
+        }
+
+        with self.assertRaises(RuntimeError) as ctx:
+            sync_folders(email_handlers, non_transaction_handler(), db_mock, "prompt", {}, {}, max_connections=2)
+
+        assert "Broken" in str(ctx.exception)
+        # Emails received before the failure are still checkpointed
+        assert checkpoints == {"Broken": 1, "Alerts": 8}
+
+    def test_sync_folders_respects_max_connections(self):
+        db_mock, _ = make_db()
+        tracker = {"lock": threading.Lock(), "active": 0, "max_active": 0}
+        email_handlers = {f"Folder{i}": make_email_handler([1, 2], delay=0.05, tracker=tracker) for i in range(5)}
+
+        processed = sync_folders(email_handlers, non_transaction_handler(), db_mock, "prompt", {}, {}, max_connections=2)
+
+        assert processed == 10
+        assert tracker["max_active"] == 2
+
+    def test_sync_folders_extracts_concurrently_and_stores_in_uid_order(self):
+        db_mock, checkpoints = make_db()
+        tracker = {"lock": threading.Lock(), "active": 0, "max_active": 0}
+        stored = []
+        db_mock.set_last_seen_uid.side_effect = lambda key, uid, **kwargs: (stored.append(uid), checkpoints.__setitem__(key, uid))
+
+        def get_transaction(e_mail, llm_prompt):
+            with tracker["lock"]:
+                tracker["active"] += 1
+                tracker["max_active"] = max(tracker["max_active"], tracker["active"])
+            # Later emails finish first
+            time.sleep(0.02 * (10 - int(e_mail["uid"])))
+            with tracker["lock"]:
+                tracker["active"] -= 1
+            return "reasoning", {"transaction_flag": False}
+
+        transaction_handler = MagicMock()
+        transaction_handler.get_transaction.side_effect = get_transaction
+        email_handlers = {"INBOX": make_email_handler(list(range(1, 10)), last_scanned_uid=12)}
+
+        processed = sync_folders(email_handlers, transaction_handler, db_mock, "prompt", {}, {}, llm_concurrency=3)
+
+        assert processed == 9
+        assert tracker["max_active"] == 3
+        assert stored == list(range(1, 10)) + [12]
+        assert checkpoints == {"INBOX": 12}
+
+    def test_sync_folders_batches_emails_and_stores_in_uid_order(self):
+        db_mock, checkpoints = make_db()
+        stored = []
+        db_mock.set_last_seen_uid.side_effect = lambda key, uid, **kwargs: (stored.append(uid), checkpoints.__setitem__(key, uid))
+        batches = []
+
+        def get_transactions(e_mails, llm_prompt, batch_size, batch_tokens):
+            batches.append([int(e_mail["uid"]) for e_mail in e_mails])
+            return [("reasoning", {"transaction_flag": False}) if int(e_mail["uid"]) != 2 else ValueError("no JSON")
+                    for e_mail in e_mails]
+
+        transaction_handler = MagicMock()
+        transaction_handler.get_transactions.side_effect = get_transactions
+        email_handlers = {"INBOX": make_email_handler(list(range(1, 8)), last_scanned_uid=9)}
+
+        processed = sync_folders(email_handlers, transaction_handler, db_mock, "prompt", {}, {}, llm_batch_size=3)
+
+        assert processed == 7
+        assert all(len(batch) <= 3 for batch in batches)
+        assert sorted(uid for batch in batches for uid in batch) == list(range(1, 8))
+        transaction_handler.get_transaction.assert_not_called()
+        # The email whose extraction failed is skipped and checkpointed like the others
+        assert stored == list(range(1, 8)) + [9]
+        assert checkpoints == {"INBOX": 9}
+
+    def test_checkpoint_key(self):
+        assert checkpoint_key("INBOX") == "INBOX"
+        assert checkpoint_key("INBOX", "other@example.com") == "other@example.com/INBOX"
+
+    def test_split_watched_folders(self):
+        email_handlers = {f"Folder{i}": MagicMock() for i in range(5)}
+        idle, polled = split_watched_folders(email_handlers, 3)
+        assert list(idle) == ["Folder0", "Folder1"]
+        assert list(polled) == ["Folder2", "Folder3", "Folder4"]
+
+        idle, polled = split_watched_folders(email_handlers, 5)
+        assert len(idle) == 5 and not polled
+
+    @patch('main.EmailHandler')
+    @patch('main.TransactionHandler')
+    @patch('main.DB')
+    @patch('main.prompt_builder', return_value="Mock prompt")
+    def test_transactsync_with_folders_and_mailboxes_file(self, mock_prompt_builder, MockDB, MockTransactionHandler, MockEmailHandler):
+        MockEmailHandler.side_effect = lambda *args, **kwargs: make_email_handler([])
+        db_mock, _ = make_db()
+        MockDB.return_value = db_mock
+
+        with tempfile.NamedTemporaryFile("w", suffix=".yaml", delete=False) as mailboxes_file:
+            mailboxes_file.write(
+                "mailboxes:\n"
+                "  - email_host: imap.other.com\n"
+                "    email_port: 993\n"
+                "    username: other@example.com\n"
+                "    password: secret\n"
+                "    folders: [INBOX, Bank]\n"
+            )
+
+        transactsync(
+            email_host="imap.example.com",
+            email_port=143,
+            username="user",
+            password="pass",
+            folder="INBOX, Alerts",
+            transaction_rules="tests/transaction_rules.yaml",
+            db_file="test_db.duckdb",
+            prompt_file="prompt.txt",
+            mailboxes_file=mailboxes_file.name
         )
-        db_mock.set_last_seen_uid.assert_called_with("INBOX", 1)
+        os.unlink(mailboxes_file.name)
+
+        opened = [(c.args[1], c.args[3], c.args[5]) for c in MockEmailHandler.call_args_list]
+        assert opened == [
+            ("imap.example.com", "user", "INBOX"),
+            ("imap.example.com", "user", "Alerts"),
+            ("imap.other.com", "other@example.com", "INBOX"),
+            ("imap.other.com", "other@example.com", "Bank"),
+        ]
+        checked = [c.args[0] for c in db_mock.get_checkpoint.call_args_list]
+        assert checked == ["INBOX", "Alerts", "other@example.com/INBOX", "other@example.com/Bank"]
+
+    @patch('main.time.sleep')
+    def test_run_daemon_survives_failed_sync_without_reconnecting(self, mock_sleep):
+        email_handler = MagicMock()
+        email_handler.idle.side_effect = [True, KeyboardInterrupt]
+        # e.g. the model host is unreachable
+        sync = MagicMock(side_effect=[Exception("Ollama unreachable"), 3])
+
+        with self.assertRaises(KeyboardInterrupt):
+            run_daemon(email_handler, sync, idle_timeout=5)
+
+        assert sync.call_count == 2
+        email_handler.close.assert_not_called()
+        mock_sleep.assert_not_called()
+
+    def test_sync_folders_skips_email_with_unparsable_model_output(self):
+        db_mock, checkpoints = make_db()
+        transaction_handler = MagicMock()
+        transaction_handler.get_transaction.side_effect = [
+            ValueError("No JSON object found in model output."),
+            ("reasoning", {"transaction_flag": False}),
+        ]
+
+        processed = sync_folders({"INBOX": make_email_handler([1, 2])}, transaction_handler, db_mock, "prompt", {}, {})
+
+        assert processed == 2
+        assert checkpoints == {"INBOX": 2}
+
+    def test_sync_folders_reports_lost_connections_as_connection_error(self):
+        db_mock, _ = make_db()
+        email_handlers = {"INBOX": make_email_handler([], error=OSError("connection reset"))}
+
+        with self.assertRaises(ConnectionError):
+            sync_folders(email_handlers, non_transaction_handler(), db_mock, "prompt", {}, {})
+
+    @patch('main.time.sleep')
+    def test_unreachable_model_is_not_taken_for_a_lost_email_connection(self, mock_sleep):
+        db_mock, checkpoints = make_db()
+        transaction_handler = MagicMock()
+        # The ollama client raises the builtin ConnectionError, an OSError like socket errors
+        transaction_handler.get_transaction.side_effect = ConnectionError("Ollama unreachable")
+        email_handler = make_email_handler([1])
+
+        with self.assertRaises(ExtractionError):
+            sync_folders({"INBOX": email_handler}, transaction_handler, db_mock, "prompt", {}, {})
+        assert checkpoints == {}
+
+        email_handler.idle.side_effect = [True, KeyboardInterrupt]
+        with self.assertRaises(KeyboardInterrupt):
+            run_daemon(email_handler, lambda: sync_folders({"INBOX": email_handler}, transaction_handler, db_mock,
+                                                           "prompt", {}, {}), idle_timeout=5)
+        # Not reconnected
+        email_handler.close.assert_not_called()
+
+    @patch('main.EmailHandler')
+    @patch('main.TransactionHandler')
+    @patch('main.DB')
+    @patch('main.prompt_builder', return_value="Mock prompt")
+    def test_transactsync_reprocess_replays_raw_store(self, mock_prompt_builder, MockDB, MockTransactionHandler, MockEmailHandler):
+        from raw_store import RawEmailStore
+        from fetch_emails import EmailHandler
+        MockEmailHandler.parse_email.side_effect = EmailHandler.parse_email
+        db_mock, checkpoints = make_db()
+        MockDB.return_value = db_mock
+        MockTransactionHandler.return_value = non_transaction_handler()
+
+        with tempfile.TemporaryDirectory() as raw_store:
+            store = RawEmailStore(raw_store)
+            store.put("INBOX", 7, b"1", b"From: sender@example.com\r\nSubject: Alert\r\nDate: Wed, 28 Jun 2025 11:47:20 -0400\r\n\r\nBody")
+            store.put("INBOX", 7, b"2", b"From: news@shop.com\r\nSubject: Sale\r\nDate: Wed, 28 Jun 2025 11:47:20 -0400\r\n\r\nBody")
+
+            transactsync(
+                email_host="imap.example.com",
+                email_port=143,
+                username="user",
+                password="pass",
+                folder="INBOX",
+                transaction_rules="tests/transaction_rules.yaml",
+                db_file="test_db.duckdb",
+                prompt_file="prompt.txt",
+                raw_store=raw_store,
+                reprocess=True
+            )
+
+        # Only the email from a known sender reaches the model, and nothing is fetched or checkpointed
+        transaction_handler = MockTransactionHandler.return_value
+        assert transaction_handler.get_transaction.call_count == 1
+        assert transaction_handler.get_transaction.call_args.args[0]["subject"] == "Alert"
+        MockEmailHandler.return_value.iter_emails.assert_not_called()
+        assert checkpoints == {}